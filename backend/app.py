@@ -1,13 +1,66 @@
 import os
 import sys
-from flask import Flask, jsonify, request, send_from_directory
+import threading
+import time
+from datetime import datetime
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import NotFound
 
 # 開発時とEXE実行時の両方に対応
 try:
     from backend.models import db, Address, Group, EmailTemplate, GlobalVariable, AttributeDefinition
+    from backend.importer import import_records, iter_text_records, iter_json_records, open_text_stream
+    from backend.membership import (group_members_json, template_recipients_json, members_by_group,
+                                    recipients_by_template, groups_for_address, VersionConflict)
+    from backend.migrations import upgrade
+    from backend.pagination import paginate, ordered, parse_limit, apply_search, NEXT_CURSOR_HEADER
+    from backend import search as fulltext
+    from backend.cache import ResponseCache, COLLECTIONS
+    from backend import changes as changelog
+    from backend.render import CompiledTemplate, template_cache, build_values, load_globals_map
+    from backend.mailmerge import iter_merged, parse_workers
+    from backend.recipients import resolve_recipients, MAX_SOURCES, MAX_ADDRESSES
+    from backend.eml import build_eml, iter_zip, iter_eml_entries, validate_recipients, InvalidAddress
+    import backend.storage as storage
+    from backend.storage import read_only
+    from backend.static_assets import StaticAssets
+    from backend import metrics as instrumentation
+    from backend import mutations
+    from backend import dispatch
+    from backend.variables import find_usages
+    from backend.dedup import dedupe_addresses
+    from backend.export import FORMATS as EXPORT_FORMATS, export_statement, iter_rows, iter_export
+    from backend.serialization import (FastJSONProvider, dumps, batched, iter_json_array, iter_ndjson,
+                                       iter_json_object, stream_response, estimated_rows, STREAM_BATCH,
+                                       STREAM_MIN_ROWS, NDJSON_MIMETYPE)
 except ModuleNotFoundError:
     from models import db, Address, Group, EmailTemplate, GlobalVariable, AttributeDefinition
+    from importer import import_records, iter_text_records, iter_json_records, open_text_stream
+    from membership import (group_members_json, template_recipients_json, members_by_group,
+                            recipients_by_template, groups_for_address, VersionConflict)
+    from migrations import upgrade
+    from pagination import paginate, ordered, parse_limit, apply_search, NEXT_CURSOR_HEADER
+    import search as fulltext
+    from cache import ResponseCache, COLLECTIONS
+    import changes as changelog
+    from render import CompiledTemplate, template_cache, build_values, load_globals_map
+    from mailmerge import iter_merged, parse_workers
+    from recipients import resolve_recipients, MAX_SOURCES, MAX_ADDRESSES
+    from eml import build_eml, iter_zip, iter_eml_entries, validate_recipients, InvalidAddress
+    import storage
+    from storage import read_only
+    from static_assets import StaticAssets
+    import metrics as instrumentation
+    import mutations
+    import dispatch
+    from variables import find_usages
+    from dedup import dedupe_addresses
+    from export import FORMATS as EXPORT_FORMATS, export_statement, iter_rows, iter_export
+    from serialization import (FastJSONProvider, dumps, batched, iter_json_array, iter_ndjson,
+                               iter_json_object, stream_response, estimated_rows, STREAM_BATCH,
+                               STREAM_MIN_ROWS, NDJSON_MIMETYPE)
 
 # PyInstaller実行時は_MEIPASSを使用、通常実行時はカレントディレクトリ
 if getattr(sys, 'frozen', False):
@@ -22,276 +75,773 @@ else:
 # data.dbは常にEXE/スクリプトと同じフォルダに保存
 DATA_DB = os.path.join(BASE_DIR if getattr(sys, 'frozen', False) else os.path.abspath(os.path.join(BASE_DIR, '..')), 'data.db')
 
-def normalize_member_ids(member_ids):
+# 一覧で返すアドレスの列（全件のストリーミングではORMオブジェクトを作らずに列だけを読む）
+ADDRESS_FIELDS = ('id', 'name', 'email', 'organization', 'department')
+
+def address_json(a):
+    return {
+        'id': a.id,
+        'name': a.name,
+        'email': a.email,
+        'organization': a.organization,
+        'department': a.department
+    }
+
+def group_json(g):
+    return {
+        'id': g.id,
+        'group_name': g.group_name,
+        'memberIds': group_members_json(g),
+        'customAttributes': g.custom_attributes or [],
+        'version': g.version
+    }
+
+def template_json(t):
+    return {
+        'id': t.id,
+        'title': t.title,
+        'subject': t.subject,
+        'body': t.body,
+        'defaultRecipients': template_recipients_json(t)
+    }
+
+def global_json(i):
+    return {'id': i.id, 'key': i.key, 'value': i.value}
+
+def attrdef_json(i):
+    return {'id': i.id, 'key': i.key, 'label': i.label}
+
+def with_cursor(response, next_cursor):
+    """次ページがある場合はカーソルをレスポンスヘッダーに付与（本文は従来どおり配列）"""
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
+
+def database_path(config=None):
     """
-    member_idsを正規化: 旧形式(文字列配列)を新形式(オブジェクト配列)に変換
-    新形式: [{"id": "addr-xxx", "recipientType": "to", "order": 0}, ...]
+    DBファイルのパス: config['DATABASE_PATH'] > 環境変数 OUTLOOK_TOOL_DB > 既定（data.db）
+    相対パスはカレントディレクトリを基準にする（そのままURIにするとFlaskのinstanceフォルダ基準になるため絶対パスにする）
     """
-    if not member_ids:
-        return []
-    if isinstance(member_ids, list) and len(member_ids) > 0:
-        if isinstance(member_ids[0], str):
-            # 旧形式を新形式に変換
-            return [{"id": mid, "recipientType": "to", "order": idx} for idx, mid in enumerate(member_ids)]
-        else:
-            # 既に新形式
-            return member_ids
-    return []
+    path = (config or {}).get('DATABASE_PATH') or os.environ.get('OUTLOOK_TOOL_DB') or DATA_DB
+    return os.path.abspath(path)
 
-def create_app():
-    app = Flask(__name__, static_folder=DIST_DIR, static_url_path='/')
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DATA_DB}'
+def create_app(config=None):
+    """
+    config: Flaskの設定値の上書き（DATABASE_PATH や SQLITE_JOURNAL_MODE などのストレージ設定を含む）
+    """
+    config = dict(config or {})
+    # 静的ファイルはStaticAssetsで配信する（Flask標準の静的ルートは使わない）
+    app = Flask(__name__, static_folder=None)
+    app.json = FastJSONProvider(app)
+    storage_settings = storage.load_settings(config)
+    app.config.update(storage_settings)
+    app.config['DATABASE_PATH'] = database_path(config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{app.config['DATABASE_PATH']}"
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = storage.engine_options(storage_settings)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    CORS(app)
+    # これより行数の多いテーブルの全件取得はストリーミングで返す
+    app.config['JSON_STREAM_MIN_ROWS'] = int(os.environ.get('OUTLOOK_TOOL_JSON_STREAM_MIN_ROWS', STREAM_MIN_ROWS))
+    app.config['CHANGES_MAX_WAITERS'] = int(os.environ.get('OUTLOOK_TOOL_CHANGES_MAX_WAITERS', changelog.MAX_WAITERS))
+    metrics_settings = instrumentation.load_settings(config)
+    app.config.update(metrics_settings)
+    dispatch_settings = dispatch.load_settings(config)
+    app.config.update(dispatch_settings)
+    app.config.update(config)
+    CORS(app, expose_headers=[NEXT_CURSOR_HEADER, 'ETag'])
     db.init_app(app)
+    storage.init_app(app, storage_settings)
+    # ルートごとのレイテンシ・SQL数の計測（/api/metrics）
+    metrics = instrumentation.init_app(app, metrics_settings)
 
-    with app.app_context():
-        db.create_all()
+    # 一覧APIのETag・レスポンスキャッシュ（変更ログの最新のseqが変わると無効になる）
+    response_cache = ResponseCache()
+    app.extensions['response_cache'] = response_cache
+    # /api/changes?wait= で同時に待たせるリクエストの枠
+    long_poll_slots = threading.BoundedSemaphore(max(1, app.config['CHANGES_MAX_WAITERS']))
+
+    # DBのオープンとマイグレーションの所要時間（main.py --profile-startup で表示）
+    started = time.perf_counter()
+    upgrade(app)
+    app.extensions['startup_timings'] = {'db_open': time.perf_counter() - started}
+
+    # SMTPの送信キュー（有効な場合はワーカースレッドを起動する）
+    dispatcher = dispatch.init_app(app, dispatch_settings)
 
     @app.route('/api/health')
     def health():
         return jsonify({'ok': True})
 
+    # Metrics: Prometheusのテキスト形式（DBファイルのサイズ・行数は取得時に調べる）
+    @app.route('/api/metrics', methods=['GET'])
+    def prometheus_metrics():
+        return Response(metrics.render(app.config['DATABASE_PATH']), content_type=instrumentation.CONTENT_TYPE,
+                        headers={'Cache-Control': 'no-store'})
+
+    # 一覧の各コレクション: モデルとJSONへの変換
+    bootstrap_loaders = {
+        'addresses': (Address, address_json),
+        'groups': (Group, group_json),
+        'templates': (EmailTemplate, template_json),
+        'globals': (GlobalVariable, global_json),
+        'attrdefs': (AttributeDefinition, attrdef_json),
+    }
+
+    def collection_batches(name, query):
+        """
+        並べ替え済みのqueryをSTREAM_BATCH件ずつ読み、JSON用の辞書のリストを順に返す（最初の取り出しまでクエリは実行しない）
+        アドレス・グループ・テンプレートはORMオブジェクトを作らずに列だけを読み、メンバー・既定宛先はバッチごとにまとめて取得する
+        """
+        def rows(*columns):
+            statement = query.with_entities(*columns).statement.execution_options(yield_per=STREAM_BATCH)
+            return batched(db.session.execute(statement).tuples())
+
+        if name == 'addresses':
+            for batch in rows(*(getattr(Address, f) for f in ADDRESS_FIELDS)):
+                yield [dict(zip(ADDRESS_FIELDS, row)) for row in batch]
+        elif name == 'groups':
+            for batch in rows(Group.id, Group.group_name, Group.custom_attributes, Group.version):
+                members = members_by_group([row[0] for row in batch])
+                yield [{'id': gid, 'group_name': group_name, 'memberIds': members.get(gid, []),
+                        'customAttributes': custom_attributes or [], 'version': version}
+                       for gid, group_name, custom_attributes, version in batch]
+        elif name == 'templates':
+            for batch in rows(EmailTemplate.id, EmailTemplate.title, EmailTemplate.subject, EmailTemplate.body):
+                recipients = recipients_by_template([row[0] for row in batch])
+                yield [{'id': tid, 'title': title, 'subject': subject, 'body': body,
+                        'defaultRecipients': recipients.get(tid, [])}
+                       for tid, title, subject, body in batch]
+        else:
+            _, to_json = bootstrap_loaders[name]
+            yield from batched(to_json(obj) for obj in query.yield_per(STREAM_BATCH))
+
+    def should_stream(*models):
+        return any(estimated_rows(m) >= app.config['JSON_STREAM_MIN_ROWS'] for m in models)
+
+    def list_response(name, query):
+        """
+        一覧のレスポンス: ?limit= 指定時は1ページ分（X-Next-Cursor付き）
+        全件取得で行数が多い場合と ?format=ndjson の場合はDBから読みながらストリーミングで返す
+        """
+        model, to_json = bootstrap_loaders[name]
+        fmt = request.args.get('format') or 'json'
+        if fmt not in ('json', 'ndjson'):
+            return jsonify({'error': 'formatは json または ndjson を指定してください'}), 400
+        if parse_limit(request.args) is None and (fmt == 'ndjson' or should_stream(model)):
+            batches = collection_batches(name, ordered(query, model, request.args))
+            if fmt == 'ndjson':
+                return stream_response(iter_ndjson(batches), NDJSON_MIMETYPE)
+            return stream_response(iter_json_array(batches))
+
+        if parse_limit(request.args) is None:
+            items, next_cursor = [item for batch in collection_batches(name, ordered(query, model, request.args))
+                                  for item in batch], None
+        else:
+            rows, next_cursor = paginate(query, model, request.args)
+            items = [to_json(r) for r in rows]
+        if fmt == 'ndjson':
+            return with_cursor(Response(b''.join(iter_ndjson([items])), mimetype=NDJSON_MIMETYPE), next_cursor)
+        return with_cursor(jsonify(items), next_cursor)
+
     # Addresses
     @app.route('/api/addresses', methods=['GET'])
+    @response_cache.cached('addresses', compress=True)
     def list_addresses():
-        addrs = Address.query.order_by(Address.created_at.desc()).all()
-        return jsonify([{
-            'id': a.id,
-            'name': a.name,
-            'email': a.email,
-            'organization': a.organization,
-            'department': a.department
-        } for a in addrs])
+        # ?limit=&cursor= でページング、?organization=&department= で絞り込み、?q=&match= で検索、?format=ndjson
+        query = Address.query
+        if request.args.get('organization'):
+            query = query.filter(Address.organization == request.args['organization'])
+        if request.args.get('department'):
+            query = query.filter(Address.department == request.args['department'])
+        query = apply_search(query, request.args,
+                             [Address.name, Address.email, Address.organization, Address.department])
+        return list_response('addresses', query)
 
     @app.route('/api/addresses', methods=['POST'])
     def create_address():
-        data = request.json
         # IDが指定されていない場合は自動生成
-        addr_id = data.get('id')
-        if not addr_id or addr_id.strip() == '':
-            addr_id = None  # SQLAlchemyのdefaultが適用される
-        
-        a = Address(
-            id=addr_id,
-            name=data.get('name', ''),
-            email=data.get('email', ''),
-            organization=data.get('organization'),
-            department=data.get('department')
-        )
-        db.session.add(a)
+        # 同じメールアドレスのアドレスが既にある場合はそれを更新し、200で既存のIDを返す
+        a, created = mutations.upsert_address(request.json)
         db.session.commit()
+        if not created:
+            return jsonify({'id': a.id, 'existing': True})
         return jsonify({'id': a.id}), 201
 
+    @app.route('/api/addresses/bulk', methods=['POST'])
+    def bulk_create_addresses():
+        # JSON配列 / CSV・TSVテキスト（本文またはファイル添付）を1トランザクションで登録
+        if request.is_json:
+            items = request.get_json()
+            if not isinstance(items, list):
+                return jsonify({'error': 'JSON配列を指定してください'}), 400
+            records = iter_json_records(items)
+        else:
+            encoding = request.args.get('encoding', 'utf-8-sig')
+            upload = next(iter(request.files.values()), None)
+            stream = upload.stream if upload else request.stream
+            records = iter_text_records(open_text_stream(stream, encoding))
+
+        summary = import_records(records)
+        return jsonify(summary), 201 if summary['accepted'] else 200
+
+    @app.route('/api/addresses/dedupe', methods=['POST'])
+    def dedupe():
+        # 同じメールアドレスのアドレスを最も古いものに統合する（?dryRun=1 の場合は件数と例を返すだけ）
+        dry_run = request.args.get('dryRun', '').lower() in ('1', 'true')
+        summary = dedupe_addresses(dry_run=dry_run)
+        db.session.commit()
+        return jsonify({**summary, 'dryRun': dry_run})
+
+    @app.route('/api/addresses/export', methods=['GET'])
+    @read_only
+    def export_addresses():
+        # ?format=csv|vcf|jsonl、?organization=&department= で絞り込み、?groupId= でグループのメンバーだけ
+        # DBから一定件数ずつ読みながら書き出す（CSVは ?bom=0 でBOMなし）
+        fmt = request.args.get('format') or 'csv'
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': 'formatは csv / vcf / jsonl のいずれかを指定してください'}), 400
+        group_id = request.args.get('groupId')
+        if group_id:
+            Group.query.get_or_404(group_id)
+        statement = export_statement(request.args.get('organization'), request.args.get('department'), group_id)
+        bom = request.args.get('bom', '1').lower() not in ('0', 'false')
+        mimetype, extension = EXPORT_FORMATS[fmt]
+        return Response(stream_with_context(iter_export(fmt, iter_rows(statement), bom)), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename="addresses.{extension}"'})
+
     @app.route('/api/addresses/<id>', methods=['PUT'])
     def update_address(id):
-        data = request.json
-        a = Address.query.get_or_404(id)
-        a.name = data.get('name', a.name)
-        a.email = data.get('email', a.email)
-        a.organization = data.get('organization', a.organization)
-        a.department = data.get('department', a.department)
+        mutations.update_address(id, request.json)
         db.session.commit()
         return jsonify({'ok': True})
 
     @app.route('/api/addresses/<id>', methods=['DELETE'])
     def delete_address(id):
-        a = Address.query.get_or_404(id)
-        
-        # 削除するアドレスを参照しているグループから削除
-        groups = Group.query.all()
-        for g in groups:
-            member_ids = g.member_ids or []
-            # 旧形式(文字列配列)と新形式(オブジェクト配列)の両方に対応
-            if isinstance(member_ids, list) and len(member_ids) > 0:
-                if isinstance(member_ids[0], str):
-                    # 旧形式: 文字列配列
-                    if id in member_ids:
-                        member_ids.remove(id)
-                        g.member_ids = member_ids
-                else:
-                    # 新形式: オブジェクト配列
-                    g.member_ids = [m for m in member_ids if m.get('id') != id]
-        
-        # 削除するアドレスを参照しているテンプレートから削除
-        templates = EmailTemplate.query.all()
-        for t in templates:
-            default_recipients = t.default_recipients or []
-            # defaultRecipientsは [{"addressId": "addr-xxx", "type": "TO"}] 形式
-            if isinstance(default_recipients, list):
-                t.default_recipients = [r for r in default_recipients if r.get('addressId') != id]
-        
-        db.session.delete(a)
+        mutations.delete_address(id)
         db.session.commit()
         return jsonify({'ok': True})
 
+    @app.route('/api/addresses/<id>/groups', methods=['GET'])
+    @response_cache.cached('addresses', 'groups')
+    def list_address_groups(id):
+        Address.query.get_or_404(id)
+        return jsonify(groups_for_address(id))
+
     # Groups
     @app.route('/api/groups', methods=['GET'])
+    @response_cache.cached('groups', compress=True)
     def list_groups():
-        groups = Group.query.order_by(Group.created_at.desc()).all()
-        return jsonify([{
-            'id': g.id,
-            'group_name': g.group_name,
-            'memberIds': normalize_member_ids(g.member_ids),
-            'customAttributes': g.custom_attributes or []
-        } for g in groups])
+        query = apply_search(Group.query, request.args, [Group.group_name])
+        return list_response('groups', query)
 
     @app.route('/api/groups', methods=['POST'])
     def create_group():
-        data = request.json
-        grp_id = data.get('id')
-        if not grp_id or grp_id.strip() == '':
-            grp_id = None
-        
-        g = Group(
-            id=grp_id,
-            group_name=data.get('group_name', ''),
-            member_ids=data.get('memberIds', []),
-            custom_attributes=data.get('customAttributes', [])
-        )
-        db.session.add(g)
+        g = mutations.create_group(request.json)
         db.session.commit()
         return jsonify({'id': g.id}), 201
 
     @app.route('/api/groups/<id>', methods=['PUT'])
     def update_group(id):
-        data = request.json
-        g = Group.query.get_or_404(id)
-        g.group_name = data.get('group_name', g.group_name)
-        g.member_ids = data.get('memberIds', g.member_ids)
-        g.custom_attributes = data.get('customAttributes', g.custom_attributes)
+        mutations.update_group(id, request.json)
         db.session.commit()
         return jsonify({'ok': True})
 
+    @app.route('/api/groups/<id>/members', methods=['PATCH'])
+    def patch_group_members(id):
+        # メンバー全体を送らずに追加・削除・宛先種別の変更・並べ替えを行う
+        # 本文: {"version": 取得時の版数（省略時は確認しない）, "operations": [{"op": "add", "id": "addr-1"}, ...]}
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'operations を含むオブジェクトを指定してください'}), 400
+        try:
+            result = mutations.patch_members(id, data)
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        except VersionConflict as e:
+            db.session.rollback()
+            return jsonify({'error': str(e), 'version': e.current}), 409
+        db.session.commit()
+        return jsonify(result)
+
     @app.route('/api/groups/<id>', methods=['DELETE'])
     def delete_group(id):
-        g = Group.query.get_or_404(id)
-        db.session.delete(g)
+        mutations.delete_group(id)
         db.session.commit()
         return jsonify({'ok': True})
 
     # Templates
     @app.route('/api/templates', methods=['GET'])
+    @response_cache.cached('templates', compress=True)
     def list_templates():
-        tpls = EmailTemplate.query.order_by(EmailTemplate.created_at.desc()).all()
-        return jsonify([{
-            'id': t.id,
-            'title': t.title,
-            'subject': t.subject,
-            'body': t.body,
-            'defaultRecipients': t.default_recipients or []
-        } for t in tpls])
+        query = apply_search(EmailTemplate.query, request.args, [EmailTemplate.title, EmailTemplate.subject])
+        return list_response('templates', query)
 
     @app.route('/api/templates', methods=['POST'])
     def create_template():
-        data = request.json
-        tpl_id = data.get('id')
-        if not tpl_id or tpl_id.strip() == '':
-            tpl_id = None
-        
-        t = EmailTemplate(
-            id=tpl_id,
-            title=data.get('title'),
-            subject=data.get('subject'),
-            body=data.get('body'),
-            default_recipients=data.get('defaultRecipients', [])
-        )
-        db.session.add(t)
+        t = mutations.create_template(request.json)
         db.session.commit()
         return jsonify({'id': t.id}), 201
 
     @app.route('/api/templates/<id>', methods=['PUT'])
     def update_template(id):
-        data = request.json
-        t = EmailTemplate.query.get_or_404(id)
-        t.title = data.get('title', t.title)
-        t.subject = data.get('subject', t.subject)
-        t.body = data.get('body', t.body)
-        t.default_recipients = data.get('defaultRecipients', t.default_recipients)
+        mutations.update_template(id, request.json)
         db.session.commit()
+        template_cache.invalidate(id)
         return jsonify({'ok': True})
 
     @app.route('/api/templates/<id>', methods=['DELETE'])
     def delete_template(id):
-        t = EmailTemplate.query.get_or_404(id)
-        db.session.delete(t)
+        mutations.delete_template(id)
         db.session.commit()
+        template_cache.invalidate(id)
         return jsonify({'ok': True})
 
     # Globals
     @app.route('/api/globals', methods=['GET'])
+    @response_cache.cached('globals', compress=True)
     def list_globals():
         items = GlobalVariable.query.order_by(GlobalVariable.created_at.desc()).all()
-        return jsonify([{'id': i.id, 'key': i.key, 'value': i.value} for i in items])
+        return jsonify([global_json(i) for i in items])
 
     @app.route('/api/globals', methods=['POST'])
     def create_global():
-        data = request.json
-        gvar_id = data.get('id')
-        if not gvar_id or gvar_id.strip() == '':
-            gvar_id = None
-        g = GlobalVariable(id=gvar_id, key=data.get('key'), value=data.get('value'))
-        db.session.add(g)
+        g = mutations.create_global(request.json)
         db.session.commit()
         return jsonify({'id': g.id}), 201
 
     @app.route('/api/globals/<id>', methods=['PUT'])
     def update_global(id):
-        data = request.json
-        g = GlobalVariable.query.get_or_404(id)
-        g.key = data.get('key', g.key)
-        g.value = data.get('value', g.value)
+        mutations.update_global(id, request.json)
         db.session.commit()
         return jsonify({'ok': True})
 
     @app.route('/api/globals/<id>', methods=['DELETE'])
     def delete_global(id):
-        g = GlobalVariable.query.get_or_404(id)
-        db.session.delete(g)
+        mutations.delete_global(id)
         db.session.commit()
         return jsonify({'ok': True})
 
     # AttrDefs
     @app.route('/api/attrdefs', methods=['GET'])
+    @response_cache.cached('attrdefs', compress=True)
     def list_attrdefs():
         items = AttributeDefinition.query.order_by(AttributeDefinition.created_at.desc()).all()
-        return jsonify([{'id': i.id, 'key': i.key, 'label': i.label} for i in items])
+        return jsonify([attrdef_json(i) for i in items])
 
     @app.route('/api/attrdefs', methods=['POST'])
     def create_attrdef():
-        data = request.json
-        atdef_id = data.get('id')
-        if not atdef_id or atdef_id.strip() == '':
-            atdef_id = None
-        a = AttributeDefinition(id=atdef_id, key=data.get('key'), label=data.get('label'))
-        db.session.add(a)
+        a = mutations.create_attrdef(request.json)
         db.session.commit()
         return jsonify({'id': a.id}), 201
 
     @app.route('/api/attrdefs/<id>', methods=['PUT'])
     def update_attrdef(id):
-        data = request.json
-        a = AttributeDefinition.query.get_or_404(id)
-        a.key = data.get('key', a.key)
-        a.label = data.get('label', a.label)
+        mutations.update_attrdef(id, request.json)
         db.session.commit()
         return jsonify({'ok': True})
 
     @app.route('/api/attrdefs/<id>', methods=['DELETE'])
     def delete_attrdef(id):
-        a = AttributeDefinition.query.get_or_404(id)
-        db.session.delete(a)
+        mutations.delete_attrdef(id)
         db.session.commit()
         return jsonify({'ok': True})
 
+    # Variables: 変数のキーを使っているテンプレート・グループ（保存時に更新する索引から引く）
+    @app.route('/api/variables/<key>/usages', methods=['GET'])
+    def variable_usages(key):
+        g = GlobalVariable.query.filter_by(key=key).first()
+        a = AttributeDefinition.query.filter_by(key=key).first()
+        return jsonify({
+            'key': key,
+            'global': global_json(g) if g else None,
+            'attrdef': attrdef_json(a) if a else None,
+            **find_usages(key),
+        })
+
+    @app.route('/api/variables/<key>/rename', methods=['POST'])
+    def rename_variable(key):
+        # {"to": 新しいキー}: 同じキーのグローバル変数・属性定義と、使っているテンプレート・グループを1回のコミットで書き換える
+        new_key = (request.get_json(silent=True) or {}).get('to')
+        new_key = new_key.strip() if isinstance(new_key, str) else ''
+        if not new_key or '{' in new_key or '}' in new_key:
+            return jsonify({'error': 'to に新しいキーを指定してください（{ } は使えません）'}), 400
+        if new_key == key:
+            return jsonify({'error': '新しいキーが現在のキーと同じです'}), 400
+        try:
+            result = mutations.rename_variable(key, new_key)
+            if not any(result[k] for k in ('globals', 'attrdefs', 'templates', 'groups')):
+                db.session.rollback()
+                return jsonify({'error': f'{key} は定義も使用もされていません'}), 404
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'error': f'{new_key} は既に定義されています'}), 409
+        for tid in result['templates']:
+            template_cache.invalidate(tid)
+        return jsonify(result)
+
+    # Batch: 複数コレクションの作成・更新・削除を順に実行し、1回のコミットで確定する
+    @app.route('/api/batch', methods=['POST'])
+    def batch():
+        # 本文: [{"op": "create", "collection": "addresses", "data": {...}}, ...] または {"operations": [...]}
+        # 1件でも失敗した場合は全体を取り消し、失敗した操作の番号とそれまでの結果を返す
+        body = request.get_json(silent=True)
+        operations = body.get('operations') if isinstance(body, dict) else body
+        if not isinstance(operations, list):
+            return jsonify({'error': '操作の配列を指定してください'}), 400
+        if len(operations) > mutations.MAX_BATCH_OPERATIONS:
+            return jsonify({'error': f'操作は{mutations.MAX_BATCH_OPERATIONS}件以下にしてください'}), 400
+
+        results = []
+        touched_templates = set()
+        for index, item in enumerate(operations):
+            try:
+                op, collection, entity_id, data = mutations.parse_operation(item)
+                entity_id, created = mutations.apply_operation(op, collection, entity_id, data)
+            except (ValueError, NotFound, IntegrityError) as e:
+                db.session.rollback()
+                if isinstance(e, NotFound):
+                    status, message = 404, f'{collection} に {entity_id} が見つかりません'
+                elif isinstance(e, IntegrityError):
+                    status, message = 409, f'制約に違反しました: {e.orig}'
+                else:
+                    status, message = 400, str(e)
+                return jsonify({'error': message, 'index': index, 'status': status,
+                                'results': results, 'committed': False}), status
+            if collection == 'templates':
+                touched_templates.add(entity_id)
+            result = {'op': op, 'collection': collection, 'id': entity_id, 'status': 201 if created else 200}
+            if op == 'create' and not created:
+                # 同じメールアドレスのアドレスを更新した（単体の POST /api/addresses と同じく200と existing）
+                result['existing'] = True
+            results.append(result)
+        db.session.commit()
+        for tid in touched_templates:
+            template_cache.invalidate(tid)
+        return jsonify({'results': results, 'committed': True})
+
+    # Bootstrap: 画面の初期表示に必要な全コレクションを1回で返す
+    @app.route('/api/bootstrap', methods=['GET'])
+    @response_cache.cached(*COLLECTIONS, compress=True)
+    def bootstrap():
+        # ?known=addresses:<version>,groups:<version> で指定したバージョンが最新のコレクションは省略する
+        known = dict(item.split(':', 1) for item in request.args.get('known', '').split(',') if ':' in item)
+        versions = response_cache.version_tokens()
+        result = {'versions': versions, 'changeSeq': changelog.latest_seq()}
+        names = [name for name in bootstrap_loaders if known.get(name) != versions[name]]
+        arrays = [(name, collection_batches(name, ordered(bootstrap_loaders[name][0].query,
+                                                          bootstrap_loaders[name][0], {})))
+                  for name in names]
+        # 行数の多いコレクションを含む場合は、コレクションごとにDBから読みながら送信する
+        if should_stream(*(bootstrap_loaders[name][0] for name in names)):
+            return stream_response(iter_json_object(result, arrays))
+        for name, batches in arrays:
+            result[name] = [item for batch in batches for item in batch]
+        return jsonify(result)
+
+    # Changes: ?since=<seq> 以降の差分（upsertは現在のデータ付き、deleteは墓標）を返す
+    @app.route('/api/changes', methods=['GET'])
+    def list_changes():
+        try:
+            since = max(0, int(request.args.get('since', 0)))
+            limit = max(1, min(int(request.args.get('limit', 500)), changelog.MAX_LIMIT))
+            wait = max(0.0, float(request.args.get('wait', 0)))
+        except ValueError:
+            return jsonify({'error': 'since/limit/waitは数値で指定してください'}), 400
+
+        # 削除済みの範囲より古いseq、またはデータベースより新しいseqからは差分を作れないため全件再取得を指示する
+        latest = changelog.latest_seq()
+        if since and (since < changelog.oldest_seq() - 1 or since > latest):
+            return jsonify({'reset': True, 'lastSeq': latest, 'changes': [], 'hasMore': False})
+        retry_after = None
+        if wait and since == latest:
+            # 待機枠が空いていなければ待たずに返す（ワーカースレッドをロングポーリングで使い切らないように）
+            if long_poll_slots.acquire(blocking=False):
+                try:
+                    changelog.wait_for_changes(since, wait)
+                finally:
+                    long_poll_slots.release()
+            else:
+                retry_after = changelog.BUSY_RETRY_AFTER
+
+        entries, last_seq, has_more = changelog.changes_since(since, limit)
+        upserts = {}
+        for _, collection, entity_id, op in entries:
+            if op == 'upsert':
+                upserts.setdefault(collection, set()).add(entity_id)
+        current = {}
+        for collection, ids in upserts.items():
+            model, to_json = bootstrap_loaders[collection]
+            for row in model.query.filter(model.id.in_(ids)):
+                current[(collection, row.id)] = to_json(row)
+
+        result = []
+        for seq, collection, entity_id, op in entries:
+            data = current.get((collection, entity_id)) if op == 'upsert' else None
+            if op == 'upsert' and data is None:
+                # 後続の変更で削除済み
+                op = 'delete'
+            result.append({'seq': seq, 'collection': collection, 'id': entity_id, 'op': op, 'data': data})
+        if retry_after is None:
+            return jsonify({'changes': result, 'lastSeq': last_seq, 'hasMore': has_more})
+        # 待たずに返した場合は、retryAfter秒あけてから次のロングポーリングをするよう伝える
+        response = jsonify({'changes': result, 'lastSeq': last_seq, 'hasMore': has_more, 'retryAfter': retry_after})
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    # Render: テンプレート（またはsubject/body）の変数を置換し、未定義の変数を報告する
+    @app.route('/api/render', methods=['POST'])
+    @read_only
+    def render_message():
+        data = request.json or {}
+        if data.get('templateId'):
+            compiled = template_cache.get(EmailTemplate.query.get_or_404(data['templateId']))
+        else:
+            compiled = CompiledTemplate(data.get('subject', ''), data.get('body', ''))
+        globals_map = load_globals_map()
+        extra = data.get('values') or {}
+
+        def render_for(custom_attributes):
+            values = build_values(globals_map, custom_attributes)
+            values.update({k: str(v) for k, v in extra.items()})
+            return compiled.render(values)
+
+        # groupIds指定時は同じコンパイル結果を各グループに適用
+        if 'groupIds' in data:
+            groups = {g.id: g for g in Group.query.filter(Group.id.in_(data['groupIds'] or []))}
+            results = []
+            for gid in data['groupIds'] or []:
+                g = groups.get(gid)
+                if g is None:
+                    results.append({'groupId': gid, 'error': 'not_found'})
+                    continue
+                results.append({'groupId': gid, **render_for(g.custom_attributes)})
+            return jsonify({'results': results})
+
+        custom_attributes = None
+        if data.get('groupId'):
+            custom_attributes = Group.query.get_or_404(data['groupId']).custom_attributes
+        return jsonify(render_for(custom_attributes))
+
+    # Recipients: グループ・テンプレートの既定宛先・個別のアドレスをまとめて解決し、重複を除いたTO/CC/BCCを返す
+    @app.route('/api/recipients/resolve', methods=['POST'])
+    @read_only
+    def resolve_recipient_lists():
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'groupIds / templateIds / addressIds を含むオブジェクトを指定してください'}), 400
+        ids = {}
+        for key, limit in (('groupIds', MAX_SOURCES), ('templateIds', MAX_SOURCES), ('addressIds', MAX_ADDRESSES)):
+            value = data.get(key) or []
+            if not isinstance(value, list) or not all(isinstance(v, (str, dict)) for v in value):
+                return jsonify({'error': f'{key} はIDの配列で指定してください'}), 400
+            if len(value) > limit:
+                return jsonify({'error': f'{key} は{limit}件以下にしてください'}), 400
+            ids[key] = value
+        if any(not isinstance(v, str) for v in ids['groupIds'] + ids['templateIds']):
+            return jsonify({'error': 'groupIds / templateIds はIDの配列で指定してください'}), 400
+        return jsonify(resolve_recipients(ids['groupIds'], ids['templateIds'], ids['addressIds'],
+                                          data.get('type', 'TO')))
+
+    def merge_targets(data):
+        """差し込み対象のグループID（allの場合はNone）と、指定が不正な場合のエラーレスポンスを返す"""
+        # workers はストリームの途中で失敗しないよう、描画を始める前に検証する
+        try:
+            parse_workers(data.get('workers'))
+        except ValueError as e:
+            return None, (jsonify({'error': str(e)}), 400)
+        if data.get('all'):
+            return None, None
+        if isinstance(data.get('groupIds'), list):
+            return data['groupIds'], None
+        return None, (jsonify({'error': 'groupIds または all を指定してください'}), 400)
+
+    # Mail merge: テンプレートをグループごとに描画し、NDJSONで1件ずつ返す
+    @app.route('/api/mailmerge', methods=['POST'])
+    @read_only
+    def mail_merge():
+        # {"templateId": ..., "groupIds": [...]} または {"templateId": ..., "all": true}
+        data = request.json or {}
+        template = EmailTemplate.query.get_or_404(data.get('templateId'))
+        group_ids, error = merge_targets(data)
+        if error:
+            return error
+
+        def generate():
+            count = errors = 0
+            for item in iter_merged(template, group_ids, data.get('workers')):
+                if item['type'] == 'error':
+                    errors += 1
+                else:
+                    count += 1
+                yield dumps(item) + b'\n'
+            yield dumps({'type': 'summary', 'messages': count, 'errors': errors}) + b'\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    # .eml export: mailto: URLの長さ制限を避けるため、メッセージを.emlファイルとして返す
+    @app.route('/api/eml', methods=['POST'])
+    @read_only
+    def export_eml():
+        # {"subject": ..., "body": ..., "to": [{"name", "email"}], "cc": [...], "bcc": [...]}
+        data = request.json or {}
+        try:
+            eml = build_eml(data, data.get('from'))
+        except InvalidAddress as e:
+            return jsonify({'error': str(e)}), 400
+        return Response(eml, mimetype='message/rfc822',
+                        headers={'Content-Disposition': 'attachment; filename="message.eml"'})
+
+    @app.route('/api/eml/zip', methods=['POST'])
+    @read_only
+    def export_eml_zip():
+        # {"templateId": ..., "groupIds": [...] | "all": true} または {"messages": [...]}
+        data = request.json or {}
+        # 送信者・指定されたメッセージの宛先は書き出す前に検証する（差し込み結果の宛先の誤りは errors.txt に記録）
+        try:
+            validate_recipients({'to': [data['from']] if data.get('from') else []})
+            if isinstance(data.get('messages'), list):
+                for message in data['messages']:
+                    validate_recipients(message)
+        except InvalidAddress as e:
+            return jsonify({'error': str(e)}), 400
+        if isinstance(data.get('messages'), list):
+            messages = data['messages']
+        else:
+            template = EmailTemplate.query.get_or_404(data.get('templateId'))
+            group_ids, error = merge_targets(data)
+            if error:
+                return error
+            messages = iter_merged(template, group_ids, data.get('workers'))
+
+        # 差し込み結果を1通ずつ.emlにしてZIPへ書き出し、書けた分から送信する
+        body = iter_zip(iter_eml_entries(messages, data.get('from')))
+        return Response(stream_with_context(body), mimetype='application/zip',
+                        headers={'Content-Disposition': 'attachment; filename="messages.zip"'})
+
+    # Dispatch: SMTPで送信するメッセージを送信キューに登録し、ワーカーが順に送信する
+    def dispatch_disabled():
+        return jsonify({'error': '送信機能は無効です（OUTLOOK_TOOL_DISPATCH_ENABLED=1 で有効になります）'}), 503
+
+    @app.route('/api/dispatch', methods=['POST'])
+    def queue_dispatch():
+        # {"messages": [{"to": [...], "cc": [...], "bcc": [...], "subject", "body"}]}
+        # または {"templateId": ..., "groupIds": [...] | "all": true}（グループごとに差し込んで1通ずつ登録）
+        if not dispatcher.enabled:
+            return dispatch_disabled()
+        data = request.get_json(silent=True) or {}
+        sender = data.get('from') or dispatch_settings['SMTP_FROM']
+        if not isinstance(sender, str) or '@' not in sender:
+            return jsonify({'error': '送信元（from または OUTLOOK_TOOL_SMTP_FROM）を指定してください'}), 400
+        not_found = []
+        if isinstance(data.get('messages'), list):
+            messages = [m for m in data['messages'] if isinstance(m, dict)]
+        else:
+            template = EmailTemplate.query.get_or_404(data.get('templateId'))
+            group_ids, error = merge_targets(data)
+            if error:
+                return error
+
+            def merged():
+                for item in iter_merged(template, group_ids, data.get('workers')):
+                    if item['type'] == 'error':
+                        not_found.append(item['groupId'])
+                    else:
+                        yield item
+
+            messages = merged()
+        try:
+            batch_id, count, skipped = dispatch.enqueue(messages, sender)
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        db.session.commit()
+        dispatcher.wake()
+        return jsonify({'batchId': batch_id, 'queued': count, 'skipped': skipped, 'notFound': not_found}), 202
+
+    @app.route('/api/dispatch/status', methods=['GET'])
+    def dispatch_status():
+        # ?batchId= で登録したまとまりごとの件数
+        return jsonify({
+            'enabled': dispatcher.enabled,
+            'workers': dispatcher.alive(),
+            'counts': dispatch.status_counts(request.args.get('batchId')),
+        })
+
+    @app.route('/api/dispatch/jobs', methods=['GET'])
+    def list_dispatch_jobs():
+        # ?status=&batchId= で絞り込み、新しい順。?limit=&cursor= でページング（カーソルは最後のジョブID）
+        query = dispatch.DispatchJob.query
+        if request.args.get('status'):
+            query = query.filter(dispatch.DispatchJob.status == request.args['status'])
+        if request.args.get('batchId'):
+            query = query.filter(dispatch.DispatchJob.batch_id == request.args['batchId'])
+        try:
+            limit = max(1, min(int(request.args.get('limit', dispatch.DEFAULT_LIST_LIMIT)), dispatch.MAX_LIST_LIMIT))
+            cursor = int(request.args['cursor']) if request.args.get('cursor') else None
+        except ValueError:
+            return jsonify({'error': 'limit / cursor は数値で指定してください'}), 400
+        if cursor is not None:
+            query = query.filter(dispatch.DispatchJob.id < cursor)
+        jobs = query.order_by(dispatch.DispatchJob.id.desc()).limit(limit + 1).all()
+        next_cursor = str(jobs[limit - 1].id) if len(jobs) > limit else None
+        return with_cursor(jsonify([dispatch.job_json(j) for j in jobs[:limit]]), next_cursor)
+
+    @app.route('/api/dispatch/jobs/<int:job_id>', methods=['GET'])
+    def get_dispatch_job(job_id):
+        return jsonify(dispatch.job_json(db.get_or_404(dispatch.DispatchJob, job_id), detail=True))
+
+    @app.route('/api/dispatch/jobs/<int:job_id>/retry', methods=['POST'])
+    def retry_dispatch_job(job_id):
+        # 失敗・取り消したジョブを送信キューに戻す（試行回数は0から数え直す）
+        if not dispatcher.enabled:
+            return dispatch_disabled()
+        job = db.get_or_404(dispatch.DispatchJob, job_id)
+        if job.status not in ('failed', 'cancelled'):
+            return jsonify({'error': f'{job.status} のジョブは再送できません'}), 409
+        job.status = 'queued'
+        job.attempts = 0
+        job.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+        dispatcher.wake()
+        return jsonify(dispatch.job_json(job))
+
+    @app.route('/api/dispatch/jobs/<int:job_id>/cancel', methods=['POST'])
+    def cancel_dispatch_job(job_id):
+        # 送信待ちのジョブだけを取り消す（送信中・送信済みは取り消せない）
+        job = db.get_or_404(dispatch.DispatchJob, job_id)
+        if job.status != 'queued':
+            return jsonify({'error': f'{job.status} のジョブは取り消せません'}), 409
+        job.status = 'cancelled'
+        db.session.commit()
+        return jsonify(dispatch.job_json(job))
+
+    # Search
+    @app.route('/api/search', methods=['GET'])
+    @response_cache.cached('addresses', 'templates')
+    def search():
+        # ?q=検索語&type=address|template&limit=&offset=
+        q = request.args.get('q', '').strip()
+        kind = request.args.get('type')
+        if kind and kind not in fulltext.KINDS:
+            return jsonify({'error': 'typeは address または template を指定してください'}), 400
+        try:
+            limit = max(1, min(int(request.args.get('limit', 20)), fulltext.MAX_LIMIT))
+            offset = max(0, int(request.args.get('offset', 0)))
+        except ValueError:
+            return jsonify({'error': 'limit/offsetは整数で指定してください'}), 400
+
+        results, next_offset = fulltext.search(q, [kind] if kind else None, limit, offset)
+        return jsonify({'results': results, 'nextOffset': next_offset})
+
     # Serve SPA index.html for root
+    static_assets = StaticAssets(DIST_DIR)
+    app.extensions['static_assets'] = static_assets
     @app.route('/', defaults={'path': ''})
     @app.route('/<path:path>')
     def serve(path):
-        if path != '' and os.path.exists(os.path.join(DIST_DIR, path)):
-            return send_from_directory(DIST_DIR, path)
-        else:
-            return send_from_directory(DIST_DIR, 'index.html')
+        # dist/の索引から返す（見つからないパスはメモリ上のindex.html）
+        return static_assets.response(path)
 
     return app
 
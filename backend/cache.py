@@ -0,0 +1,116 @@
+"""
+一覧APIのETag / 条件付きGETとレスポンスキャッシュ
+コレクションのバージョンは変更ログ（changesテーブル）のコレクションごとの最新seqから求め、
+未変更なら一覧のクエリもJSON変換も行わずに返す
+バージョンはDBから読むため、このサーバーを通らない書き込み（インポート・重複統合のコマンド、
+デモデータの再作成、同じdata.dbを使う別のサーバー）も変更ログに記録されていれば反映される
+"""
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import func
+
+try:
+    from backend.models import db, Change
+    from backend.compression import choose_encoding, compress_response
+except ModuleNotFoundError:
+    from models import db, Change
+    from compression import choose_encoding, compress_response
+
+COLLECTIONS = ('addresses', 'groups', 'templates', 'globals', 'attrdefs')
+# キャッシュするレスポンス数の上限
+MAX_ENTRIES = 256
+# キャッシュしたレスポンスで復元するヘッダー
+CACHED_HEADERS = ('X-Next-Cursor', 'Content-Encoding', 'Vary')
+
+
+class ResponseCache:
+    """コレクションのバージョン管理とシリアライズ済みレスポンスのLRUキャッシュ"""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        # 再起動したら以前のETagはすべて無効にする（DBファイルを作り直してseqが戻った場合の備え）
+        self.boot_id = uuid.uuid4().hex[:8]
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def versions(self):
+        """
+        コレクションごとのバージョン（1リクエストにつき1回だけDBから読む）
+        "<変更ログの最古のseq>.<そのコレクションの最新のseq>" の形式で、古い変更ログを削除した場合も以前の値に戻らない
+        """
+        if has_request_context() and '_collection_versions' in g:
+            return g._collection_versions
+        t = Change.__table__
+        latest = [db.select(func.max(t.c.seq)).where(t.c.collection == c).scalar_subquery() for c in COLLECTIONS]
+        oldest, *values = db.session.execute(
+            db.select(db.select(func.min(t.c.seq)).scalar_subquery(), *latest)).one()
+        versions = {c: f'{oldest or 0}.{value or 0}' for c, value in zip(COLLECTIONS, values)}
+        if has_request_context():
+            g._collection_versions = versions
+        return versions
+
+    def version_tokens(self, collections=COLLECTIONS):
+        """クライアントに渡すコレクションごとのバージョン文字列"""
+        versions = self.versions()
+        return {c: f'{self.boot_id}-{versions[c]}' for c in collections}
+
+    def etag(self, collections, key):
+        versions = self.versions()
+        version = '-'.join(versions[c] for c in collections)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+        return f'{self.boot_id}-{version}-{digest}'
+
+    def get(self, etag):
+        with self.lock:
+            entry = self.entries.get(etag)
+            if entry is not None:
+                self.entries.move_to_end(etag)
+            return entry
+
+    def put(self, etag, entry):
+        with self.lock:
+            self.entries[etag] = entry
+            self.entries.move_to_end(etag)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def cached(self, *collections, compress=False):
+        """
+        一覧ハンドラ用デコレータ: ETag付与・304応答・レスポンスキャッシュ
+        compress=Trueの場合は圧縮済みの本文を圧縮方式ごとにキャッシュする
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                encoding = choose_encoding(request.accept_encodings) if compress else None
+                etag = self.etag(collections, f'{request.full_path}|{encoding or ""}')
+                if etag in request.if_none_match:
+                    response = current_app.response_class(status=304)
+                    if compress:
+                        response.vary.add('Accept-Encoding')
+                else:
+                    entry = self.get(etag)
+                    if entry is not None:
+                        body, mimetype, headers = entry
+                        response = current_app.response_class(body, mimetype=mimetype, headers=headers)
+                    else:
+                        response = current_app.make_response(view(*args, **kwargs))
+                        if response.status_code != 200:
+                            return response
+                        if compress:
+                            compress_response(response, encoding)
+                        # ストリーミングのレスポンス（大きな一覧）は本文をキャッシュせず、ETagだけを付ける
+                        if not response.is_streamed:
+                            headers = {h: response.headers[h] for h in CACHED_HEADERS if h in response.headers}
+                            self.put(etag, (response.get_data(), response.mimetype, headers))
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'no-cache'
+                return response
+            return wrapper
+        return decorator
+
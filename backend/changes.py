@@ -0,0 +1,123 @@
+"""
+変更ログ（差分同期）
+各書き込みと同じトランザクションでchangesテーブルに追記し、クライアントは /api/changes?since= で差分だけを取得する
+一覧APIのETag（cache.py）もコレクションごとの最新のseqから求めるため、キャッシュする一覧に影響する書き込みは必ずここに記録する
+"""
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event, func
+
+try:
+    from backend.models import db, Change
+except ModuleNotFoundError:
+    from models import db, Change
+
+# 保持する変更ログの件数（これより古いものは起動時に削除する）
+MAX_RETAINED = 100000
+# 1回のレスポンスで返す変更の最大数
+MAX_LIMIT = 1000
+# ロングポーリングの最大待ち時間（秒）
+MAX_WAIT = 30
+# 同時に待たせるロングポーリングの数の既定値（待機中はサーバーのワーカースレッドを1つ占有するため、
+# スレッド数より十分少なくする。config: CHANGES_MAX_WAITERS）
+MAX_WAITERS = 4
+# 待機枠が埋まっている場合に、クライアントに次の取得まで空けてもらう秒数
+BUSY_RETRY_AFTER = 5
+
+# コミット通知（ロングポーリング待ちのリクエストを起こす）
+_new_changes = threading.Condition()
+# サーバーの停止中（待機中のロングポーリングはすぐに空の結果を返す）
+shutting_down = threading.Event()
+
+
+def record_change(collection, obj, op='upsert'):
+    """変更を1件記録する（objはモデルのインスタンスまたはID）"""
+    entity_id = getattr(obj, 'id', obj)
+    if entity_id is None:
+        # 新規作成でIDが未確定の場合はflushして採番する
+        db.session.flush()
+        entity_id = obj.id
+    db.session.add(Change(collection=collection, entity_id=entity_id, op=op, created_at=datetime.utcnow()))
+    db.session.info['has_changes'] = True
+
+
+def record_changes(collection, entity_ids, op='upsert'):
+    """一括インポート用: 変更をexecutemanyでまとめて記録する"""
+    now = datetime.utcnow()
+    rows = [{'collection': collection, 'entity_id': eid, 'op': op, 'created_at': now} for eid in entity_ids]
+    if rows:
+        db.session.execute(Change.__table__.insert(), rows)
+        db.session.info['has_changes'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _notify_on_commit(session):
+    if session.info.pop('has_changes', None):
+        with _new_changes:
+            _new_changes.notify_all()
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_on_rollback(session, previous_transaction):
+    session.info.pop('has_changes', None)
+
+
+def latest_seq():
+    return db.session.query(func.max(Change.seq)).scalar() or 0
+
+
+def oldest_seq():
+    return db.session.query(func.min(Change.seq)).scalar() or 0
+
+
+def changes_since(since, limit):
+    """
+    since以降の変更を取得し、同じエンティティへの変更は最後の1件にまとめる
+    戻り値: (変更リスト[(seq, collection, id, op)], 最後に読んだseq, 続きがあるか)
+    """
+    rows = (Change.query.filter(Change.seq > since)
+            .order_by(Change.seq).limit(limit + 1).all())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    latest = {}
+    for r in rows:
+        latest.pop((r.collection, r.entity_id), None)
+        latest[(r.collection, r.entity_id)] = (r.seq, r.collection, r.entity_id, r.op)
+    last_seq = rows[-1].seq if rows else since
+    return list(latest.values()), last_seq, has_more
+
+
+def begin_shutdown():
+    """
+    サーバーの停止前に呼ぶ: 待機中のロングポーリングを起こして空の結果を返させる
+    （待たせたままだと処理中のリクエストの完了待ちが停止の猶予時間いっぱいまでかかる）
+    """
+    shutting_down.set()
+    with _new_changes:
+        _new_changes.notify_all()
+
+
+def wait_for_changes(since, timeout):
+    """since以降の変更がコミットされるまで最大timeout秒待つ（他プロセスの書き込みも1秒ごとに確認）"""
+    deadline = time.monotonic() + min(timeout, MAX_WAIT)
+    while latest_seq() <= since:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or shutting_down.is_set():
+            return False
+        # 読み取りトランザクションを終えてから待つ（次の確認で最新の状態を読む）
+        db.session.rollback()
+        with _new_changes:
+            # begin_shutdown() の通知を取りこぼさないよう、ロックを取ってから確認する
+            if not shutting_down.is_set():
+                _new_changes.wait(min(remaining, 1.0))
+    return True
+
+
+def prune_changes(keep=MAX_RETAINED):
+    """古い変更ログを削除する"""
+    cutoff = latest_seq() - keep
+    if cutoff > 0:
+        Change.query.filter(Change.seq <= cutoff).delete(synchronize_session=False)
+        db.session.commit()
@@ -0,0 +1,67 @@
+"""
+レスポンス圧縮（gzip / brotli）
+brotliはインストールされている場合のみ使用する
+"""
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# これより小さいレスポンスは圧縮しない
+MIN_SIZE = 1024
+
+
+def choose_encoding(accept_encodings):
+    """Accept-Encodingから使用する圧縮方式を選ぶ（brotli優先）"""
+    if brotli is not None and accept_encodings.quality('br') > 0:
+        return 'br'
+    if accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def compress_stream(chunks, encoding):
+    """ストリーミングのレスポンスをチャンクごとに圧縮する（圧縮結果が溜まった分だけ送信）"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+    try:
+        for chunk in chunks:
+            data = process(chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def compress_response(response, encoding):
+    """レスポンス本文を圧縮してContent-Encodingを設定する（小さい本文はそのまま）"""
+    response.vary.add('Accept-Encoding')
+    if encoding is None or response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers['Content-Encoding'] = encoding
+        response.headers.pop('Content-Length', None)
+        return response
+    data = response.get_data()
+    if len(data) < MIN_SIZE:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
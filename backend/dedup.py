@@ -0,0 +1,154 @@
+"""
+アドレス帳の重複の統合
+正規化したメールアドレス（addresses.email_normalized）が同じアドレスを、最も古いアドレスにまとめる
+重複側のグループのメンバー・テンプレートの既定宛先を残すアドレスに付け替えてから、重複側を削除する
+
+    python -m backend.dedup --dry-run     # 重複の件数と例を表示するだけ
+    python -m backend.dedup
+"""
+import argparse
+import sys
+from itertools import groupby
+
+from sqlalchemy import text
+
+try:
+    from backend.models import db, Address
+    from backend.membership import bump_group_versions
+    from backend.changes import record_changes
+except ModuleNotFoundError:
+    from models import db, Address
+    from membership import bump_group_versions
+    from changes import record_changes
+
+# 結果に含める重複のまとまりの例の数
+MAX_REPORTED_CLUSTERS = 100
+# 残すアドレスの空欄を重複側の値で補う列
+FILLED_COLUMNS = ('name', 'organization', 'department')
+
+
+def iter_duplicate_clusters():
+    """
+    重複のまとまりを (正規化したメールアドレス, [行, ...]) で返す（行は古い順、先頭が残すアドレス）
+    email_normalized の索引を1回走査して重複のあるメールアドレスだけを読む
+    """
+    t = Address.__table__
+    duplicated = (db.select(t.c.email_normalized).where(t.c.email_normalized != '')
+                  .group_by(t.c.email_normalized).having(db.func.count() > 1))
+    rows = db.session.execute(
+        db.select(t.c.id, t.c.name, t.c.email, t.c.organization, t.c.department, t.c.email_normalized)
+        .where(t.c.email_normalized.in_(duplicated))
+        .order_by(t.c.email_normalized, t.c.created_at, t.c.id))
+    for key, cluster in groupby(rows, key=lambda row: row.email_normalized):
+        yield key, list(cluster)
+
+
+def dedupe_addresses(dry_run=False):
+    """
+    重複を統合する（コミットは呼び出し側）
+    戻り値: {"clusters": まとまりの数, "removed": 削除したアドレス数, "groups": 付け替えたグループ数,
+             "templates": 付け替えたテンプレート数, "samples": [{"email", "keep", "remove": [...]}, ...]}
+    """
+    mapping = []
+    fills = []
+    samples = []
+    clusters = 0
+    for key, rows in iter_duplicate_clusters():
+        clusters += 1
+        keep, duplicates = rows[0], rows[1:]
+        mapping.extend({'dup': row.id, 'survivor': keep.id} for row in duplicates)
+        if len(samples) < MAX_REPORTED_CLUSTERS:
+            samples.append({'email': keep.email, 'keep': keep.id, 'remove': [row.id for row in duplicates]})
+        # 残すアドレスの空欄は、重複側の最初の空でない値で補う
+        fill = {}
+        for column in FILLED_COLUMNS:
+            if not getattr(keep, column):
+                value = next((getattr(row, column) for row in duplicates if getattr(row, column)), None)
+                if value:
+                    fill[column] = value
+        if fill:
+            fills.append({'_id': keep.id, **fill})
+
+    summary = {'clusters': clusters, 'removed': len(mapping), 'groups': 0, 'templates': 0, 'samples': samples}
+    if dry_run or not mapping:
+        return summary
+
+    # 重複側のID -> 残すアドレスのID（付け替えのUPDATE・DELETEを1文ずつで行うための一時テーブル）
+    db.session.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS dedup_map (dup TEXT PRIMARY KEY, survivor TEXT NOT NULL)"))
+    db.session.execute(text("DELETE FROM dedup_map"))
+    db.session.execute(text("INSERT INTO dedup_map (dup, survivor) VALUES (:dup, :survivor)"), mapping)
+    try:
+        group_ids = _repoint('group_members', 'group_id')
+        template_ids = _repoint('template_recipients', 'template_id')
+        t = Address.__table__
+        for row in fills:
+            db.session.execute(t.update().where(t.c.id == row['_id'])
+                               .values({k: v for k, v in row.items() if k != '_id'}))
+        db.session.execute(text("DELETE FROM addresses WHERE id IN (SELECT dup FROM dedup_map)"))
+    finally:
+        db.session.execute(text("DROP TABLE IF EXISTS temp.dedup_map"))
+
+    bump_group_versions(group_ids)
+    record_changes('groups', group_ids)
+    record_changes('templates', template_ids)
+    record_changes('addresses', [row['_id'] for row in fills])
+    record_changes('addresses', [m['dup'] for m in mapping], 'delete')
+    # 一括UPDATE・DELETEはセッション内のオブジェクトに反映されないため、読み込み済みのものは読み直させる
+    db.session.expire_all()
+    summary['groups'] = len(group_ids)
+    summary['templates'] = len(template_ids)
+    return summary
+
+
+def _repoint(table, owner_column):
+    """
+    重複側を参照している行を残すアドレスに付け替え、付け替えたグループ・テンプレートのIDを返す
+    既に残すアドレスがある場合（主キーが衝突する場合）は重複側の行を削除する（残すアドレスの種別・並び順を優先）
+    """
+    owners = list(db.session.execute(text(
+        f"SELECT DISTINCT {owner_column} FROM {table} WHERE address_id IN (SELECT dup FROM dedup_map)"
+    )).scalars())
+    db.session.execute(text(
+        f"UPDATE OR IGNORE {table} SET address_id = "
+        f"(SELECT survivor FROM dedup_map WHERE dup = {table}.address_id) "
+        f"WHERE address_id IN (SELECT dup FROM dedup_map)"
+    ))
+    db.session.execute(text(f"DELETE FROM {table} WHERE address_id IN (SELECT dup FROM dedup_map)"))
+    return owners
+
+
+def main(argv=None):
+    """CLI: python -m backend.dedup [--dry-run]"""
+    parser = argparse.ArgumentParser(description='アドレス帳の重複（同じメールアドレス）を統合')
+    parser.add_argument('--dry-run', action='store_true', help='統合せずに重複の件数と例を表示する')
+    args = parser.parse_args(argv)
+
+    try:
+        from backend.app import create_app
+        from backend.storage import write_intent
+    except ModuleNotFoundError:
+        from app import create_app
+        from storage import write_intent
+
+    app = create_app()
+    with app.app_context():
+        token = write_intent.set(True)
+        try:
+            summary = dedupe_addresses(dry_run=args.dry_run)
+            db.session.commit()
+        finally:
+            write_intent.reset(token)
+
+    for sample in summary['samples'][:20]:
+        print(f"  {sample['email']}: {sample['keep']} を残して {', '.join(sample['remove'])} を統合")
+    if args.dry_run:
+        print(f"重複: {summary['clusters']}件（統合すると {summary['removed']}件のアドレスを削除）")
+    else:
+        print(f"統合: {summary['clusters']}件 / 削除したアドレス: {summary['removed']}件 / "
+              f"付け替えたグループ: {summary['groups']}件 / テンプレート: {summary['templates']}件")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
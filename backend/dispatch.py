@@ -0,0 +1,495 @@
+"""
+SMTPによる送信キュー（任意機能。OUTLOOK_TOOL_DISPATCH_ENABLED=1 で有効）
+送信するメッセージを data.db の dispatch_jobs テーブルに1通1行で登録し、
+ワーカースレッドが送信時刻になった行を取り出してSMTPで送信する
+
+- ワーカーごとにSMTP接続を保持して複数のメッセージで使い回す（アイドル時間・送信数で切断）
+- 宛先ドメインごとの送信数を1分あたりの上限で抑える（トークンバケット。超えた分は送信時刻を後ろにずらす）
+- 一時的な失敗（4xx・接続エラー）は指数バックオフで再試行し、恒久的な失敗（5xx）と上限回数の失敗は failed にする
+- 起動時に sending のまま残った行（送信中に終了した場合）は queued に戻す（同じメッセージが再送される場合がある）
+
+設定（create_app(config) > 環境変数 OUTLOOK_TOOL_<キー> > 既定値）:
+    DISPATCH_ENABLED                 1 でワーカーを起動する
+    DISPATCH_WORKERS                 ワーカースレッド数（= 同時に使うSMTP接続数）
+    DISPATCH_DOMAIN_RATE_PER_MINUTE  宛先ドメインごとの1分あたりの送信数（0で無制限）
+    DISPATCH_MAX_ATTEMPTS            送信を試みる最大回数
+    SMTP_HOST / SMTP_PORT / SMTP_SECURITY（none / starttls / ssl） / SMTP_USERNAME / SMTP_PASSWORD / SMTP_FROM
+"""
+import logging
+import os
+import random
+import smtplib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from email.utils import make_msgid, parseaddr
+
+try:
+    from backend.models import db, DispatchJob
+    from backend.eml import build_eml, normalize_address, InvalidAddress, CONTROL_CHARS
+    from backend.storage import ENV_PREFIX, write_intent
+except ModuleNotFoundError:
+    from models import db, DispatchJob
+    from eml import build_eml, normalize_address, InvalidAddress, CONTROL_CHARS
+    from storage import ENV_PREFIX, write_intent
+
+DEFAULTS = {
+    'DISPATCH_ENABLED': 0,
+    'DISPATCH_WORKERS': 2,
+    'DISPATCH_DOMAIN_RATE_PER_MINUTE': 60,
+    # 上限に達するまで続けて送信できる数
+    'DISPATCH_DOMAIN_BURST': 10,
+    'DISPATCH_MAX_ATTEMPTS': 5,
+    # 再試行の間隔: RETRY_BASE_SECONDS * 2^(試行回数-1)（最大 RETRY_MAX_SECONDS）
+    'DISPATCH_RETRY_BASE_SECONDS': 30.0,
+    'DISPATCH_RETRY_MAX_SECONDS': 3600.0,
+    # 送信するジョブがないときに次を確認するまでの秒数（登録時はすぐに起こす）
+    'DISPATCH_POLL_SECONDS': 2.0,
+    # SMTP接続を使い回す条件
+    'DISPATCH_CONNECTION_IDLE_SECONDS': 30.0,
+    'DISPATCH_MESSAGES_PER_CONNECTION': 100,
+    'SMTP_HOST': 'localhost',
+    'SMTP_PORT': 25,
+    'SMTP_SECURITY': 'none',
+    'SMTP_USERNAME': '',
+    'SMTP_PASSWORD': '',
+    'SMTP_FROM': '',
+    'SMTP_TIMEOUT': 30.0,
+}
+
+CHOICES = {
+    'SMTP_SECURITY': ('none', 'starttls', 'ssl'),
+}
+
+STATUSES = ('queued', 'sending', 'sent', 'failed', 'cancelled')
+# 1回の登録で受け付けるメッセージ数
+MAX_ENQUEUE = 10000
+# 一覧で返すジョブ数
+DEFAULT_LIST_LIMIT = 100
+MAX_LIST_LIMIT = 1000
+# 登録時にまとめてINSERTする行数
+INSERT_CHUNK = 500
+
+logger = logging.getLogger('outlook_tool.dispatch')
+
+
+def load_settings(config=None, environ=None):
+    environ = os.environ if environ is None else environ
+    config = config or {}
+    settings = {}
+    for key, default in DEFAULTS.items():
+        value = config.get(key, environ.get(ENV_PREFIX + key, default))
+        if isinstance(default, (int, float)):
+            try:
+                value = type(default)(value)
+            except (TypeError, ValueError):
+                raise ValueError(f'{key} には数値を指定してください: {value!r}')
+        else:
+            value = str(value)
+            if key in CHOICES:
+                value = value.lower()
+                if value not in CHOICES[key]:
+                    raise ValueError(f'{key} は {"/".join(CHOICES[key])} のいずれかを指定してください: {value!r}')
+        settings[key] = value
+    return settings
+
+
+class DomainRateLimiter:
+    """宛先ドメインごとのトークンバケット（ワーカー間で共有）"""
+
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, float(burst))
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def reserve(self, domains):
+        """全ドメインの送信枠を確保できれば0、できなければ確保できるまでの秒数を返す（その場合は消費しない）"""
+        if self.rate <= 0 or not domains:
+            return 0.0
+        now = time.monotonic()
+        with self.lock:
+            wait = 0.0
+            for domain in domains:
+                tokens, updated = self.buckets.get(domain, (self.capacity, now))
+                tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+                self.buckets[domain] = (tokens, now)
+                if tokens < 1.0:
+                    wait = max(wait, (1.0 - tokens) / self.rate)
+            if wait:
+                return wait
+            for domain in domains:
+                tokens, _ = self.buckets[domain]
+                self.buckets[domain] = (tokens - 1.0, now)
+            return 0.0
+
+
+class SmtpConnection:
+    """ワーカー1つ分のSMTP接続（接続は最初の送信時に開き、以降のメッセージで使い回す）"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.smtp = None
+        self.sent = 0
+        self.last_used = 0.0
+        # 開いた接続の数（確認用）
+        self.connections = 0
+
+    def _connect(self):
+        s = self.settings
+        if s['SMTP_SECURITY'] == 'ssl':
+            smtp = smtplib.SMTP_SSL(s['SMTP_HOST'], s['SMTP_PORT'], timeout=s['SMTP_TIMEOUT'])
+        else:
+            smtp = smtplib.SMTP(s['SMTP_HOST'], s['SMTP_PORT'], timeout=s['SMTP_TIMEOUT'])
+        try:
+            smtp.ehlo()
+            if s['SMTP_SECURITY'] == 'starttls':
+                smtp.starttls()
+                smtp.ehlo()
+            if s['SMTP_USERNAME']:
+                smtp.login(s['SMTP_USERNAME'], s['SMTP_PASSWORD'])
+        except Exception:
+            smtp.close()
+            raise
+        self.smtp = smtp
+        self.sent = 0
+        self.connections += 1
+
+    def send(self, sender, recipients, data):
+        """送信して、受け付けられなかった宛先 {アドレス: (コード, メッセージ)} を返す"""
+        if self.smtp is not None and (self.sent >= self.settings['DISPATCH_MESSAGES_PER_CONNECTION']
+                                      or self.idle_for() >= self.settings['DISPATCH_CONNECTION_IDLE_SECONDS']):
+            self.close()
+        if self.smtp is None:
+            self._connect()
+            reused = False
+        else:
+            reused = True
+        try:
+            refused = self.smtp.sendmail(sender, recipients, data)
+        except smtplib.SMTPServerDisconnected:
+            self.close()
+            if not reused:
+                raise
+            # 使い回した接続がサーバー側で切断されていた場合は1回だけ接続し直す
+            self._connect()
+            refused = self.smtp.sendmail(sender, recipients, data)
+        self.sent += 1
+        self.last_used = time.monotonic()
+        return refused
+
+    def idle_for(self):
+        return time.monotonic() - self.last_used if self.last_used else 0.0
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self.smtp.close()
+            self.smtp = None
+
+
+def classify_error(error):
+    """送信エラーを (再試行するか, 記録するメッセージ) に分類する"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        detail = '; '.join(f'{addr}: {code} {_text(msg)}' for addr, (code, msg) in error.recipients.items())
+        return any(400 <= code < 500 for code in codes), f'宛先を受け付けられませんでした: {detail}'
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500, f'{error.smtp_code} {_text(error.smtp_error)}'
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)):
+        return True, f'SMTPサーバーに接続できませんでした: {error}'
+    return False, f'{type(error).__name__}: {error}'
+
+
+def _text(value):
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) else str(value)
+
+
+def retry_delay(attempts, settings):
+    """attempts回目の失敗の後、次に送信するまでの秒数（同時に失敗したジョブが一斉に再送しないよう揺らす）"""
+    delay = min(settings['DISPATCH_RETRY_MAX_SECONDS'], settings['DISPATCH_RETRY_BASE_SECONDS'] * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def recipient_addresses(recipients):
+    """エンベロープの宛先（To・Cc・Bccのメールアドレス、重複なし）"""
+    result = []
+    for key in ('to', 'cc', 'bcc'):
+        for r in recipients.get(key) or []:
+            email = (r.get('email') if isinstance(r, dict) else parseaddr(r)[1]) or ''
+            email = email.strip()
+            if email and email not in result:
+                result.append(email)
+    return result
+
+
+def domains_of(addresses):
+    return sorted({a.rsplit('@', 1)[-1].lower() for a in addresses})
+
+
+class Dispatcher:
+    """ワーカースレッドの管理"""
+
+    def __init__(self, app, settings):
+        self.app = app
+        self.settings = settings
+        self.enabled = bool(settings['DISPATCH_ENABLED'])
+        self.limiter = DomainRateLimiter(settings['DISPATCH_DOMAIN_RATE_PER_MINUTE'],
+                                         settings['DISPATCH_DOMAIN_BURST'])
+        self.wakeup = threading.Condition()
+        self.stopping = threading.Event()
+        self.threads = []
+        self.connections = []
+
+    def start(self):
+        if self.threads:
+            return
+        self.stopping.clear()
+        with self.app.app_context():
+            recovered = recover_interrupted()
+        if recovered:
+            logger.warning('送信中のまま終了したジョブ %d件を再送します', recovered)
+        for i in range(max(1, self.settings['DISPATCH_WORKERS'])):
+            connection = SmtpConnection(self.settings)
+            thread = threading.Thread(target=self._run, args=(connection,), name=f'dispatch-{i}', daemon=True)
+            self.connections.append(connection)
+            self.threads.append(thread)
+            thread.start()
+
+    def stop(self, timeout=10.0):
+        """送信中のメッセージが終わるのを待ってからワーカーを止める"""
+        self.stopping.set()
+        self.wake()
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self.threads = []
+        self.connections = []
+
+    def wake(self):
+        with self.wakeup:
+            self.wakeup.notify_all()
+
+    def alive(self):
+        return sum(1 for t in self.threads if t.is_alive())
+
+    def _run(self, connection):
+        with self.app.app_context():
+            # ジョブの取り出し・更新は書き込みなので BEGIN IMMEDIATE で開始する
+            write_intent.set(True)
+            try:
+                while not self.stopping.is_set():
+                    try:
+                        job = claim_next()
+                    except Exception:
+                        db.session.rollback()
+                        logger.exception('送信キューを読み込めませんでした')
+                        job = None
+                    if job is None:
+                        if connection.smtp is not None and (
+                                connection.idle_for() >= self.settings['DISPATCH_CONNECTION_IDLE_SECONDS']):
+                            connection.close()
+                        with self.wakeup:
+                            if not self.stopping.is_set():
+                                self.wakeup.wait(self.settings['DISPATCH_POLL_SECONDS'])
+                        continue
+                    try:
+                        self.process(job, connection)
+                    except Exception:
+                        db.session.rollback()
+                        logger.exception('ジョブ %s の処理中にエラーが発生しました', job.id)
+            finally:
+                connection.close()
+                db.session.remove()
+
+    def process(self, job, connection):
+        recipients = recipient_addresses(job.recipients)
+        if not recipients:
+            finish(job.id, 'failed', job.attempts, '宛先がありません')
+            return
+        wait = self.limiter.reserve(domains_of(recipients))
+        if wait:
+            # 送信枠が空くまで後ろにずらす（試行回数には数えない）
+            requeue(job.id, job.attempts, wait, job.last_error)
+            return
+
+        attempts = job.attempts + 1
+        try:
+            sender = _recipient(job.sender)
+            message_id = job.message_id or make_msgid(domain=sender['email'].rsplit('@', 1)[-1] or None)
+            data = build_eml({'subject': job.subject, 'body': job.body, **job.recipients}, sender,
+                             draft=False, message_id=message_id)
+        except InvalidAddress as e:
+            # 登録時の検証より前に登録されたジョブなど。再送しても送れないので失敗にする
+            finish(job.id, 'failed', attempts, str(e))
+            return
+        try:
+            refused = connection.send(sender['email'], recipients, data)
+        except Exception as e:
+            temporary, reason = classify_error(e)
+            # 応答コードのあるエラー（421を除く）は接続をそのまま使い続けられる
+            if (not isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused))
+                    or getattr(e, 'smtp_code', None) == 421):
+                connection.close()
+            if temporary and attempts < self.settings['DISPATCH_MAX_ATTEMPTS']:
+                delay = retry_delay(attempts, self.settings)
+                logger.info('ジョブ %s を %.0f秒後に再送します（%d回目）: %s', job.id, delay, attempts, reason)
+                requeue(job.id, attempts, delay, reason, message_id)
+            else:
+                logger.warning('ジョブ %s の送信に失敗しました（%d回目）: %s', job.id, attempts, reason)
+                finish(job.id, 'failed', attempts, reason, message_id)
+            return
+        note = None
+        if refused:
+            note = '一部の宛先を受け付けられませんでした: ' + '; '.join(
+                f'{addr}: {code} {_text(msg)}' for addr, (code, msg) in refused.items())
+        finish(job.id, 'sent', attempts, note, message_id, sent_at=datetime.utcnow())
+
+
+def recover_interrupted():
+    t = DispatchJob.__table__
+    token = write_intent.set(True)
+    try:
+        count = db.session.execute(t.update().where(t.c.status == 'sending').values(status='queued')).rowcount
+        db.session.commit()
+    finally:
+        write_intent.reset(token)
+    return count
+
+
+def claim_next():
+    """送信時刻になったqueuedのジョブを1件 sending にして取り出す（なければNone）"""
+    t = DispatchJob.__table__
+    now = datetime.utcnow()
+    next_id = (db.select(t.c.id).where(t.c.status == 'queued', t.c.next_attempt_at <= now)
+               .order_by(t.c.next_attempt_at, t.c.id).limit(1).scalar_subquery())
+    job = db.session.execute(
+        t.update().where(t.c.id == next_id, t.c.status == 'queued').values(status='sending')
+        .returning(t.c.id, t.c.sender, t.c.recipients, t.c.subject, t.c.body, t.c.attempts, t.c.message_id,
+                   t.c.last_error)
+    ).first()
+    db.session.commit()
+    return job
+
+
+def requeue(job_id, attempts, delay, error, message_id=None):
+    t = DispatchJob.__table__
+    values = {'status': 'queued', 'attempts': attempts, 'last_error': error,
+              'next_attempt_at': datetime.utcnow() + timedelta(seconds=delay)}
+    if message_id:
+        values['message_id'] = message_id
+    db.session.execute(t.update().where(t.c.id == job_id).values(**values))
+    db.session.commit()
+
+
+def finish(job_id, status, attempts, error, message_id=None, sent_at=None):
+    t = DispatchJob.__table__
+    db.session.execute(t.update().where(t.c.id == job_id).values(
+        status=status, attempts=attempts, last_error=error, message_id=message_id, sent_at=sent_at))
+    db.session.commit()
+
+
+def enqueue(messages, sender):
+    """
+    メッセージ（{'to', 'cc', 'bcc', 'subject', 'body', 'groupId'}）のイテレータを送信キューに登録する（コミットは呼び出し側）
+    宛先・送信元のメールアドレスは登録前に検証し、使えないもの（制御文字を含むものなど）があれば
+    1件も登録せずにValueError（InvalidAddress）にする
+    戻り値: (バッチID, 登録した件数, 宛先がなく登録しなかったメッセージの番号)
+    """
+    _recipient(sender)
+    batch_id = uuid.uuid4().hex
+    now = datetime.utcnow()
+    rows = []
+    count = 0
+    skipped = []
+    for index, message in enumerate(messages):
+        if index >= MAX_ENQUEUE:
+            raise ValueError(f'一度に登録できるメッセージは{MAX_ENQUEUE}件までです')
+        try:
+            recipients = {key: [r for r in map(_recipient, message.get(key) or []) if r['email']]
+                          for key in ('to', 'cc', 'bcc')}
+        except InvalidAddress as e:
+            raise InvalidAddress(f'{index + 1}件目のメッセージ: {e}') from None
+        if not recipient_addresses(recipients):
+            skipped.append(index)
+            continue
+        rows.append({'batch_id': batch_id, 'status': 'queued', 'sender': sender, 'recipients': recipients,
+                     'subject': message.get('subject') or '', 'body': message.get('body') or '',
+                     'group_id': message.get('groupId'), 'attempts': 0, 'next_attempt_at': now,
+                     'created_at': now})
+        if len(rows) >= INSERT_CHUNK:
+            count += _insert(rows)
+    count += _insert(rows)
+    return batch_id, count, skipped
+
+
+def _recipient(value):
+    """{'name', 'email'} または "名前 <email>" を {'name', 'email'} にする（メールアドレスは検証・正規化する。空は ''）"""
+    if isinstance(value, dict):
+        name, email = value.get('name') or '', value.get('email') or ''
+    else:
+        value = str(value)
+        # parseaddrは改行の後ろの部分をアドレスとして取り出すことがあるため、先に制御文字を確認する
+        if CONTROL_CHARS.search(value.strip()):
+            raise InvalidAddress(f'宛先に制御文字が含まれています: {value!r}')
+        name, email = parseaddr(value)
+        if not email and value.strip():
+            email = value
+    return {'name': str(name), 'email': normalize_address(email) if str(email).strip() else ''}
+
+
+def _insert(rows):
+    if not rows:
+        return 0
+    db.session.execute(DispatchJob.__table__.insert(), rows)
+    count = len(rows)
+    rows.clear()
+    return count
+
+
+def job_json(job, detail=False):
+    result = {
+        'id': job.id,
+        'batchId': job.batch_id,
+        'status': job.status,
+        'to': job.recipients.get('to', []),
+        'cc': job.recipients.get('cc', []),
+        'bcc': job.recipients.get('bcc', []),
+        'subject': job.subject,
+        'groupId': job.group_id,
+        'attempts': job.attempts,
+        'lastError': job.last_error,
+        'messageId': job.message_id,
+        'createdAt': _iso(job.created_at),
+        'nextAttemptAt': _iso(job.next_attempt_at) if job.status == 'queued' else None,
+        'sentAt': _iso(job.sent_at),
+    }
+    if detail:
+        result['body'] = job.body
+    return result
+
+
+def _iso(value):
+    return value.isoformat(timespec='seconds') + 'Z' if value else None
+
+
+def status_counts(batch_id=None):
+    t = DispatchJob.__table__
+    query = db.select(t.c.status, db.func.count()).group_by(t.c.status)
+    if batch_id:
+        query = query.where(t.c.batch_id == batch_id)
+    counts = {s: 0 for s in STATUSES}
+    counts.update({status: count for status, count in db.session.execute(query)})
+    return counts
+
+
+def init_app(app, settings):
+    """Dispatcherを作成し、有効な場合はワーカーを起動する"""
+    dispatcher = Dispatcher(app, settings)
+    app.extensions['dispatcher'] = dispatcher
+    if dispatcher.enabled:
+        dispatcher.start()
+    return dispatcher
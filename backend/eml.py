@@ -0,0 +1,187 @@
+"""
+.emlファイル（RFC 5322）の生成とZIPでのストリーミング出力
+mailto: URLの長さ制限を受けないよう、件名・本文・宛先をMIME形式（UTF-8）で書き出す
+X-Unsent: 1 を付けるため、Outlookで開くと送信前の下書きとして表示される
+"""
+import base64
+import re
+import zipfile
+from datetime import datetime
+from email.errors import HeaderParseError
+from email.header import Header
+from email.headerregistry import Address
+from email.utils import formataddr, formatdate, parseaddr
+
+# ZIP内で使えないファイル名の文字
+UNSAFE_FILENAME = re.compile(r'[\\/:*?"<>|\r\n\t]+')
+MAX_FILENAME_LENGTH = 80
+CRLF = '\r\n'
+# ヘッダーに入れてはいけない制御文字（CR・LFによるヘッダーの追加を防ぐ）
+CONTROL_CHARS = re.compile(r'[\x00-\x1f\x7f]')
+# 宛先の誤りで書き出せなかったメッセージを一覧にするZIP内のファイル
+ERRORS_FILENAME = 'errors.txt'
+
+
+class InvalidAddress(ValueError):
+    """ヘッダー・SMTPのエンベロープに使えないメールアドレス"""
+
+
+def normalize_address(email):
+    """
+    メールアドレスを検証し、ASCIIのaddr-specにして返す（日本語ドメインはIDNAで変換する）
+    制御文字を含むもの・形式が正しくないもの・ローカル部にASCII以外を含むものはInvalidAddress
+    """
+    email = (email or '').strip()
+    if not email:
+        raise InvalidAddress('メールアドレスが空です')
+    if CONTROL_CHARS.search(email):
+        raise InvalidAddress(f'メールアドレスに制御文字が含まれています: {email!r}')
+    try:
+        address = Address(addr_spec=email)
+        username, domain = address.username, address.domain
+        if not username or not domain or not username.isascii():
+            raise ValueError
+        if not domain.isascii():
+            domain = domain.encode('idna').decode('ascii')
+        return Address(username=username, domain=domain).addr_spec
+    except (ValueError, IndexError, HeaderParseError):
+        raise InvalidAddress(f'メールアドレスの形式が正しくありません: {email!r}') from None
+
+
+def _encode_header(value):
+    """日本語を含むヘッダー値をRFC 2047形式（UTF-8 / base64）にする"""
+    value = ' '.join((value or '').splitlines())
+    if value.isascii():
+        return value
+    return Header(value, 'utf-8').encode(linesep=CRLF)
+
+
+def _format_address(recipient):
+    """
+    {'name', 'email'} または文字列（"名前 <email>"）をヘッダー用のアドレス表記に変換
+    メールアドレスが空なら ''、使えないメールアドレスはInvalidAddress
+    """
+    if isinstance(recipient, str):
+        if CONTROL_CHARS.search(recipient.strip()):
+            raise InvalidAddress(f'宛先に制御文字が含まれています: {recipient!r}')
+        name, email = parseaddr(recipient)
+        if not email and recipient.strip():
+            raise InvalidAddress(f'宛先の形式が正しくありません: {recipient!r}')
+    else:
+        name, email = recipient.get('name') or '', recipient.get('email') or ''
+    if not email.strip():
+        return ''
+    name = ' '.join(CONTROL_CHARS.sub(' ', name).split())
+    return formataddr((name, normalize_address(email)), charset='utf-8')
+
+
+def validate_recipients(message):
+    """メッセージの宛先をすべて検証する（使えないメールアドレスがあればInvalidAddress）"""
+    for key in ('to', 'cc', 'bcc'):
+        for recipient in message.get(key) or []:
+            _format_address(recipient)
+
+
+def build_eml(message, sender=None, draft=True, message_id=None):
+    """
+    1通分の.emlをバイト列で返す
+    message: {'subject', 'body', 'to', 'cc', 'bcc'}（宛先は {'name', 'email'} または文字列のリスト）
+    使えないメールアドレス（制御文字を含むものなど）がある場合はInvalidAddress
+    draft=False はSMTPで送信する本文（X-Unsent・Bccヘッダーを付けない）
+    email.policyによるヘッダーの折り返し処理は1通あたり数ミリ秒かかるため、ヘッダーは直接組み立てる
+    """
+    headers = [('X-Unsent', '1')] if draft else []
+    headers.append(('Date', formatdate(localtime=True)))
+    if message_id:
+        headers.append(('Message-ID', message_id))
+    if sender:
+        headers.append(('From', _format_address(sender)))
+    for key in ('to', 'cc', 'bcc') if draft else ('to', 'cc'):
+        addresses = [a for a in (_format_address(r) for r in message.get(key) or []) if a]
+        if addresses:
+            headers.append((key.capitalize(), (',' + CRLF + ' ').join(addresses)))
+    headers += [
+        ('Subject', _encode_header(message.get('subject'))),
+        ('MIME-Version', '1.0'),
+        ('Content-Type', 'text/plain; charset="utf-8"'),
+        # 日本語を含む本文はUTF-8のbase64にして、7bitのみを扱うクライアントでも崩れないようにする
+        ('Content-Transfer-Encoding', 'base64'),
+    ]
+    body = CRLF.join((message.get('body') or '').splitlines()) + CRLF
+    encoded = base64.encodebytes(body.encode('utf-8')).replace(b'\n', b'\r\n')
+    head = ''.join(f'{name}: {value}{CRLF}' for name, value in headers)
+    return (head + CRLF).encode('ascii') + encoded
+
+
+def eml_filename(message, index=None):
+    """グループ名（なければ件名）から.emlのファイル名を作る"""
+    base = message.get('groupName') or message.get('subject') or 'message'
+    base = UNSAFE_FILENAME.sub('_', base).strip(' ._') or 'message'
+    base = base[:MAX_FILENAME_LENGTH]
+    if index is not None:
+        base = f'{index:05d}_{base}'
+    return base + '.eml'
+
+
+class _ChunkBuffer:
+    """
+    ZipFileの書き込み先（シーク不可のストリームとして扱われる）
+    書き込まれたバイト列をため、take()で取り出すたびに空にする
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_zip(entries):
+    """
+    (ファイル名, バイト列) のイテレータをZIPとして少しずつ出力する
+    1ファイル書き込むごとに出力するため、ZIP全体をメモリに載せない
+    """
+    buffer = _ChunkBuffer()
+    now = datetime.now().timetuple()[:6]
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, data in entries:
+            info = zipfile.ZipInfo(name, date_time=now)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zf.writestr(info, data)
+            chunk = buffer.take()
+            if chunk:
+                yield chunk
+    # 中央ディレクトリ
+    chunk = buffer.take()
+    if chunk:
+        yield chunk
+
+
+def iter_eml_entries(messages, sender=None):
+    """
+    差し込み結果（message行）から (ファイル名, .emlのバイト列) を順に返す（error行は除外）
+    宛先のメールアドレスが使えないメッセージは書き出さず、最後に errors.txt にまとめる
+    """
+    index = 0
+    errors = []
+    for message in messages:
+        if message.get('type', 'message') != 'message':
+            continue
+        index += 1
+        try:
+            data = build_eml(message, sender)
+        except InvalidAddress as e:
+            errors.append(f'{eml_filename(message, index)}: {e}')
+            continue
+        yield eml_filename(message, index), data
+    if errors:
+        yield ERRORS_FILENAME, (CRLF.join(errors) + CRLF).encode('utf-8')
@@ -0,0 +1,187 @@
+"""
+アドレス帳のエクスポート（CSV / vCard / JSON Lines）
+SQLiteのカーソルから一定件数ずつ読み、その場でエンコードして送る（全件をメモリに置かない）
+
+    python -m backend.export --format csv -o addresses.csv
+    python -m backend.export --format vcf --group grp-000001 -o group.vcf
+    python -m backend.export --format jsonl --organization 自社 > addresses.jsonl
+
+CSVはExcel（日本語環境）で文字化けしないようにUTF-8のBOMを付ける（--no-bom / ?bom=0 で付けない）
+列は name, email, organization, department, id の順で、そのまま一括登録（POST /api/addresses/bulk）に使える
+"""
+import argparse
+import codecs
+import contextlib
+import csv
+import io
+import sys
+
+try:
+    from backend.models import db, Address, GroupMember
+    from backend.serialization import batched, iter_ndjson, STREAM_BATCH, CHUNK_SIZE, NDJSON_MIMETYPE
+except ModuleNotFoundError:
+    from models import db, Address, GroupMember
+    from serialization import batched, iter_ndjson, STREAM_BATCH, CHUNK_SIZE, NDJSON_MIMETYPE
+
+FIELDS = ('id', 'name', 'email', 'organization', 'department')
+# CSVの列（一括登録と同じく 名前, メールアドレス, 組織, 部署 を先頭に置く）
+CSV_COLUMNS = ('name', 'email', 'organization', 'department', 'id')
+# 形式 -> (Content-Type（text/* にはFlaskが charset=utf-8 を付ける）, 拡張子)
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'vcf': ('text/vcard', 'vcf'),
+    'jsonl': (NDJSON_MIMETYPE, 'jsonl'),
+}
+# vCardの1行の最大オクテット数（超える分は折り返す）
+VCARD_LINE_OCTETS = 75
+
+
+def export_statement(organization=None, department=None, group_id=None):
+    """
+    エクスポートする行（FIELDSの順のタプル）のSELECT
+    全件は作成順（created_at, id）、グループ指定時はメンバーの並び順
+    """
+    t = Address.__table__
+    statement = db.select(*(t.c[f] for f in FIELDS))
+    if group_id:
+        m = GroupMember.__table__
+        statement = (statement.join(m, m.c.address_id == t.c.id)
+                     .where(m.c.group_id == group_id).order_by(m.c.order, t.c.id))
+    else:
+        statement = statement.order_by(t.c.created_at, t.c.id)
+    if organization:
+        statement = statement.where(t.c.organization == organization)
+    if department:
+        statement = statement.where(t.c.department == department)
+    return statement.execution_options(yield_per=STREAM_BATCH)
+
+
+def iter_rows(statement):
+    """STREAM_BATCH件ずつのタプルのリストを返す（最初の取り出しまでクエリは実行しない）"""
+    yield from batched(db.session.execute(statement))
+
+
+def iter_csv(batches, bom=True):
+    index = [FIELDS.index(c) for c in CSV_COLUMNS]
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(CSV_COLUMNS)
+    buffer = bytearray(codecs.BOM_UTF8 if bom else b'')
+    for batch in batches:
+        writer.writerows([row[i] for i in index] for row in batch)
+        buffer += text.getvalue().encode('utf-8')
+        text.seek(0)
+        text.truncate()
+        if len(buffer) >= CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += text.getvalue().encode('utf-8')
+    if buffer:
+        yield bytes(buffer)
+
+
+def _vcard_escape(value):
+    """vCardの値のエスケープ（\\ , ; 改行）。ほとんどの値は対象の文字を含まないので、含む場合だけ置換する"""
+    value = value or ''
+    if '\\' in value or ',' in value or ';' in value or '\n' in value or '\r' in value:
+        value = (value.replace('\\', '\\\\').replace(',', '\\,').replace(';', '\\;')
+                 .replace('\r\n', '\\n').replace('\n', '\\n').replace('\r', '\\n'))
+    return value
+
+
+def _vcard_line(line):
+    """1行をUTF-8で75オクテットごとに折り返す（続きの行は空白で始める。文字の途中では切らない）"""
+    data = line.encode('utf-8')
+    if len(data) <= VCARD_LINE_OCTETS:
+        return data + b'\r\n'
+    parts = []
+    start = 0
+    limit = VCARD_LINE_OCTETS
+    while len(data) - start > limit:
+        end = start + limit
+        # UTF-8の継続バイト（10xxxxxx）の前では切らない
+        while data[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(data[start:end])
+        start = end
+        limit = VCARD_LINE_OCTETS - 1
+    parts.append(data[start:])
+    return b'\r\n '.join(parts) + b'\r\n'
+
+
+def vcard(row):
+    """アドレス1件のvCard 3.0（氏名は分割せずに姓の欄にも入れる）"""
+    aid, name, email, organization, department = row
+    name = _vcard_escape(name)
+    lines = [f'FN:{name}', f'N:{name};;;;']
+    if email:
+        lines.append(f'EMAIL;TYPE=INTERNET:{_vcard_escape(email)}')
+    if organization or department:
+        # ORG: 組織;部署
+        lines.append(f'ORG:{_vcard_escape(organization)}' + (f';{_vcard_escape(department)}' if department else ''))
+    lines.append(f'UID:{_vcard_escape(aid)}')
+    return b'BEGIN:VCARD\r\nVERSION:3.0\r\n' + b''.join(map(_vcard_line, lines)) + b'END:VCARD\r\n'
+
+
+def iter_vcf(batches):
+    buffer = bytearray()
+    for batch in batches:
+        for row in batch:
+            buffer += vcard(row)
+        if len(buffer) >= CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def iter_export(fmt, batches, bom=True):
+    """batches（iter_rowsの戻り値）を形式fmtのバイト列として少しずつ返す"""
+    if fmt == 'csv':
+        return iter_csv(batches, bom)
+    if fmt == 'vcf':
+        return iter_vcf(batches)
+    return iter_ndjson([dict(zip(FIELDS, row)) for row in batch] for batch in batches)
+
+
+def main(argv=None):
+    """CLI: python -m backend.export --format csv|vcf|jsonl [-o FILE] [--organization] [--department] [--group]"""
+    parser = argparse.ArgumentParser(description='アドレス帳をCSV / vCard / JSON Linesに書き出す')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('-o', '--output', help='出力先のファイル（省略時は標準出力）')
+    parser.add_argument('--organization', help='この組織のアドレスだけ')
+    parser.add_argument('--department', help='この部署のアドレスだけ')
+    parser.add_argument('--group', help='このグループのメンバーだけ（グループの並び順）')
+    parser.add_argument('--no-bom', action='store_true', help='CSVにBOMを付けない')
+    args = parser.parse_args(argv)
+
+    try:
+        from backend.app import create_app
+        from backend.models import Group
+    except ModuleNotFoundError:
+        from app import create_app
+        from models import Group
+
+    # 標準出力に書き出す場合があるため、マイグレーションのメッセージは標準エラーに出す
+    with contextlib.redirect_stdout(sys.stderr):
+        app = create_app()
+    with app.app_context():
+        if args.group and db.session.get(Group, args.group) is None:
+            print(f'グループが見つかりません: {args.group}', file=sys.stderr)
+            return 1
+        statement = export_statement(args.organization, args.department, args.group)
+        chunks = iter_export(args.format, iter_rows(statement), bom=not args.no_bom)
+        out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if args.output:
+                out.close()
+            else:
+                out.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+アドレス一括インポート
+CSV/TSVテキストまたはJSON配列を解析し、1トランザクション内でまとめて登録する
+メールアドレス（正規化して比較）が既存のアドレス・ファイル内の前の行と同じ行は、そのアドレスの更新として扱う
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import datetime
+
+try:
+    from backend.models import db, Address, gen_id, normalize_email
+    from backend.changes import record_changes
+except ModuleNotFoundError:
+    from models import db, Address, gen_id, normalize_email
+    from changes import record_changes
+
+# executemanyで一度に投入する行数
+BATCH_SIZE = 1000
+# 組織が空の場合の既定値（DataImport.tsxと同じ）
+DEFAULT_ORGANIZATION = '自社'
+
+
+def split_line(line):
+    """1行を列に分割: タブ区切りを優先し、2列未満ならカンマ区切りとして解析"""
+    parts = next(csv.reader([line], delimiter='\t'), [])
+    if len(parts) < 2:
+        parts = next(csv.reader([line]), [])
+    return [strip_quotes(p.strip()) for p in parts]
+
+
+def strip_quotes(value):
+    if value.startswith('"'):
+        value = value[1:]
+    if value.endswith('"'):
+        value = value[:-1]
+    return value
+
+
+def build_record(parts):
+    """
+    列リストからアドレス1件を組み立てる
+    戻り値: (record, None) または (None, 却下理由)
+    """
+    if len(parts) < 2:
+        return None, 'too_few_columns'
+
+    name = parts[0]
+    email = parts[1]
+    org = (parts[2] if len(parts) > 2 else '') or DEFAULT_ORGANIZATION
+    dept = (parts[3] if len(parts) > 3 else '') or ''
+
+    # メールアドレスが先頭列にある場合は入れ替え
+    if '@' in name:
+        name, email = email, name
+
+    # ヘッダー行 / メールアドレスでない行を除外
+    if 'email' in email.lower():
+        return None, 'header'
+    if '@' not in email:
+        return None, 'invalid_email'
+
+    return {
+        'name': name,
+        'email': email,
+        'organization': org,
+        'department': dept,
+    }, None
+
+
+def iter_text_records(lines):
+    """CSV/TSVの行イテレータを1行ずつ解析: (行番号, record, 却下理由) を返す"""
+    for row_no, line in enumerate(lines, start=1):
+        line = line.rstrip('\r\n')
+        if line.strip() == '':
+            continue
+        record, reason = build_record(split_line(line))
+        yield row_no, record, reason
+
+
+def iter_json_records(items):
+    """JSON配列（Address形式のオブジェクト）を解析: (行番号, record, 却下理由) を返す"""
+    for row_no, item in enumerate(items, start=1):
+        if not isinstance(item, dict):
+            yield row_no, None, 'invalid_item'
+            continue
+        # IDは文字列のみ（数値などはその行だけ却下する）
+        item_id = item.get('id')
+        if item_id is not None and not isinstance(item_id, str):
+            yield row_no, None, 'invalid_id'
+            continue
+        parts = [str(item.get(k) or '').strip()
+                 for k in ('name', 'email', 'organization', 'department')]
+        record, reason = build_record(parts)
+        if record is not None and (item_id or '').strip():
+            record['id'] = item_id.strip()
+        yield row_no, record, reason
+
+
+def import_records(records, batch_size=BATCH_SIZE):
+    """
+    解析済みレコードを一括登録する
+    BATCH_SIZE行ごとに既存のアドレスをメールアドレスの索引で検索し、新規はINSERT・既存はUPDATEを
+    executemanyでまとめて実行して、最後に1回だけコミットする
+    新規の行のIDが既存のアドレスやこのインポートで登録した行と重なる場合は、その行だけ duplicate_id で却下する
+    途中で失敗した場合は全件ロールバックする
+    """
+    table = Address.__table__
+    update = (table.update().where(table.c.id == db.bindparam('_id'))
+              .values(name=db.bindparam('name'), organization=db.bindparam('organization'),
+                      department=db.bindparam('department')))
+    # 正規化したメールアドレス -> このインポートで登録・更新したアドレスのID
+    seen = {}
+    # このインポートで新規に登録したアドレスのID
+    inserted_ids = set()
+    counts = {'updated': 0}
+
+    def flush(batch):
+        ids = list({r['id'] for r, _ in batch} - inserted_ids)
+        taken = set()
+        if ids:
+            taken = set(db.session.execute(db.select(table.c.id).where(table.c.id.in_(ids))).scalars())
+        keys = list({r['email_normalized'] for r, _ in batch} - seen.keys())
+        existing = {}
+        if keys:
+            # 同じメールアドレスのアドレスが複数ある場合は最も古いものを更新する
+            rows = db.session.execute(
+                db.select(table.c.email_normalized, table.c.id).where(table.c.email_normalized.in_(keys))
+                .order_by(table.c.created_at.desc(), table.c.id.desc()))
+            existing = {key: address_id for key, address_id in rows}
+        inserts, updates = [], []
+        for record, result in batch:
+            key = record['email_normalized']
+            target = seen.get(key) or existing.get(key)
+            if target is None:
+                if record['id'] in taken or record['id'] in inserted_ids:
+                    # 指定されたIDが他のアドレスで使われている（メールアドレスは新規なので更新先にはしない）
+                    result.update(status='rejected', reason='duplicate_id')
+                    del result['id']
+                    continue
+                seen[key] = record['id']
+                inserted_ids.add(record['id'])
+                inserts.append(record)
+                continue
+            seen[key] = target
+            updates.append({'_id': target, 'name': record['name'], 'organization': record['organization'],
+                            'department': record['department']})
+            result['id'] = target
+            result['updated'] = True
+        if inserts:
+            db.session.execute(table.insert(), inserts)
+        if updates:
+            db.session.execute(update, updates)
+            counts['updated'] += len(updates)
+        record_changes('addresses', list(dict.fromkeys(r['id'] for _, r in batch if 'id' in r)))
+
+    now = datetime.utcnow()
+    results = []
+    batch = []
+
+    try:
+        for row_no, record, reason in records:
+            if record is None:
+                results.append({'row': row_no, 'status': 'rejected', 'reason': reason})
+                continue
+            record.setdefault('id', gen_id('addr-'))
+            record['email_normalized'] = normalize_email(record['email'])
+            record['created_at'] = now
+            result = {'row': row_no, 'status': 'accepted', 'id': record['id']}
+            batch.append((record, result))
+            results.append(result)
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    accepted = sum(1 for r in results if r['status'] == 'accepted')
+    return {
+        'accepted': accepted,
+        'updated': counts['updated'],
+        'rejected': len(results) - accepted,
+        'results': results,
+    }
+
+
+def open_text_stream(binary_stream, encoding='utf-8-sig'):
+    """バイナリストリームを全体を読み込まずに行単位で読めるテキストストリームに変換"""
+    return io.TextIOWrapper(binary_stream, encoding=encoding, errors='replace', newline='')
+
+
+def main(argv=None):
+    """CLI: python -m backend.importer contacts.csv"""
+    parser = argparse.ArgumentParser(description='アドレス帳にCSV/TSV/JSONを一括インポート')
+    parser.add_argument('path', help='インポートするファイル（.csv / .tsv / .txt / .json）')
+    parser.add_argument('--encoding', default='utf-8-sig', help='文字コード（例: cp932）')
+    args = parser.parse_args(argv)
+
+    try:
+        from backend.app import create_app
+    except ModuleNotFoundError:
+        from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        with open(args.path, 'r', encoding=args.encoding, errors='replace', newline='') as f:
+            if args.path.lower().endswith('.json'):
+                summary = import_records(iter_json_records(json.load(f)))
+            else:
+                summary = import_records(iter_text_records(f))
+
+    for r in summary['results']:
+        if r['status'] == 'rejected':
+            print(f"  {r['row']}行目: 除外 ({r['reason']})")
+    print(f"登録: {summary['accepted']}件（うち既存のアドレスの更新: {summary['updated']}件） / "
+          f"除外: {summary['rejected']}件")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+差し込み印刷（メールマージ）
+1つのテンプレートを複数グループに適用し、グループごとの宛先と件名・本文を順次生成する
+グループはチャンク単位で読み込み、描画はスレッドプールで行うため、全件をメモリに載せない
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import tuple_
+
+try:
+    from backend.models import db, Address, Group, GroupMember
+    from backend.render import build_values, load_globals_map, template_cache
+except ModuleNotFoundError:
+    from models import db, Address, Group, GroupMember
+    from render import build_values, load_globals_map, template_cache
+
+# 1回に読み込むグループ数
+GROUP_CHUNK_SIZE = 200
+# IN句1回あたりのID数
+ID_CHUNK_SIZE = 500
+DEFAULT_WORKERS = 4
+MAX_WORKERS = 16
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def load_addresses(address_ids):
+    """アドレスIDの集合から {id: (name, email)} を取得（IN句を分割して検索）"""
+    result = {}
+    ids = list(address_ids)
+    for chunk in _chunks(ids, ID_CHUNK_SIZE):
+        for aid, name, email in (db.session.query(Address.id, Address.name, Address.email)
+                                 .filter(Address.id.in_(chunk))):
+            result[aid] = (name, email)
+    return result
+
+
+def _load_snapshots(group_rows):
+    """
+    グループ行（id, group_name, custom_attributes）に group_members を結合し、
+    描画スレッドに渡せる素のデータに変換する（ORMオブジェクトは作らない）
+    """
+    snapshots = {gid: {'id': gid, 'group_name': name, 'custom_attributes': attrs or [], 'members': []}
+                 for gid, name, attrs in group_rows}
+    if snapshots:
+        rows = (db.session.query(GroupMember.group_id, GroupMember.address_id,
+                                 GroupMember.recipient_type, GroupMember.order)
+                .filter(GroupMember.group_id.in_(list(snapshots))))
+        for gid, address_id, recipient_type, order in rows:
+            snapshots[gid]['members'].append((address_id, recipient_type, order))
+    return snapshots
+
+
+def iter_group_chunks(group_ids=None, chunk_size=GROUP_CHUNK_SIZE):
+    """
+    グループをチャンク単位で読み込み、[(グループID, スナップショット または None), ...] を返す
+    group_ids指定時は指定順に返し、存在しないIDはスナップショットがNoneになる
+    未指定の場合は全グループを created_at DESC, id DESC の順にキーセットで読み進める
+    """
+    columns = (Group.id, Group.group_name, Group.custom_attributes)
+    if group_ids is not None:
+        for chunk in _chunks(list(group_ids), chunk_size):
+            found = _load_snapshots(db.session.query(*columns).filter(Group.id.in_(chunk)))
+            yield [(gid, found.get(gid)) for gid in chunk]
+        return
+
+    last = None
+    while True:
+        query = (db.session.query(*columns, Group.created_at)
+                 .order_by(Group.created_at.desc(), Group.id.desc()))
+        if last is not None:
+            query = query.filter(tuple_(Group.created_at, Group.id) < tuple_(*last))
+        rows = query.limit(chunk_size).all()
+        if not rows:
+            return
+        last = (rows[-1].created_at, rows[-1].id)
+        found = _load_snapshots(row[:3] for row in rows)
+        yield [(row.id, found[row.id]) for row in rows]
+
+
+def split_recipients(members, addresses):
+    """メンバーをorder順に並べ、recipientTypeごとのTO/CC/BCCリストに分ける（削除済みアドレスは除外）"""
+    result = {'to': [], 'cc': [], 'bcc': []}
+    for address_id, recipient_type, _ in sorted(members, key=lambda m: m[2]):
+        addr = addresses.get(address_id)
+        if addr is None:
+            continue
+        bucket = result.get((recipient_type or 'to').lower(), result['to'])
+        bucket.append({'id': address_id, 'name': addr[0], 'email': addr[1]})
+    return result
+
+
+def merge_group(compiled, globals_map, group, addresses, today=None):
+    """1グループ分のメッセージを生成する（DBにはアクセスしない）"""
+    rendered = compiled.render(build_values(globals_map, group['custom_attributes'], today))
+    return {
+        'type': 'message',
+        'groupId': group['id'],
+        'groupName': group['group_name'],
+        **split_recipients(group['members'], addresses),
+        **rendered,
+    }
+
+
+def parse_workers(value):
+    """描画スレッド数の指定（省略時はDEFAULT_WORKERS）を1〜MAX_WORKERSの整数にする（整数でない場合はValueError）"""
+    if isinstance(value, bool) or not isinstance(value, (int, str, type(None))):
+        raise ValueError(f'workers は整数で指定してください: {value!r}')
+    if not value:
+        return DEFAULT_WORKERS
+    try:
+        workers = int(value)
+    except ValueError:
+        raise ValueError(f'workers は整数で指定してください: {value!r}') from None
+    return max(1, min(workers, MAX_WORKERS))
+
+
+def iter_merged(template, group_ids=None, workers=DEFAULT_WORKERS):
+    """
+    グループごとのメッセージを順に生成する
+    描画はスレッドプールで行い、実行中のジョブ数を上限付きにしてメモリ使用量を一定に保つ
+    結果はグループの順序どおりに返し、見つからないグループは error 行として返す
+    """
+    compiled = template_cache.get(template)
+    globals_map = load_globals_map()
+    workers = parse_workers(workers)
+    window = workers * 4
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for entries in iter_group_chunks(group_ids):
+            address_ids = {m[0] for _, g in entries if g for m in g['members']}
+            addresses = load_addresses(address_ids)
+            for gid, group in entries:
+                if group is None:
+                    pending.append({'type': 'error', 'groupId': gid, 'error': 'not_found'})
+                else:
+                    pending.append(pool.submit(merge_group, compiled, globals_map, group, addresses))
+                while len(pending) >= window:
+                    yield _result(pending.popleft())
+        while pending:
+            yield _result(pending.popleft())
+
+
+def _result(entry):
+    return entry if isinstance(entry, dict) else entry.result()
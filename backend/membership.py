@@ -0,0 +1,271 @@
+"""
+グループメンバー / テンプレート既定宛先の関連テーブル操作
+APIのJSON形式（memberIds / defaultRecipients）と関連テーブルの相互変換を行う
+"""
+try:
+    from backend.models import db, Address, Group, GroupMember, EmailTemplate, TemplateRecipient
+except ModuleNotFoundError:
+    from models import db, Address, Group, GroupMember, EmailTemplate, TemplateRecipient
+
+RECIPIENT_TYPES = ('to', 'cc', 'bcc')
+MEMBER_OPS = ('add', 'remove', 'setType', 'move')
+# 1回の部分更新で受け付ける操作数の上限
+MAX_MEMBER_OPERATIONS = 5000
+
+
+class VersionConflict(Exception):
+    """指定した版数が現在の版数と異なる（他の更新が先にコミットされた）"""
+
+    def __init__(self, current):
+        super().__init__(f'グループは他の更新により変更されています（現在の版数: {current}）')
+        self.current = current
+
+
+def normalize_member_ids(member_ids):
+    """
+    member_idsを正規化: 旧形式(文字列配列)を新形式(オブジェクト配列)に変換
+    新形式: [{"id": "addr-xxx", "recipientType": "to", "order": 0}, ...]
+    """
+    if not member_ids:
+        return []
+    if isinstance(member_ids, list) and len(member_ids) > 0:
+        if isinstance(member_ids[0], str):
+            # 旧形式を新形式に変換
+            return [{"id": mid, "recipientType": "to", "order": idx} for idx, mid in enumerate(member_ids)]
+        else:
+            # 既に新形式
+            return member_ids
+    return []
+
+
+def group_members_json(group):
+    return [{'id': m.address_id, 'recipientType': m.recipient_type, 'order': m.order}
+            for m in group.members]
+
+
+def template_recipients_json(template):
+    return [{'addressId': r.address_id, 'type': r.type} for r in template.recipients]
+
+
+def members_by_group(group_ids):
+    """複数グループのmemberIdsを1回のクエリでまとめて取得（ORMオブジェクトを作らない一覧用）"""
+    t = GroupMember.__table__
+    result = {}
+    rows = db.session.execute(
+        db.select(t.c.group_id, t.c.address_id, t.c.recipient_type, t.c.order)
+        .where(t.c.group_id.in_(group_ids)).order_by(t.c.group_id, t.c.order)
+    ).tuples()
+    for group_id, address_id, recipient_type, order in rows:
+        result.setdefault(group_id, []).append({'id': address_id, 'recipientType': recipient_type, 'order': order})
+    return result
+
+
+def recipients_by_template(template_ids):
+    """複数テンプレートのdefaultRecipientsを1回のクエリでまとめて取得"""
+    t = TemplateRecipient.__table__
+    result = {}
+    rows = db.session.execute(
+        db.select(t.c.template_id, t.c.address_id, t.c.type)
+        .where(t.c.template_id.in_(template_ids)).order_by(t.c.template_id, t.c.position)
+    ).tuples()
+    for template_id, address_id, kind in rows:
+        result.setdefault(template_id, []).append({'addressId': address_id, 'type': kind})
+    return result
+
+
+def set_group_members(group, member_ids):
+    """memberIdsの内容でグループのメンバー行を更新（変更のあった行だけを書き込む）"""
+    wanted = {}
+    for idx, m in enumerate(normalize_member_ids(member_ids)):
+        addr_id = m.get('id')
+        if not addr_id or addr_id in wanted:
+            continue
+        wanted[addr_id] = (m.get('recipientType') or 'to', m.get('order', idx))
+
+    for m in list(group.members):
+        if m.address_id not in wanted:
+            group.members.remove(m)
+            continue
+        recipient_type, order = wanted.pop(m.address_id)
+        if m.recipient_type != recipient_type:
+            m.recipient_type = recipient_type
+        if m.order != order:
+            m.order = order
+
+    for addr_id, (recipient_type, order) in wanted.items():
+        group.members.append(GroupMember(address_id=addr_id, recipient_type=recipient_type, order=order))
+
+
+def set_template_recipients(template, default_recipients):
+    """defaultRecipientsの内容でテンプレートの既定宛先行を更新（変更のあった行だけを書き込む）"""
+    wanted = {}
+    for idx, r in enumerate(default_recipients or []):
+        addr_id = r.get('addressId') if isinstance(r, dict) else None
+        if not addr_id or addr_id in wanted:
+            continue
+        wanted[addr_id] = (r.get('type') or 'TO', idx)
+
+    for r in list(template.recipients):
+        if r.address_id not in wanted:
+            template.recipients.remove(r)
+            continue
+        rtype, position = wanted.pop(r.address_id)
+        if r.type != rtype:
+            r.type = rtype
+        if r.position != position:
+            r.position = position
+
+    for addr_id, (rtype, position) in wanted.items():
+        template.recipients.append(TemplateRecipient(address_id=addr_id, type=rtype, position=position))
+
+
+def bump_group_versions(group_ids):
+    """グループの版数を1つ進める（メンバー行だけを変更した場合）"""
+    if group_ids:
+        t = Group.__table__
+        db.session.execute(t.update().where(t.c.id.in_(group_ids)).values(version=t.c.version + 1))
+
+
+def patch_group_members(group_id, operations, expected_version=None):
+    """
+    メンバーの追加・削除・宛先種別の変更・並べ替えを、操作の対象の行だけに対して行う（全メンバーを読み書きしない）
+    operations: [{"op": "add", "id": "addr-1", "recipientType": "cc"}, {"op": "remove", "id": "addr-2"},
+                 {"op": "setType", "id": "addr-3", "recipientType": "bcc"}, {"op": "move", "id": "addr-4", "order": 0}]
+    add は order を省略すると末尾に追加する。order を指定した add / move はその位置以降のメンバーを1つずつ後ろにずらす
+    expected_version が現在の版数と異なる場合は VersionConflict、不正な操作は ValueError
+    戻り値: {"version": 新しい版数, "added": 件数, "removed": ..., "updated": ..., "moved": ..., "unchanged": ...}
+    """
+    if not isinstance(operations, list):
+        raise ValueError('operations は配列で指定してください')
+    if len(operations) > MAX_MEMBER_OPERATIONS:
+        raise ValueError(f'操作は{MAX_MEMBER_OPERATIONS}件以下にしてください')
+    parsed = [_parse_member_operation(item) for item in operations]
+    if expected_version is not None and (isinstance(expected_version, bool) or not isinstance(expected_version, int)):
+        raise ValueError('version は整数で指定してください')
+
+    # 書き込みのトランザクション（BEGIN IMMEDIATE）内なので、確認からコミットまで他の更新は入らない
+    g = Group.__table__
+    current = db.one_or_404(db.select(g.c.version).where(g.c.id == group_id))
+    if expected_version is not None and expected_version != current:
+        raise VersionConflict(current)
+
+    added = {aid for op, aid, _, _ in parsed if op == 'add'}
+    if added:
+        existing = set(db.session.execute(db.select(Address.id).where(Address.id.in_(added))).scalars())
+        missing = sorted(added - existing)
+        if missing:
+            raise ValueError(f'存在しないアドレスです: {", ".join(missing[:10])}')
+
+    m = GroupMember.__table__
+    in_group = m.c.group_id == group_id
+    counts = {'added': 0, 'removed': 0, 'updated': 0, 'moved': 0, 'unchanged': 0}
+    next_order = None
+
+    def make_room(order, address_id):
+        # 指定位置が使われている場合だけ、その位置以降を1文のUPDATEで後ろにずらす
+        taken = db.session.execute(db.select(m.c.address_id).where(
+            in_group, m.c.order == order, m.c.address_id != address_id).limit(1)).first()
+        if taken:
+            db.session.execute(m.update().where(in_group, m.c.order >= order, m.c.address_id != address_id)
+                               .values(order=m.c.order + 1))
+        return taken is not None
+
+    for op, address_id, recipient_type, order in parsed:
+        row = db.session.execute(db.select(m.c.recipient_type, m.c.order).where(
+            in_group, m.c.address_id == address_id)).first()
+        if op == 'add':
+            if row is not None:
+                counts['unchanged'] += 1
+                continue
+            if order is None:
+                if next_order is None:
+                    last = db.session.execute(db.select(db.func.max(m.c.order)).where(in_group)).scalar()
+                    next_order = -1 if last is None else last
+                next_order += 1
+                order = next_order
+            elif make_room(order, address_id):
+                next_order = None
+            elif next_order is not None:
+                next_order = max(next_order, order)
+            db.session.execute(m.insert().values(group_id=group_id, address_id=address_id,
+                                                 recipient_type=recipient_type or 'to', order=order))
+            counts['added'] += 1
+        elif op == 'remove':
+            if row is None:
+                counts['unchanged'] += 1
+                continue
+            db.session.execute(m.delete().where(in_group, m.c.address_id == address_id))
+            counts['removed'] += 1
+        else:
+            if row is None:
+                raise ValueError(f'{address_id} はグループのメンバーではありません')
+            if op == 'setType':
+                if row.recipient_type == recipient_type:
+                    counts['unchanged'] += 1
+                    continue
+                db.session.execute(m.update().where(in_group, m.c.address_id == address_id)
+                                   .values(recipient_type=recipient_type))
+                counts['updated'] += 1
+            else:
+                if row.order == order:
+                    counts['unchanged'] += 1
+                    continue
+                if make_room(order, address_id):
+                    next_order = None
+                elif next_order is not None:
+                    next_order = max(next_order, order)
+                db.session.execute(m.update().where(in_group, m.c.address_id == address_id).values(order=order))
+                counts['moved'] += 1
+
+    version = current
+    if counts['added'] or counts['removed'] or counts['updated'] or counts['moved']:
+        version = db.session.execute(g.update().where(g.c.id == group_id).values(version=g.c.version + 1)
+                                     .returning(g.c.version)).scalar()
+    return {'version': version, **counts}
+
+
+def _parse_member_operation(item):
+    if not isinstance(item, dict):
+        raise ValueError('操作はオブジェクトで指定してください')
+    op = item.get('op')
+    if op not in MEMBER_OPS:
+        raise ValueError(f'op は {"/".join(MEMBER_OPS)} のいずれかを指定してください: {op!r}')
+    address_id = item.get('id')
+    if not isinstance(address_id, str) or not address_id:
+        raise ValueError(f'{op} には id（アドレスID）を指定してください')
+    recipient_type = item.get('recipientType')
+    if recipient_type is not None and recipient_type not in RECIPIENT_TYPES:
+        raise ValueError(f'recipientType は {"/".join(RECIPIENT_TYPES)} のいずれかを指定してください')
+    if op == 'setType' and recipient_type is None:
+        raise ValueError('setType には recipientType を指定してください')
+    order = item.get('order')
+    if order is not None and (isinstance(order, bool) or not isinstance(order, int) or order < 0):
+        raise ValueError('order は0以上の整数で指定してください')
+    if op == 'move' and order is None:
+        raise ValueError('move には order を指定してください')
+    return op, address_id, recipient_type, order
+
+
+def remove_address_references(address_id):
+    """
+    アドレスを参照しているメンバー行・既定宛先行だけを削除
+    戻り値: (影響したグループIDリスト, 影響したテンプレートIDリスト)
+    """
+    group_ids = [gid for (gid,) in db.session.query(GroupMember.group_id).filter_by(address_id=address_id)]
+    template_ids = [tid for (tid,) in db.session.query(TemplateRecipient.template_id).filter_by(address_id=address_id)]
+    if group_ids:
+        GroupMember.query.filter_by(address_id=address_id).delete(synchronize_session=False)
+    if template_ids:
+        TemplateRecipient.query.filter_by(address_id=address_id).delete(synchronize_session=False)
+    return group_ids, template_ids
+
+
+def groups_for_address(address_id):
+    """アドレスが所属するグループ一覧（group_membersの逆引きインデックスを使用）"""
+    rows = (db.session.query(Group.id, Group.group_name, GroupMember.recipient_type, GroupMember.order)
+            .join(GroupMember, GroupMember.group_id == Group.id)
+            .filter(GroupMember.address_id == address_id)
+            .order_by(Group.group_name)
+            .all())
+    return [{'id': gid, 'group_name': name, 'recipientType': rtype, 'order': order}
+            for gid, name, rtype, order in rows]
@@ -0,0 +1,294 @@
+"""
+リクエスト・SQLの計測と /api/metrics（Prometheusのテキスト形式）
+- ルートごとのレイテンシのヒストグラムとステータス別の件数
+- リクエストごとのSQL発行数・SQL時間（SQLAlchemyのイベントで計測し、Server-Timingヘッダーでも返す）
+- しきい値を超えたSQLのログ（スロークエリ）
+- DBファイルのサイズと各テーブルの行数（/api/metrics の取得時に調べる）
+
+設定（create_app(config) > 環境変数 OUTLOOK_TOOL_<キー> > 既定値）:
+    METRICS_SLOW_QUERY_MS   スロークエリとして記録するSQLの実行時間（ミリ秒、0で無効）
+    METRICS_LOG_FILE        指定するとリクエストごとの計測結果とスロークエリをローテーションするログに書き出す
+"""
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import g, request
+from sqlalchemy import event, text
+
+try:
+    from backend.models import db
+    from backend.storage import ENV_PREFIX
+except ModuleNotFoundError:
+    from models import db
+    from storage import ENV_PREFIX
+
+DEFAULTS = {
+    'METRICS_SLOW_QUERY_MS': 200,
+    'METRICS_LOG_FILE': '',
+    'METRICS_LOG_MAX_BYTES': 5 * 1024 * 1024,
+    'METRICS_LOG_BACKUPS': 3,
+}
+
+PREFIX = 'outlook_tool'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# レイテンシ（秒）とリクエストあたりのSQL数のバケット
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# 行数を数えるテーブル
+COUNTED_TABLES = ('addresses', 'groups', 'group_members', 'templates', 'template_recipients',
+                  'globals', 'attrdefs', 'changes', 'dispatch_jobs')
+# ログに書き出すSQL文の最大文字数
+MAX_STATEMENT_LENGTH = 500
+
+logger = logging.getLogger('outlook_tool')
+
+# 現在のリクエストのSQL計測（リクエスト外のSQLは全体の件数にだけ加算する）
+_current = ContextVar('metrics_request', default=None)
+
+
+def load_settings(config=None, environ=None):
+    environ = os.environ if environ is None else environ
+    config = config or {}
+    settings = {}
+    for key, default in DEFAULTS.items():
+        value = config.get(key, environ.get(ENV_PREFIX + key, default))
+        if isinstance(default, int):
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f'{key} には整数を指定してください: {value!r}')
+        settings[key] = value
+    return settings
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            yield f'{name}_bucket{_labels(labels, le=_number(bound))} {cumulative}'
+        yield f'{name}_bucket{_labels(labels, le="+Inf")} {self.count}'
+        yield f'{name}_sum{_labels(labels)} {_number(self.sum)}'
+        yield f'{name}_count{_labels(labels)} {self.count}'
+
+
+class RequestStats:
+    __slots__ = ('started', 'queries', 'sql_seconds')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+
+class Metrics:
+    """プロセス内の計測値（スレッド間で共有）"""
+
+    def __init__(self, slow_query_seconds=0.0):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.slow_query_seconds = slow_query_seconds
+        # (method, route) -> Histogram
+        self.latency = {}
+        self.query_counts = {}
+        # (method, route) -> SQL時間の合計
+        self.sql_seconds = {}
+        # (method, route, status) -> 件数
+        self.responses = {}
+        self.queries_total = 0
+        self.slow_queries = 0
+
+    def observe_request(self, method, route, status, stats, seconds):
+        key = (method, route)
+        with self.lock:
+            if key not in self.latency:
+                self.latency[key] = Histogram(LATENCY_BUCKETS)
+                self.query_counts[key] = Histogram(QUERY_COUNT_BUCKETS)
+                self.sql_seconds[key] = 0.0
+            self.latency[key].observe(seconds)
+            self.query_counts[key].observe(stats.queries)
+            self.sql_seconds[key] += stats.sql_seconds
+            rkey = (method, route, str(status))
+            self.responses[rkey] = self.responses.get(rkey, 0) + 1
+
+    def observe_query(self, statement, seconds):
+        stats = _current.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.sql_seconds += seconds
+        slow = self.slow_query_seconds and seconds >= self.slow_query_seconds
+        with self.lock:
+            self.queries_total += 1
+            if slow:
+                self.slow_queries += 1
+        if slow:
+            statement = ' '.join(statement.split())
+            if len(statement) > MAX_STATEMENT_LENGTH:
+                statement = statement[:MAX_STATEMENT_LENGTH] + '...'
+            route = getattr(request.url_rule, 'rule', '-') if stats is not None else '-'
+            logger.warning('slow query %.1fms route=%s sql=%s', seconds * 1000, route, statement)
+
+    def render(self, database_path):
+        """Prometheusのテキスト形式"""
+        out = []
+
+        def metric(name, kind, help_text):
+            out.append(f'# HELP {PREFIX}_{name} {help_text}')
+            out.append(f'# TYPE {PREFIX}_{name} {kind}')
+
+        with self.lock:
+            metric('http_request_duration_seconds', 'histogram', 'Request latency by route')
+            for (method, route), h in sorted(self.latency.items()):
+                out.extend(h.lines(f'{PREFIX}_http_request_duration_seconds', {'method': method, 'route': route}))
+            metric('http_requests_total', 'counter', 'Responses by route and status')
+            for (method, route, status), n in sorted(self.responses.items()):
+                out.append(f'{PREFIX}_http_requests_total'
+                           f'{_labels({"method": method, "route": route, "status": status})} {n}')
+            metric('sql_queries_per_request', 'histogram', 'SQL statements issued per request')
+            for (method, route), h in sorted(self.query_counts.items()):
+                out.extend(h.lines(f'{PREFIX}_sql_queries_per_request', {'method': method, 'route': route}))
+            metric('sql_duration_seconds_total', 'counter', 'Time spent in SQL by route')
+            for (method, route), seconds in sorted(self.sql_seconds.items()):
+                out.append(f'{PREFIX}_sql_duration_seconds_total'
+                           f'{_labels({"method": method, "route": route})} {_number(seconds)}')
+            metric('sql_queries_total', 'counter', 'SQL statements issued (including outside requests)')
+            out.append(f'{PREFIX}_sql_queries_total {self.queries_total}')
+            metric('sql_slow_queries_total', 'counter', 'SQL statements slower than the slow query threshold')
+            out.append(f'{PREFIX}_sql_slow_queries_total {self.slow_queries}')
+
+        metric('process_start_time_seconds', 'gauge', 'Start time of the process (unix time)')
+        out.append(f'{PREFIX}_process_start_time_seconds {_number(self.started_at)}')
+
+        metric('db_file_bytes', 'gauge', 'Size of the database files')
+        for suffix, label in (('', 'db'), ('-wal', 'wal')):
+            try:
+                size = os.path.getsize(database_path + suffix)
+            except OSError:
+                size = 0
+            out.append(f'{PREFIX}_db_file_bytes{_labels({"file": label})} {size}')
+
+        metric('db_rows', 'gauge', 'Row count by table')
+        for table, count in table_counts():
+            out.append(f'{PREFIX}_db_rows{_labels({"table": table})} {count}')
+        return '\n'.join(out) + '\n'
+
+
+def table_counts():
+    rows = []
+    try:
+        for table in COUNTED_TABLES:
+            rows.append((table, db.session.execute(text(f'SELECT count(*) FROM "{table}"')).scalar()))
+    finally:
+        db.session.rollback()
+    return rows
+
+
+def _labels(labels, **extra):
+    items = {**labels, **extra}
+    if not items:
+        return ''
+    escaped = (f'{k}="{_escape(v)}"' for k, v in items.items())
+    return '{' + ','.join(escaped) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _configure_logging(settings):
+    """スロークエリはコンソールに、METRICS_LOG_FILE指定時はリクエストごとの計測結果もファイルに書き出す"""
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if not any(getattr(h, '_outlook_tool', None) == 'console' for h in logger.handlers):
+        console = logging.StreamHandler()
+        console.setLevel(logging.WARNING)
+        console.setFormatter(logging.Formatter('%(message)s'))
+        console._outlook_tool = 'console'
+        logger.addHandler(console)
+
+    path = settings['METRICS_LOG_FILE']
+    if path and not any(getattr(h, '_outlook_tool', None) == path for h in logger.handlers):
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=settings['METRICS_LOG_MAX_BYTES'], backupCount=settings['METRICS_LOG_BACKUPS'],
+            encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+        handler._outlook_tool = path
+        logger.addHandler(handler)
+
+
+def init_app(app, settings):
+    """SQLAlchemyのイベントとリクエストの前後処理を登録する"""
+    metrics = Metrics(settings['METRICS_SLOW_QUERY_MS'] / 1000)
+    app.extensions['metrics'] = metrics
+    _configure_logging(settings)
+    log_requests = bool(settings['METRICS_LOG_FILE'])
+
+    with app.app_context():
+        engine = db.engine
+
+    # 開始時刻は文ごとの実行コンテキストに持たせる（失敗した文は after_cursor_execute が呼ばれないため、
+    # 接続に積むと取り出されずに残り、以降の文の開始時刻がずれる）
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        metrics.observe_query(statement, time.perf_counter() - context._query_start)
+
+    @app.before_request
+    def _start_request():
+        g.metrics_stats = RequestStats()
+        _current.set(g.metrics_stats)
+
+    @app.after_request
+    def _server_timing(response):
+        stats = g.get('metrics_stats')
+        if stats is not None:
+            g.metrics_status = response.status_code
+            # ストリーミングのレスポンスは本文の送信前までの値
+            total = (time.perf_counter() - stats.started) * 1000
+            response.headers['Server-Timing'] = (f'app;dur={total:.1f}, '
+                                                 f'db;dur={stats.sql_seconds * 1000:.1f};desc="{stats.queries} queries"')
+        return response
+
+    @app.teardown_request
+    def _finish_request(exc):
+        # ストリーミングのレスポンスでは本文の送信後に呼ばれるため、送信完了までを含めて記録する
+        stats = g.pop('metrics_stats', None)
+        if stats is None:
+            return
+        _current.set(None)
+        seconds = time.perf_counter() - stats.started
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        status = g.pop('metrics_status', 500)
+        metrics.observe_request(request.method, route, status, stats, seconds)
+        if log_requests:
+            logger.info('%s %s %s %.1fms queries=%d sql=%.1fms', request.method, request.full_path.rstrip('?'),
+                        status, seconds * 1000, stats.queries, stats.sql_seconds * 1000)
+
+    return metrics
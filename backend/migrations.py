@@ -0,0 +1,253 @@
+"""
+データベースのスキーマバージョン管理
+data.dbのPRAGMA user_versionに適用済みのバージョンを記録し、未適用のマイグレーションだけを1回ずつ実行する
+最新バージョンのDBでは起動時にスキーマの確認（create_all）を行わない
+
+マイグレーションを追加する場合は MIGRATIONS の末尾に追記する（既存の番号は変更しない）
+各マイグレーションは途中で中断しても再実行できるように書く
+"""
+import json
+
+from sqlalchemy import text
+
+try:
+    from backend.models import db, GroupMember, TemplateRecipient, DispatchJob, VariableUsage, normalize_email
+    from backend.membership import normalize_member_ids
+    from backend.search import (install_search_index, detect_search_index, reinstall_sync_triggers,
+                                KINDS as SEARCH_KINDS)
+    from backend.changes import prune_changes
+    from backend.storage import write_intent
+    from backend.variables import rebuild_usages
+except ModuleNotFoundError:
+    from models import db, GroupMember, TemplateRecipient, DispatchJob, VariableUsage, normalize_email
+    from membership import normalize_member_ids
+    from search import (install_search_index, detect_search_index, reinstall_sync_triggers,
+                        KINDS as SEARCH_KINDS)
+    from changes import prune_changes
+    from storage import write_intent
+    from variables import rebuild_usages
+
+# 既存の行を更新するときに一度に読み込む行数
+BACKFILL_BATCH = 5000
+
+
+def upgrade(app):
+    """未適用のマイグレーションを実行し、起動時の保守処理を行う"""
+    with app.app_context():
+        apply_migrations()
+        detect_search_index()
+        prune_changes()
+
+
+def schema_version():
+    return db.session.execute(text("PRAGMA user_version")).scalar() or 0
+
+
+def set_schema_version(version):
+    # PRAGMAはパラメータを使えないため整数に限定して埋め込む
+    db.session.execute(text(f"PRAGMA user_version = {int(version)}"))
+
+
+def apply_migrations():
+    """
+    user_versionより新しいマイグレーションを順に適用する
+    複数プロセスが同時に起動した場合に備え、BEGIN IMMEDIATEで書き込みロックを取ってから確認する
+    """
+    current = schema_version()
+    db.session.rollback()
+    if current >= LATEST_VERSION:
+        return current
+
+    token = write_intent.set(True)
+    try:
+        for version, description, migrate in MIGRATIONS:
+            current = schema_version()
+            if version <= current:
+                db.session.rollback()
+                continue
+            migrate()
+            set_schema_version(version)
+            db.session.commit()
+            print(f"データベースを更新しました: v{version} {description}")
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        write_intent.reset(token)
+    return LATEST_VERSION
+
+
+def reset_database():
+    """全テーブル（全文検索索引を含む）を削除し、最新バージョンまで作り直す（デモデータの初期化用）"""
+    db.session.rollback()
+    # 変更ログのseqは作り直した後も続きから採番する（一覧のETag・差分同期のseqが以前の値に戻らないように）
+    last_seq = None
+    if db.session.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'")).scalar():
+        last_seq = db.session.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'changes'")).scalar()
+    for spec in SEARCH_KINDS.values():
+        db.session.execute(text(f"DROP TABLE IF EXISTS {spec['fts']}"))
+    db.session.execute(text("DROP TABLE IF EXISTS fts_keys"))
+    db.session.commit()
+    db.drop_all()
+    set_schema_version(0)
+    db.session.commit()
+    apply_migrations()
+    if last_seq:
+        db.session.execute(text("DELETE FROM sqlite_sequence WHERE name = 'changes'"))
+        db.session.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('changes', :seq)"), {'seq': last_seq})
+        db.session.commit()
+    detect_search_index()
+
+
+def create_tables():
+    """
+    v1: 現在のモデルのテーブルを作成（新規DB、または旧バージョンのDBに不足しているテーブル）
+    旧バージョンのDBにある既存テーブルはそのまま残る
+    """
+    db.metadata.create_all(db.session.connection(), checkfirst=True)
+
+
+def ensure_indexes():
+    """v2: 既存テーブルに後から追加したインデックスを作成（create_allは既存テーブルのインデックスを作らないため）"""
+    connection = db.session.connection()
+    existing = set(connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+    for table in db.metadata.sorted_tables:
+        # 後のマイグレーションで作成するテーブル・追加する列のインデックスは、そのマイグレーションで作る
+        if table.name not in existing:
+            continue
+        columns = {row[1] for row in connection.execute(text(f'PRAGMA table_info("{table.name}")'))}
+        for index in table.indexes:
+            if all(c.name in columns for c in index.columns):
+                index.create(connection, checkfirst=True)
+
+
+def migrate_legacy_membership():
+    """
+    v3: groups.member_ids / templates.default_recipients のJSONを関連テーブルへ移行する
+    移行済みの行はJSON列をNULLにするため、2回目以降は何もしない
+    """
+    groups = db.session.execute(
+        text("SELECT id, member_ids FROM groups WHERE member_ids IS NOT NULL")
+    ).all()
+    templates = db.session.execute(
+        text("SELECT id, default_recipients FROM templates WHERE default_recipients IS NOT NULL")
+    ).all()
+    if not groups and not templates:
+        return
+
+    existing = {row[0] for row in db.session.execute(text("SELECT id FROM addresses"))}
+
+    member_rows = []
+    for gid, raw in groups:
+        seen = set()
+        for idx, m in enumerate(normalize_member_ids(_load_json(raw))):
+            addr_id = m.get('id') if isinstance(m, dict) else None
+            if addr_id not in existing or addr_id in seen:
+                continue
+            seen.add(addr_id)
+            member_rows.append({
+                'group_id': gid,
+                'address_id': addr_id,
+                'recipient_type': m.get('recipientType') or 'to',
+                'order': m.get('order', idx),
+            })
+
+    recipient_rows = []
+    for tid, raw in templates:
+        seen = set()
+        for idx, r in enumerate(_load_json(raw) or []):
+            addr_id = r.get('addressId') if isinstance(r, dict) else None
+            if addr_id not in existing or addr_id in seen:
+                continue
+            seen.add(addr_id)
+            recipient_rows.append({
+                'template_id': tid,
+                'address_id': addr_id,
+                'type': r.get('type') or 'TO',
+                'position': idx,
+            })
+
+    if member_rows:
+        db.session.execute(GroupMember.__table__.insert(), member_rows)
+    if recipient_rows:
+        db.session.execute(TemplateRecipient.__table__.insert(), recipient_rows)
+    db.session.execute(text("UPDATE groups SET member_ids = NULL WHERE member_ids IS NOT NULL"))
+    db.session.execute(text("UPDATE templates SET default_recipients = NULL WHERE default_recipients IS NOT NULL"))
+    print(f"メンバー情報を移行しました: "
+          f"グループ {len(groups)}件 / テンプレート {len(templates)}件")
+
+
+def _load_json(raw):
+    if not isinstance(raw, str):
+        return raw
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+
+def create_search_index():
+    """v4: 全文検索索引（FTS5が使えない環境ではLIKE検索のまま続行する）"""
+    install_search_index()
+
+
+def add_group_version():
+    """
+    v5: groups.version 列（v1で新しく作成したテーブルには既にある）と、
+    メンバーの部分更新で使う group_members(group_id, order) のインデックス
+    """
+    columns = {row[1] for row in db.session.execute(text("PRAGMA table_info(groups)"))}
+    if 'version' not in columns:
+        db.session.execute(text("ALTER TABLE groups ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+    ensure_indexes()
+
+
+def create_dispatch_queue():
+    """v6: 送信キューのテーブル（v1で新しく作成したDBには既にある）"""
+    DispatchJob.__table__.create(db.session.connection(), checkfirst=True)
+    ensure_indexes()
+
+
+def create_variable_index():
+    """v7: 変数の使用箇所の索引（既存のテンプレート・グループから作成する）"""
+    VariableUsage.__table__.create(db.session.connection(), checkfirst=True)
+    ensure_indexes()
+    rebuild_usages()
+
+
+def add_email_normalized():
+    """
+    v8: addresses.email_normalized 列と索引（既存の行はPythonで正規化して埋める）
+    全文検索の更新トリガーを索引する列の更新だけで動くように作り直してから埋める
+    """
+    reinstall_sync_triggers()
+    columns = {row[1] for row in db.session.execute(text("PRAGMA table_info(addresses)"))}
+    if 'email_normalized' not in columns:
+        db.session.execute(text("ALTER TABLE addresses ADD COLUMN email_normalized TEXT"))
+    # rowid順に一定件数ずつ読み、全件をメモリに載せない
+    last = 0
+    while True:
+        rows = db.session.execute(text(
+            "SELECT rowid, email FROM addresses WHERE rowid > :last ORDER BY rowid LIMIT :limit"
+        ), {'last': last, 'limit': BACKFILL_BATCH}).all()
+        if not rows:
+            break
+        db.session.execute(text("UPDATE addresses SET email_normalized = :key WHERE rowid = :rowid"),
+                           [{'rowid': rowid, 'key': normalize_email(email)} for rowid, email in rows])
+        last = rows[-1][0]
+    ensure_indexes()
+
+
+# (バージョン, 説明, 適用関数)
+MIGRATIONS = [
+    (1, 'テーブル作成', create_tables),
+    (2, 'インデックス追加', ensure_indexes),
+    (3, 'メンバー・既定宛先を関連テーブルへ移行', migrate_legacy_membership),
+    (4, '全文検索索引', create_search_index),
+    (5, 'グループの版数・メンバーの並び順インデックス', add_group_version),
+    (6, '送信キュー', create_dispatch_queue),
+    (7, '変数の使用箇所の索引', create_variable_index),
+    (8, 'メールアドレスの重複判定用の列', add_email_normalized),
+    (9, '変更ログのコレクション別インデックス', ensure_indexes),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import unicodedata
 import uuid
 
 db = SQLAlchemy()
@@ -7,34 +8,79 @@ db = SQLAlchemy()
 def gen_id(prefix=''):
     return prefix + str(uuid.uuid4())
 
+def normalize_email(email):
+    """重複判定用のメールアドレス（全角→半角・前後の空白を除去・小文字化）"""
+    return unicodedata.normalize('NFKC', email or '').strip().lower()
+
 
 class Address(db.Model):
     __tablename__ = 'addresses'
+    __table_args__ = (
+        db.Index('ix_addresses_created_at_id', 'created_at', 'id'),
+        # 同じメールアドレスの検索・重複の統合に使う（既存のDBに重複が残っている場合があるため一意制約にはしない）
+        db.Index('ix_addresses_email_normalized', 'email_normalized'),
+    )
     id = db.Column(db.String, primary_key=True, default=lambda: gen_id('addr-'))
     name = db.Column(db.String, nullable=False)
     email = db.Column(db.String, nullable=False)
-    organization = db.Column(db.String)
-    department = db.Column(db.String)
+    # normalize_email(email)（作成・更新・インポート時に設定する）
+    email_normalized = db.Column(db.String)
+    organization = db.Column(db.String, index=True)
+    department = db.Column(db.String, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
 class Group(db.Model):
     __tablename__ = 'groups'
+    __table_args__ = (
+        db.Index('ix_groups_created_at_id', 'created_at', 'id'),
+    )
     id = db.Column(db.String, primary_key=True, default=lambda: gen_id('grp-'))
     group_name = db.Column(db.String, nullable=False)
-    member_ids = db.Column(db.JSON, default=list)
+    # 旧形式のメンバー一覧（移行前のdata.db用）。現在はgroup_membersテーブルを使用
+    member_ids = db.Column(db.JSON)
     custom_attributes = db.Column(db.JSON, default=list)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # 更新のたびに1ずつ増やす版数（メンバーの部分更新で競合を検出する）
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    members = db.relationship('GroupMember', order_by='GroupMember.order',
+                              cascade='all, delete-orphan', lazy='selectin')
+
+
+class GroupMember(db.Model):
+    __tablename__ = 'group_members'
+    __table_args__ = (
+        # 並び順での取得・末尾の位置（max(order)）・位置をずらすUPDATEに使う
+        db.Index('ix_group_members_group_id_order', 'group_id', 'order'),
+    )
+    group_id = db.Column(db.String, db.ForeignKey('groups.id', ondelete='CASCADE'), primary_key=True)
+    address_id = db.Column(db.String, db.ForeignKey('addresses.id', ondelete='CASCADE'), primary_key=True, index=True)
+    recipient_type = db.Column(db.String, nullable=False, default='to')
+    order = db.Column(db.Integer, nullable=False, default=0)
 
 
 class EmailTemplate(db.Model):
     __tablename__ = 'templates'
+    __table_args__ = (
+        db.Index('ix_templates_created_at_id', 'created_at', 'id'),
+    )
     id = db.Column(db.String, primary_key=True, default=lambda: gen_id('tpl-'))
     title = db.Column(db.String)
     subject = db.Column(db.String)
     body = db.Column(db.Text)
-    default_recipients = db.Column(db.JSON, default=list)
+    # 旧形式の既定宛先（移行前のdata.db用）。現在はtemplate_recipientsテーブルを使用
+    default_recipients = db.Column(db.JSON)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    recipients = db.relationship('TemplateRecipient', order_by='TemplateRecipient.position',
+                                 cascade='all, delete-orphan', lazy='selectin')
+
+
+class TemplateRecipient(db.Model):
+    __tablename__ = 'template_recipients'
+    template_id = db.Column(db.String, db.ForeignKey('templates.id', ondelete='CASCADE'), primary_key=True)
+    address_id = db.Column(db.String, db.ForeignKey('addresses.id', ondelete='CASCADE'), primary_key=True, index=True)
+    type = db.Column(db.String, nullable=False, default='TO')
+    position = db.Column(db.Integer, nullable=False, default=0)
 
 
 class GlobalVariable(db.Model):
@@ -51,3 +97,56 @@ class AttributeDefinition(db.Model):
     key = db.Column(db.String, nullable=False, unique=True)
     label = db.Column(db.String)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class VariableUsage(db.Model):
+    """変数の使用箇所の索引: 変数のキー -> そのキーを使っているテンプレート（件名・本文）・グループ（属性）"""
+    __tablename__ = 'variable_usages'
+    __table_args__ = (
+        # 保存時に1件分の索引を読み替える・削除時にまとめて消す
+        db.Index('ix_variable_usages_kind_ref_id', 'kind', 'ref_id'),
+    )
+    key = db.Column(db.String, primary_key=True)
+    kind = db.Column(db.String, primary_key=True)  # 'template' または 'group'
+    ref_id = db.Column(db.String, primary_key=True)
+
+
+class Change(db.Model):
+    """変更ログ: 書き込みごとに1行追記し、seqの昇順で差分同期に使う"""
+    __tablename__ = 'changes'
+    __table_args__ = (
+        # コレクションごとの最新のseq（一覧のETag）をリクエストごとに引くため
+        db.Index('ix_changes_collection_seq', 'collection', 'seq'),
+        {'sqlite_autoincrement': True},
+    )
+    seq = db.Column(db.Integer, primary_key=True)
+    collection = db.Column(db.String, nullable=False)
+    entity_id = db.Column(db.String, nullable=False)
+    op = db.Column(db.String, nullable=False)  # 'upsert' または 'delete'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class DispatchJob(db.Model):
+    """送信キュー: 1通ごとに1行。ワーカーが送信時刻になったqueuedの行を取り出してSMTPで送信する"""
+    __tablename__ = 'dispatch_jobs'
+    __table_args__ = (
+        db.Index('ix_dispatch_jobs_status_next_attempt_at', 'status', 'next_attempt_at'),
+        db.Index('ix_dispatch_jobs_batch_id', 'batch_id'),
+        {'sqlite_autoincrement': True},
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    # 同じリクエストで登録したジョブのまとまり
+    batch_id = db.Column(db.String, nullable=False)
+    status = db.Column(db.String, nullable=False, default='queued')  # queued / sending / sent / failed / cancelled
+    sender = db.Column(db.String, nullable=False)
+    # {"to": [{"name", "email"}, ...], "cc": [...], "bcc": [...]}
+    recipients = db.Column(db.JSON, nullable=False)
+    subject = db.Column(db.String)
+    body = db.Column(db.Text)
+    group_id = db.Column(db.String)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String)
+    message_id = db.Column(db.String)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
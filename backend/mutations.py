@@ -0,0 +1,323 @@
+"""
+各コレクションの作成・更新・削除
+単体のAPI（POST / PUT / DELETE）と一括のAPI（POST /api/batch）で共通に使い、コミットは呼び出し側で行う
+"""
+from sqlalchemy.orm.util import identity_key
+
+try:
+    from backend.models import db, Address, Group, EmailTemplate, GlobalVariable, AttributeDefinition, normalize_email
+    from backend.membership import (set_group_members, set_template_recipients, remove_address_references,
+                                    bump_group_versions, patch_group_members)
+    from backend.changes import record_change, record_changes
+    from backend.variables import TEMPLATE, GROUP, index_template, index_group, remove_usages, rename_usages
+except ModuleNotFoundError:
+    from models import db, Address, Group, EmailTemplate, GlobalVariable, AttributeDefinition, normalize_email
+    from membership import (set_group_members, set_template_recipients, remove_address_references,
+                            bump_group_versions, patch_group_members)
+    from changes import record_change, record_changes
+    from variables import TEMPLATE, GROUP, index_template, index_group, remove_usages, rename_usages
+
+# 1回の /api/batch で受け付ける操作数の上限
+MAX_BATCH_OPERATIONS = 1000
+OPS = ('create', 'update', 'delete')
+
+
+def requested_id(data):
+    """指定されたID（未指定・空文字の場合はNoneにしてSQLAlchemyのdefaultで採番する）"""
+    value = data.get('id')
+    if not value or value.strip() == '':
+        return None
+    return value
+
+
+# Addresses
+def find_address_by_email(email):
+    """正規化したメールアドレスが一致するアドレス（複数ある場合は最も古いもの）"""
+    key = normalize_email(email)
+    if not key:
+        return None
+    return (Address.query.filter_by(email_normalized=key)
+            .order_by(Address.created_at, Address.id).first())
+
+
+def upsert_address(data):
+    """
+    同じメールアドレス（大文字・小文字、全角・半角、前後の空白を区別しない）のアドレスがあれば更新し、なければ作成する
+    戻り値: (アドレス, 作成したか)
+    """
+    existing = find_address_by_email(data.get('email'))
+    if existing is not None:
+        # 既存のIDとメールアドレスの表記はそのまま残す
+        return update_address(existing.id, {k: v for k, v in data.items() if k not in ('id', 'email')}), False
+    email = data.get('email', '')
+    a = Address(
+        id=requested_id(data),
+        name=data.get('name', ''),
+        email=email,
+        email_normalized=normalize_email(email),
+        organization=data.get('organization'),
+        department=data.get('department')
+    )
+    db.session.add(a)
+    record_change('addresses', a)
+    return a, True
+
+
+def create_address(data):
+    return upsert_address(data)[0]
+
+
+def update_address(id, data):
+    a = Address.query.get_or_404(id)
+    a.name = data.get('name', a.name)
+    a.email = data.get('email', a.email)
+    a.email_normalized = normalize_email(a.email)
+    a.organization = data.get('organization', a.organization)
+    a.department = data.get('department', a.department)
+    record_change('addresses', a)
+    return a
+
+
+def delete_address(id):
+    a = Address.query.get_or_404(id)
+    # 削除するアドレスを参照しているグループメンバー・テンプレート既定宛先の行だけを削除
+    group_ids, template_ids = remove_address_references(id)
+    bump_group_versions(group_ids)
+    # 一括削除はセッション内のオブジェクトに反映されないため、読み込み済みのメンバー一覧は読み直させる
+    _expire_loaded(Group, group_ids, ['members', 'version'])
+    _expire_loaded(EmailTemplate, template_ids, ['recipients'])
+    for gid in group_ids:
+        record_change('groups', gid)
+    for tid in template_ids:
+        record_change('templates', tid)
+    db.session.delete(a)
+    record_change('addresses', id, 'delete')
+    return a
+
+
+# Groups
+def create_group(data):
+    g = Group(
+        id=requested_id(data),
+        group_name=data.get('group_name', ''),
+        custom_attributes=data.get('customAttributes', [])
+    )
+    set_group_members(g, data.get('memberIds', []))
+    db.session.add(g)
+    record_change('groups', g)
+    index_group(g)
+    return g
+
+
+def update_group(id, data):
+    g = Group.query.get_or_404(id)
+    g.group_name = data.get('group_name', g.group_name)
+    if 'memberIds' in data:
+        set_group_members(g, data['memberIds'])
+    g.custom_attributes = data.get('customAttributes', g.custom_attributes)
+    g.version += 1
+    record_change('groups', g)
+    index_group(g)
+    return g
+
+
+def patch_members(id, data):
+    """メンバーの部分更新（data: {"version": 期待する版数, "operations": [...]}）"""
+    result = patch_group_members(id, data.get('operations'), data.get('version'))
+    if any(result[k] for k in ('added', 'removed', 'updated', 'moved')):
+        record_change('groups', id)
+    return result
+
+
+def delete_group(id):
+    g = Group.query.get_or_404(id)
+    db.session.delete(g)
+    remove_usages(GROUP, id)
+    record_change('groups', id, 'delete')
+    return g
+
+
+# Templates
+def create_template(data):
+    t = EmailTemplate(
+        id=requested_id(data),
+        title=data.get('title'),
+        subject=data.get('subject'),
+        body=data.get('body')
+    )
+    set_template_recipients(t, data.get('defaultRecipients', []))
+    db.session.add(t)
+    record_change('templates', t)
+    index_template(t)
+    return t
+
+
+def update_template(id, data):
+    t = EmailTemplate.query.get_or_404(id)
+    t.title = data.get('title', t.title)
+    t.subject = data.get('subject', t.subject)
+    t.body = data.get('body', t.body)
+    if 'defaultRecipients' in data:
+        set_template_recipients(t, data['defaultRecipients'])
+    record_change('templates', t)
+    if 'subject' in data or 'body' in data:
+        index_template(t)
+    return t
+
+
+def delete_template(id):
+    t = EmailTemplate.query.get_or_404(id)
+    db.session.delete(t)
+    remove_usages(TEMPLATE, id)
+    record_change('templates', id, 'delete')
+    return t
+
+
+# Globals
+def create_global(data):
+    g = GlobalVariable(id=requested_id(data), key=data.get('key'), value=data.get('value'))
+    db.session.add(g)
+    record_change('globals', g)
+    return g
+
+
+def update_global(id, data):
+    g = GlobalVariable.query.get_or_404(id)
+    _rename_if_requested(g.key, data)
+    g.key = data.get('key', g.key)
+    g.value = data.get('value', g.value)
+    record_change('globals', g)
+    return g
+
+
+def delete_global(id):
+    g = GlobalVariable.query.get_or_404(id)
+    db.session.delete(g)
+    record_change('globals', id, 'delete')
+    return g
+
+
+# AttrDefs
+def create_attrdef(data):
+    a = AttributeDefinition(id=requested_id(data), key=data.get('key'), label=data.get('label'))
+    db.session.add(a)
+    record_change('attrdefs', a)
+    return a
+
+
+def update_attrdef(id, data):
+    a = AttributeDefinition.query.get_or_404(id)
+    _rename_if_requested(a.key, data)
+    a.key = data.get('key', a.key)
+    a.label = data.get('label', a.label)
+    record_change('attrdefs', a)
+    return a
+
+
+def delete_attrdef(id):
+    a = AttributeDefinition.query.get_or_404(id)
+    db.session.delete(a)
+    record_change('attrdefs', id, 'delete')
+    return a
+
+
+# Variables
+def rename_variable(key, new_key):
+    """
+    変数のキーを変更する: 同じキーのグローバル変数・属性定義と、索引にあるテンプレート・グループを書き換える
+    戻り値: {"key", "globals": [...], "attrdefs": [...], "templates": [...], "groups": [...]}（変更したID）
+    """
+    definitions = {}
+    for collection, model in (('globals', GlobalVariable), ('attrdefs', AttributeDefinition)):
+        definitions[collection] = []
+        for item in model.query.filter_by(key=key):
+            item.key = new_key
+            record_change(collection, item)
+            definitions[collection].append(item.id)
+    templates, groups = _rename_usages(key, new_key)
+    return {'key': new_key, **definitions, 'templates': templates, 'groups': groups}
+
+
+def _rename_if_requested(old_key, data):
+    # {"key": 新しいキー, "renameUsages": true} の場合は、使っているテンプレート・グループも書き換える
+    new_key = data.get('key')
+    if data.get('renameUsages') and new_key and new_key != old_key:
+        _rename_usages(old_key, new_key)
+
+
+def _rename_usages(key, new_key):
+    templates, groups = rename_usages(key, new_key)
+    # 一括UPDATEはセッション内のオブジェクトに反映されないため、読み込み済みのものは読み直させる
+    _expire_loaded(EmailTemplate, templates, ['subject', 'body'])
+    _expire_loaded(Group, groups, ['custom_attributes', 'version'])
+    record_changes('templates', templates)
+    record_changes('groups', groups)
+    return templates, groups
+
+
+# コレクション -> 操作 -> 関数（createは data、updateは id, data、deleteは id を受け取る）
+MUTATIONS = {
+    'addresses': {'create': create_address, 'update': update_address, 'delete': delete_address},
+    'groups': {'create': create_group, 'update': update_group, 'delete': delete_group},
+    'templates': {'create': create_template, 'update': update_template, 'delete': delete_template},
+    'globals': {'create': create_global, 'update': update_global, 'delete': delete_global},
+    'attrdefs': {'create': create_attrdef, 'update': update_attrdef, 'delete': delete_attrdef},
+}
+
+
+def parse_operation(item):
+    """
+    /api/batch の1操作を検証して (op, collection, id, data) を返す（不正な場合はValueError）
+    形式: {"op": "create" | "update" | "delete", "collection": "groups", "id": "...", "data": {...}}
+    """
+    if not isinstance(item, dict):
+        raise ValueError('操作はオブジェクトで指定してください')
+    op = item.get('op')
+    if op not in OPS:
+        raise ValueError(f'op は {"/".join(OPS)} のいずれかを指定してください: {op!r}')
+    collection = item.get('collection')
+    if collection not in MUTATIONS:
+        raise ValueError(f'collection は {"/".join(MUTATIONS)} のいずれかを指定してください: {collection!r}')
+    data = item.get('data') or {}
+    if not isinstance(data, dict):
+        raise ValueError('data はオブジェクトで指定してください')
+    entity_id = item.get('id')
+    if entity_id is not None and not isinstance(entity_id, str):
+        raise ValueError('id は文字列で指定してください')
+    if op == 'create':
+        # 作成するIDは id と data.id のどちらでも指定できる（後続の操作から参照する場合に指定する）
+        if entity_id and not data.get('id'):
+            data = {**data, 'id': entity_id}
+        if data.get('id') is not None and not isinstance(data['id'], str):
+            raise ValueError('id は文字列で指定してください')
+    elif not entity_id:
+        raise ValueError(f'{op} には id を指定してください')
+    return op, collection, entity_id, data
+
+
+def apply_operation(op, collection, entity_id, data):
+    """
+    1操作を実行してflushし、(作成・更新・削除したエンティティのID, 新しく作成したか) を返す
+    アドレスの作成は同じメールアドレスのアドレスがあればそれを更新する（作成したか = False）
+    """
+    func = MUTATIONS[collection][op]
+    created = False
+    if op == 'create' and collection == 'addresses':
+        a, created = upsert_address(data)
+        entity_id = a.id
+    elif op == 'create':
+        entity_id, created = func(data).id, True
+    elif op == 'update':
+        func(entity_id, data)
+    else:
+        func(entity_id)
+    # 制約違反をこの操作の失敗として検出し、後続の操作が変更を読めるようにする
+    db.session.flush()
+    return entity_id, created
+
+
+def _expire_loaded(model, ids, attributes):
+    for id_ in ids:
+        obj = db.session.identity_map.get(identity_key(model, id_))
+        if obj is not None:
+            db.session.expire(obj, attributes)
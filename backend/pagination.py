@@ -0,0 +1,92 @@
+"""
+一覧APIのカーソル（キーセット）ページング・検索条件
+並び順は created_at DESC, id DESC で固定し、次ページの開始位置をカーソル文字列で受け渡す
+"""
+import base64
+import json
+from datetime import datetime
+
+from flask import abort
+from sqlalchemy import or_, tuple_
+
+# 1ページの最大件数
+MAX_LIMIT = 1000
+# レスポンスヘッダーで返す次ページのカーソル
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def encode_cursor(created_at, id):
+    raw = json.dumps([created_at.isoformat() if created_at else None, id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, id = json.loads(raw)
+        return datetime.fromisoformat(created_at), id
+    except (ValueError, TypeError):
+        abort(400, description='cursorが不正です')
+
+
+def parse_limit(args):
+    """limitパラメータを取得（未指定ならNone = 全件）"""
+    limit = args.get('limit')
+    if limit is None or limit == '':
+        return None
+    try:
+        limit = int(limit)
+    except ValueError:
+        abort(400, description='limitは整数で指定してください')
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def search_filter(q, columns, mode='substring'):
+    """
+    検索文字列の条件式: いずれかの列に部分一致（mode='prefix'なら前方一致）
+    LIKEの特殊文字はエスケープする
+    """
+    escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    pattern = f'{escaped}%' if mode == 'prefix' else f'%{escaped}%'
+    return or_(*[col.like(pattern, escape='\\') for col in columns])
+
+
+def apply_search(query, args, columns):
+    """qパラメータ（matchで prefix / substring を指定）による絞り込み"""
+    q = (args.get('q') or '').strip()
+    if not q:
+        return query
+    mode = args.get('match', 'substring')
+    if mode not in ('prefix', 'substring'):
+        abort(400, description='matchは prefix または substring を指定してください')
+    return query.filter(search_filter(q, columns, mode))
+
+
+def ordered(query, model, args):
+    """created_at DESC, id DESC で並べ、cursor指定時はその次の行からにする（件数は制限しない）"""
+    query = query.order_by(model.created_at.desc(), model.id.desc())
+    cursor = args.get('cursor')
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        query = query.filter(tuple_(model.created_at, model.id) < tuple_(created_at, last_id))
+    return query
+
+
+def paginate(query, model, args):
+    """
+    created_at DESC, id DESC の順にカーソルページングする
+    戻り値: (行リスト, 次ページのカーソル または None)
+    limit未指定の場合は従来どおり全件を返す
+    """
+    query = ordered(query, model, args)
+
+    limit = parse_limit(args)
+    if limit is None:
+        return query.all(), None
+
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.created_at, last.id)
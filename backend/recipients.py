@@ -0,0 +1,110 @@
+"""
+宛先の解決
+グループ・テンプレートの既定宛先・個別に指定したアドレスをサーバー側でまとめてアドレス帳と結合し、
+正規化したメールアドレスで重複を除いてTO/CC/BCCのリストを返す
+同じ人が複数の種別で指定された場合は TO > CC > BCC の優先順位で1か所にだけ入れる
+"""
+try:
+    from backend.models import db, Address, normalize_email
+    from backend.membership import members_by_group, recipients_by_template
+except ModuleNotFoundError:
+    from models import db, Address, normalize_email
+    from membership import members_by_group, recipients_by_template
+
+TYPES = ('TO', 'CC', 'BCC')
+# 種別の優先順位（小さいほど優先）
+PRECEDENCE = {t: i for i, t in enumerate(TYPES)}
+# 1回の解決で受け付けるグループ・テンプレート・アドレスの数
+MAX_SOURCES = 1000
+MAX_ADDRESSES = 20000
+# IN句1回あたりのID数
+ID_CHUNK_SIZE = 500
+ADDRESS_COLUMNS = (Address.id, Address.name, Address.email, Address.organization, Address.department)
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _type(value, default='TO'):
+    value = (value or default).upper()
+    return value if value in PRECEDENCE else default
+
+
+def load_address_rows(address_ids):
+    """アドレスIDの集合から {id: (id, name, email, organization, department)} を主キーで取得"""
+    result = {}
+    for chunk in _chunks(list(address_ids), ID_CHUNK_SIZE):
+        for row in db.session.execute(db.select(*ADDRESS_COLUMNS).where(Address.id.in_(chunk))).tuples():
+            result[row[0]] = row
+    return result
+
+
+def resolve_recipients(group_ids=(), template_ids=(), addresses=(), default_type='TO'):
+    """
+    宛先を解決する（テンプレートの既定宛先 → グループ（指定順） → 個別のアドレス の順に並べる）
+    addresses: アドレスIDの文字列、または {"id": ..., "type": "CC"} のリスト
+    戻り値: {"to": [...], "cc": [...], "bcc": [...], "total": 指定された宛先数, "duplicates": 除いた重複数,
+             "notFound": {"groups": [...], "templates": [...], "addresses": [...]}}
+    """
+    default_type = _type(default_type)
+    template_ids = list(dict.fromkeys(template_ids))
+    group_ids = list(dict.fromkeys(group_ids))
+
+    # (アドレスID, 種別) を並び順どおりに集める
+    entries = []
+    recipients = recipients_by_template(template_ids) if template_ids else {}
+    members = members_by_group(group_ids) if group_ids else {}
+    existing_templates = _existing_ids('templates', template_ids)
+    existing_groups = _existing_ids('groups', group_ids)
+    for tid in template_ids:
+        entries.extend((r['addressId'], _type(r['type'])) for r in recipients.get(tid, []))
+    for gid in group_ids:
+        entries.extend((m['id'], _type(m['recipientType'])) for m in members.get(gid, []))
+    for item in addresses:
+        if isinstance(item, dict):
+            entries.append((item.get('id'), _type(item.get('type'), default_type)))
+        else:
+            entries.append((item, default_type))
+
+    rows = load_address_rows({aid for aid, _ in entries if aid})
+
+    # 正規化したメールアドレスごとに、最も優先度の高い種別での最初の出現を残す
+    chosen = {}
+    missing = []
+    for seq, (aid, kind) in enumerate(entries):
+        row = rows.get(aid)
+        if row is None:
+            missing.append(aid)
+            continue
+        # メールアドレスが空のアドレスはIDで区別する
+        key = normalize_email(row[2]) or ('id', aid)
+        rank = PRECEDENCE[kind]
+        current = chosen.get(key)
+        if current is None or rank < current[0]:
+            chosen[key] = (rank, seq, row)
+
+    result = {t.lower(): [] for t in TYPES}
+    for rank, _, row in sorted(chosen.values(), key=lambda c: c[1]):
+        aid, name, email, organization, department = row
+        result[TYPES[rank].lower()].append({'id': aid, 'name': name, 'email': email,
+                                            'organization': organization, 'department': department})
+    result['total'] = len(entries)
+    result['duplicates'] = len(entries) - len(missing) - len(chosen)
+    result['notFound'] = {
+        'groups': [gid for gid in group_ids if gid not in existing_groups],
+        'templates': [tid for tid in template_ids if tid not in existing_templates],
+        'addresses': list(dict.fromkeys(aid for aid in missing if aid)),
+    }
+    return result
+
+
+def _existing_ids(table, ids):
+    if not ids:
+        return set()
+    t = db.metadata.tables[table]
+    found = set()
+    for chunk in _chunks(ids, ID_CHUNK_SIZE):
+        found.update(db.session.execute(db.select(t.c.id).where(t.c.id.in_(chunk))).scalars())
+    return found
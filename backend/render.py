@@ -0,0 +1,121 @@
+"""
+テンプレート変数の置換エンジン
+件名・本文を一度だけ解析してトークン列にコンパイルし、グループごとの描画ではコンパイル結果を再利用する
+変数の優先順位はフロントエンドのresolveTextVariablesと同じ（システム変数 > グローバル変数 > グループ属性）
+"""
+import re
+import threading
+from datetime import date
+
+try:
+    from backend.models import GlobalVariable
+except ModuleNotFoundError:
+    from models import GlobalVariable
+
+# {変数名} 形式の変数
+VARIABLE_PATTERN = re.compile(r'\{([^{}]+)\}')
+# システム変数: {本日} -> yyyymmdd
+SYSTEM_TODAY = '本日'
+# コンパイル済みテンプレートのキャッシュ上限
+MAX_CACHED_TEMPLATES = 1024
+
+
+class CompiledText:
+    """
+    コンパイル済みテキスト
+    parts は [文字列, 変数名, 文字列, 変数名, ..., 文字列] の交互の並び
+    """
+    __slots__ = ('parts', 'keys')
+
+    def __init__(self, text):
+        self.parts = tuple(VARIABLE_PATTERN.split(text or ''))
+        self.keys = tuple(dict.fromkeys(self.parts[1::2]))
+
+    def render(self, values):
+        """変数を置換したテキストと、値が見つからなかった変数名のリストを返す"""
+        parts = self.parts
+        if len(parts) == 1:
+            return parts[0], []
+        out = [parts[0]]
+        missing = []
+        for i in range(1, len(parts), 2):
+            key = parts[i]
+            value = values.get(key)
+            if value is None:
+                # 未定義の変数は {変数名} のまま残す
+                out.append('{' + key + '}')
+                if key not in missing:
+                    missing.append(key)
+            else:
+                out.append(value)
+            out.append(parts[i + 1])
+        return ''.join(out), missing
+
+
+class CompiledTemplate:
+    __slots__ = ('subject_source', 'body_source', 'subject', 'body')
+
+    def __init__(self, subject, body):
+        self.subject_source = subject
+        self.body_source = body
+        self.subject = CompiledText(subject)
+        self.body = CompiledText(body)
+
+    def render(self, values):
+        subject, missing_subject = self.subject.render(values)
+        body, missing_body = self.body.render(values)
+        missing = list(dict.fromkeys(missing_subject + missing_body))
+        return {'subject': subject, 'body': body, 'missing': missing}
+
+
+class TemplateCache:
+    """テンプレートIDごとのコンパイル結果キャッシュ（テンプレート更新・削除時に無効化）"""
+
+    def __init__(self, max_entries=MAX_CACHED_TEMPLATES):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, template):
+        with self.lock:
+            compiled = self.entries.get(template.id)
+        # 他プロセスからの更新にも対応するため、元の文面が変わっていれば再コンパイル
+        if (compiled is None or compiled.subject_source != template.subject
+                or compiled.body_source != template.body):
+            compiled = CompiledTemplate(template.subject, template.body)
+            with self.lock:
+                if len(self.entries) >= self.max_entries:
+                    self.entries.pop(next(iter(self.entries)))
+                self.entries[template.id] = compiled
+        return compiled
+
+    def invalidate(self, template_id):
+        with self.lock:
+            self.entries.pop(template_id, None)
+
+
+template_cache = TemplateCache()
+
+
+def today_string(today=None):
+    return (today or date.today()).strftime('%Y%m%d')
+
+
+def build_values(globals_map, custom_attributes=None, today=None):
+    """
+    置換に使う値の辞書を作る
+    優先順位: システム変数 > グローバル変数 > グループ属性
+    """
+    values = {}
+    for attr in custom_attributes or []:
+        if isinstance(attr, dict) and attr.get('key'):
+            # 同じキーが複数ある場合は先頭を優先
+            values.setdefault(attr['key'], '' if attr.get('value') is None else str(attr['value']))
+    values.update(globals_map)
+    values[SYSTEM_TODAY] = today_string(today)
+    return values
+
+
+def load_globals_map():
+    """グローバル変数を {キー: 値} の辞書で取得"""
+    return {g.key: g.value or '' for g in GlobalVariable.query.all()}
@@ -0,0 +1,227 @@
+"""
+全文検索（SQLite FTS5）
+アドレス・テンプレートをtrigramトークナイザで索引し、かな・漢字でも部分一致で検索できるようにする
+索引はトリガーで元テーブルと同期するため、一括インポートを含むすべての書き込みで自動更新される
+"""
+from sqlalchemy import bindparam, text
+
+try:
+    from backend.models import db
+except ModuleNotFoundError:
+    from models import db
+
+# trigramトークナイザで索引検索できる最小文字数（これより短い語はLIKEで絞り込む）
+MIN_TERM_LENGTH = 3
+MAX_LIMIT = 100
+
+# 検索対象: kind -> 元テーブル・索引列・列の重み・結果に含める列
+KINDS = {
+    'address': {
+        'table': 'addresses',
+        'fts': 'addresses_fts',
+        'columns': ['name', 'email', 'organization', 'department'],
+        'weights': [10.0, 5.0, 2.0, 2.0],
+        'fields': ['id', 'name', 'email', 'organization', 'department'],
+    },
+    'template': {
+        'table': 'templates',
+        'fts': 'templates_fts',
+        'columns': ['title', 'subject', 'body'],
+        'weights': [10.0, 5.0, 1.0],
+        'fields': ['id', 'title', 'subject'],
+    },
+}
+
+# FTS5が使えるかどうか（install_search_indexで判定）
+fts_enabled = False
+
+
+def detect_search_index():
+    """起動時: 索引テーブルが作成済みかどうかで全文検索の有効・無効を決める"""
+    global fts_enabled
+    names = [spec['fts'] for spec in KINDS.values()]
+    found = db.session.execute(
+        text("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name IN :names")
+        .bindparams(bindparam('names', expanding=True)),
+        {'names': names}
+    ).scalar()
+    db.session.rollback()
+    fts_enabled = found == len(names)
+    return fts_enabled
+
+
+def install_search_index():
+    """
+    FTS5索引と同期トリガーを作成する（作成済みなら何もしない）
+    FTS5/trigramが使えないSQLiteではFalseを返し、検索はLIKEで行う
+    """
+    global fts_enabled
+    try:
+        db.session.execute(text(
+            "CREATE TABLE IF NOT EXISTS fts_keys ("
+            " rowid INTEGER PRIMARY KEY, kind TEXT NOT NULL, ref_id TEXT NOT NULL,"
+            " UNIQUE (kind, ref_id))"
+        ))
+        created = False
+        for kind, spec in KINDS.items():
+            exists = db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': spec['fts']}
+            ).first()
+            if exists:
+                continue
+            db.session.execute(text(
+                f"CREATE VIRTUAL TABLE {spec['fts']} USING fts5("
+                f"{', '.join(spec['columns'])}, tokenize = 'trigram')"
+            ))
+            for statement in _trigger_sql(kind, spec):
+                db.session.execute(text(statement))
+            _rebuild(kind, spec)
+            created = True
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"全文検索索引を作成できませんでした（LIKE検索を使用します）: {e}")
+        fts_enabled = False
+        return False
+
+    if created:
+        print("全文検索索引を作成しました")
+    fts_enabled = True
+    return True
+
+
+def drop_sync_triggers():
+    """大量データの一括投入前に同期トリガーを削除する（投入後に rebuild_search_index で作り直す）"""
+    for spec in KINDS.values():
+        for suffix in ('ai', 'ad', 'au'):
+            db.session.execute(text(f"DROP TRIGGER IF EXISTS {spec['fts']}_{suffix}"))
+
+
+def rebuild_search_index():
+    """同期トリガーを作り直し、全件から索引を再構築する（コミットは呼び出し側で行う）"""
+    for kind, spec in KINDS.items():
+        for statement in _trigger_sql(kind, spec):
+            db.session.execute(text(statement.replace('CREATE TRIGGER', 'CREATE TRIGGER IF NOT EXISTS', 1)))
+        _rebuild(kind, spec)
+
+
+def reinstall_sync_triggers():
+    """同期トリガーを現在の定義で作り直す（索引テーブルがない場合は何もしない。コミットは呼び出し側で行う）"""
+    for kind, spec in KINDS.items():
+        exists = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': spec['fts']}
+        ).first()
+        if not exists:
+            continue
+        for suffix in ('ai', 'ad', 'au'):
+            db.session.execute(text(f"DROP TRIGGER IF EXISTS {spec['fts']}_{suffix}"))
+        for statement in _trigger_sql(kind, spec):
+            db.session.execute(text(statement))
+
+
+def _key_sql(kind, ref):
+    return f"(SELECT rowid FROM fts_keys WHERE kind = '{kind}' AND ref_id = {ref}.id)"
+
+
+def _trigger_sql(kind, spec):
+    table, fts, cols = spec['table'], spec['fts'], spec['columns']
+    col_list = ', '.join(cols)
+    new_values = ', '.join(f'new.{c}' for c in cols)
+    assignments = ', '.join(f'{c} = new.{c}' for c in cols)
+    return [
+        f"""CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN
+            INSERT OR IGNORE INTO fts_keys (kind, ref_id) VALUES ('{kind}', new.id);
+            INSERT INTO {fts} (rowid, {col_list}) VALUES ({_key_sql(kind, 'new')}, {new_values});
+        END""",
+        f"""CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN
+            DELETE FROM {fts} WHERE rowid = {_key_sql(kind, 'old')};
+            DELETE FROM fts_keys WHERE kind = '{kind}' AND ref_id = old.id;
+        END""",
+        # 索引しない列（email_normalized など）だけの更新では索引を書き換えない
+        f"""CREATE TRIGGER {fts}_au AFTER UPDATE OF id, {col_list} ON {table} BEGIN
+            UPDATE fts_keys SET ref_id = new.id WHERE kind = '{kind}' AND ref_id = old.id;
+            UPDATE {fts} SET {assignments} WHERE rowid = {_key_sql(kind, 'new')};
+        END""",
+    ]
+
+
+def _rebuild(kind, spec):
+    """既存データから索引を作り直す"""
+    table, fts, cols = spec['table'], spec['fts'], spec['columns']
+    db.session.execute(text(f"DELETE FROM {fts}"))
+    db.session.execute(text("DELETE FROM fts_keys WHERE kind = :kind"), {'kind': kind})
+    db.session.execute(text(
+        f"INSERT INTO fts_keys (kind, ref_id) SELECT :kind, id FROM {table}"
+    ), {'kind': kind})
+    db.session.execute(text(
+        f"INSERT INTO {fts} (rowid, {', '.join(cols)}) "
+        f"SELECT k.rowid, {', '.join('t.' + c for c in cols)} FROM {table} t "
+        f"JOIN fts_keys k ON k.kind = :kind AND k.ref_id = t.id"
+    ), {'kind': kind})
+
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _kind_query(kind, spec, terms, limit):
+    """
+    1種類分の検索SQLとパラメータを組み立てる
+    3文字以上の語はFTS索引でスコア順に検索し、短い語は元テーブルのLIKEで絞り込む
+    短い語だけの場合は並べ替えずに走査するため、一致が多いほど早く打ち切られる
+    """
+    long_terms = [t for t in terms if len(t) >= MIN_TERM_LENGTH] if fts_enabled else []
+    short_terms = [t for t in terms if t not in long_terms]
+    fields = ', '.join(f't.{f}' for f in spec['fields'])
+    params = {'limit': limit}
+    where = []
+
+    if long_terms:
+        fts = spec['fts']
+        source = (f"{fts} JOIN fts_keys k ON k.rowid = {fts}.rowid AND k.kind = '{kind}' "
+                  f"JOIN {spec['table']} t ON t.id = k.ref_id")
+        # 各語をフレーズとして扱い、すべてを含むものに一致（trigramなので部分一致になる）
+        params['match'] = ' AND '.join('"' + t.replace('"', '""') + '"' for t in long_terms)
+        where.append(f"{fts} MATCH :match")
+        weights = ', '.join(str(w) for w in spec['weights'])
+        rank = f"bm25({fts}, {weights})"
+        order = "ORDER BY rank, t.id "
+    else:
+        source = f"{spec['table']} t"
+        rank = "0.0"
+        order = ""
+
+    for i, term in enumerate(short_terms):
+        params[f's{i}'] = f'%{_escape_like(term)}%'
+        where.append('(' + ' OR '.join(f"t.{c} LIKE :s{i} ESCAPE '\\'" for c in spec['columns']) + ')')
+
+    sql = f"SELECT {fields}, {rank} AS rank FROM {source} WHERE {' AND '.join(where)} {order}LIMIT :limit"
+    return sql, params
+
+
+def search(q, kinds=None, limit=20, offset=0):
+    """
+    スコア順に検索結果を返す
+    戻り値: (結果リスト, 次ページのoffset または None)
+    """
+    terms = q.split()
+    if not terms:
+        return [], None
+    kinds = kinds or list(KINDS)
+
+    # 各種類から offset+limit+1 件ずつ取得してスコア順に統合
+    window = offset + limit + 1
+    merged = []
+    for kind in kinds:
+        spec = KINDS[kind]
+        sql, params = _kind_query(kind, spec, terms, window)
+        for row in db.session.execute(text(sql), params).mappings():
+            item = {f: row[f] for f in spec['fields']}
+            merged.append((row['rank'], kind, item))
+
+    merged.sort(key=lambda r: (r[0], r[1]))
+    page = merged[offset:offset + limit]
+    results = [{'type': kind, 'score': -rank if rank else 0.0, 'item': item} for rank, kind, item in page]
+    next_offset = offset + limit if len(merged) > offset + limit else None
+    return results, next_offset
@@ -1,5 +1,8 @@
 from app import create_app
-from models import db, Address, Group, EmailTemplate, GlobalVariable, AttributeDefinition
+from models import db, Address, Group, EmailTemplate, GlobalVariable, AttributeDefinition, normalize_email
+from membership import set_group_members, set_template_recipients
+from variables import index_group, index_template
+from changes import record_changes
 
 app = create_app()
 
@@ -106,35 +109,50 @@ DEMO_ATTR_DEFS = [
 ]
 
 with app.app_context():
+    # 登録したID（変更ログに記録し、起動中のサーバーの一覧のキャッシュにも反映させる）
+    added = {'addresses': [], 'groups': [], 'templates': [], 'globals': [], 'attrdefs': []}
+
     # Addresses
     for a in DEMO_ADDRESSES:
         if not Address.query.get(a['id']):
-            addr = Address(id=a['id'], name=a['name'], email=a['email'], organization=a.get('organization'), department=a.get('department'))
+            addr = Address(id=a['id'], name=a['name'], email=a['email'], email_normalized=normalize_email(a['email']), organization=a.get('organization'), department=a.get('department'))
             db.session.add(addr)
+            added['addresses'].append(addr.id)
 
     # Groups
     for g in DEMO_GROUPS:
         if not Group.query.get(g['id']):
-            grp = Group(id=g['id'], group_name=g['group_name'], member_ids=g.get('memberIds', []), custom_attributes=g.get('customAttributes', []))
+            grp = Group(id=g['id'], group_name=g['group_name'], custom_attributes=g.get('customAttributes', []))
+            set_group_members(grp, g.get('memberIds', []))
             db.session.add(grp)
+            added['groups'].append(grp.id)
+            index_group(grp)
 
     # Templates
     for t in DEMO_TEMPLATES:
         if not EmailTemplate.query.get(t['id']):
-            tpl = EmailTemplate(id=t['id'], title=t.get('title'), subject=t.get('subject'), body=t.get('body'), default_recipients=t.get('defaultRecipients', []))
+            tpl = EmailTemplate(id=t['id'], title=t.get('title'), subject=t.get('subject'), body=t.get('body'))
+            set_template_recipients(tpl, t.get('defaultRecipients', []))
             db.session.add(tpl)
+            added['templates'].append(tpl.id)
+            index_template(tpl)
 
     # Globals
     for g in DEMO_GLOBALS:
         if not GlobalVariable.query.get(g['id']):
             gv = GlobalVariable(id=g['id'], key=g['key'], value=g['value'])
             db.session.add(gv)
+            added['globals'].append(gv.id)
 
     # AttrDefs
     for a in DEMO_ATTR_DEFS:
         if not AttributeDefinition.query.get(a['id']):
             ad = AttributeDefinition(id=a['id'], key=a['key'], label=a.get('label'))
             db.session.add(ad)
+            added['attrdefs'].append(ad.id)
+
+    for collection, ids in added.items():
+        record_changes(collection, ids)
 
     db.session.commit()
     print('Seed data inserted')
@@ -0,0 +1,130 @@
+"""
+JSONのシリアライズと大きな一覧のストリーミング
+orjsonがインストールされていれば使用し、なければ標準のjsonを使う（pip install orjson）
+環境変数 OUTLOOK_TOOL_JSON_ENCODER=stdlib で標準のjsonに固定できる（比較用）
+
+件数の多い一覧は、DBから一定件数ずつ読みながらJSON配列（またはNDJSON）として送信し、
+全件のORMオブジェクト・辞書のリスト・エンコード済みの文字列を同時にメモリへ置かない
+"""
+import json
+import os
+from itertools import islice
+
+from flask import Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import text
+
+try:
+    from backend.models import db
+except ModuleNotFoundError:
+    from models import db
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if os.environ.get('OUTLOOK_TOOL_JSON_ENCODER', '').lower() == 'stdlib':
+    orjson = None
+
+# DBから一度に読み込む行数
+STREAM_BATCH = 1000
+# 送信する1チャンクの目安（バイト）
+CHUNK_SIZE = 64 * 1024
+# これより行数の多いテーブルの全件取得はストリーミングで返す（config: JSON_STREAM_MIN_ROWS）
+STREAM_MIN_ROWS = 5000
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+if orjson is not None:
+    # 日時は標準と同じくFlaskのdefault（HTTP日付）に任せる
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def dumps(obj, default=None):
+    """objをUTF-8のJSON（bytes）にする"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=default or DefaultJSONProvider.default, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # orjsonが扱えない値（64bitを超える整数など）は標準のjsonで処理する
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'),
+                      default=default or DefaultJSONProvider.default).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify・request.json で使うJSONプロバイダ（orjsonがあればそれでエンコードする）"""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, self.default).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj, self.default) + b'\n', mimetype=self.mimetype)
+
+
+def batched(iterable, size=STREAM_BATCH):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_json_array(batches):
+    """辞書のリストの列をJSON配列のバイト列として少しずつ返す"""
+    buffer = bytearray(b'[')
+    first = True
+    for batch in batches:
+        if not batch:
+            continue
+        if not first:
+            buffer += b','
+        # バッチごとに1回エンコードし、外側の [] を除いて連結する
+        buffer += dumps(batch)[1:-1]
+        first = False
+        if len(buffer) >= CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b']'
+    yield bytes(buffer)
+
+
+def iter_ndjson(batches):
+    """1行に1件のNDJSON"""
+    buffer = bytearray()
+    for batch in batches:
+        for item in batch:
+            buffer += dumps(item)
+            buffer += b'\n'
+        if len(buffer) >= CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def iter_json_object(head, arrays):
+    """
+    head（通常の値）の後にarrays（名前 -> バッチの列）を続けたJSONオブジェクト
+    例: {"versions": {...}, "addresses": [...], "groups": [...]}
+    """
+    yield dumps(head)[:-1]
+    separator = b',' if head else b''
+    for name, batches in arrays:
+        yield separator + dumps(name) + b':'
+        yield from iter_json_array(batches)
+        separator = b','
+    yield b'}'
+
+
+def stream_response(chunks, mimetype='application/json'):
+    return Response(stream_with_context(chunks), mimetype=mimetype)
+
+
+def estimated_rows(model):
+    """テーブルの行数の目安（max(rowid)なので削除済みの分だけ多めになるが、全件を数えない）"""
+    return db.session.execute(text(f'SELECT max(rowid) FROM "{model.__tablename__}"')).scalar() or 0
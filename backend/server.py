@@ -0,0 +1,169 @@
+"""
+WSGIサーバーの起動と停止
+本番モードはwaitress（純Pythonのマルチスレッドサーバー）、devモードはFlask（Werkzeug）の開発サーバーを使う
+どちらも serve_forever() / shutdown() の同じ形で扱えるようにする
+
+起動を速くするため、このモジュールはFlask・SQLAlchemyをimportしない
+（DeferredAppで先にポートを開き、アプリの作成と並行してブラウザを起動できるようにする）
+"""
+import threading
+import time
+
+try:
+    import waitress
+except ImportError:  # pragma: no cover - requirements.txt に含まれるが、未インストール時は開発サーバーで動かす
+    waitress = None
+
+SERVER_MODES = ('waitress', 'dev')
+DEFAULT_MODE = 'waitress'
+# リクエストを処理するワーカースレッド数
+DEFAULT_THREADS = 8
+# 同時接続数の上限（超えた分は接続の受け付けを一時停止する）
+DEFAULT_CONNECTION_LIMIT = 100
+# keep-alive接続を閉じるまでのアイドル秒数
+DEFAULT_CHANNEL_TIMEOUT = 60
+# Ctrl+C後に処理中のリクエストを待つ秒数
+SHUTDOWN_GRACE = 5.0
+# アプリの準備が終わるまでリクエストを待たせる最大秒数
+STARTUP_TIMEOUT = 60.0
+
+
+
+def max_long_poll_waiters(threads):
+    """
+    ロングポーリング（/api/changes?wait=）で同時に待たせるリクエスト数の上限
+    待機中のリクエストはワーカースレッドを占有するため、スレッドの半分までにして残りを通常のリクエストに使う
+    """
+    return max(1, (threads or DEFAULT_THREADS) // 2)
+
+class DeferredApp:
+    """
+    アプリの作成前に起動できるWSGIアプリ
+    準備中に届いたリクエストは set_app() が呼ばれるまで待たせてから処理する
+    """
+
+    def __init__(self):
+        self.app = None
+        self.error = None
+        self.ready = threading.Event()
+
+    def set_app(self, app):
+        self.app = app
+        self.ready.set()
+
+    def set_error(self, error):
+        self.error = error
+        self.ready.set()
+
+    def __call__(self, environ, start_response):
+        if not self.ready.wait(STARTUP_TIMEOUT) or self.app is None:
+            message = f'アプリケーションを起動できませんでした: {self.error}' if self.error else '起動中です'
+            start_response('503 Service Unavailable', [('Content-Type', 'text/plain; charset=utf-8'),
+                                                        ('Retry-After', '1')])
+            return [message.encode('utf-8')]
+        return self.app(environ, start_response)
+
+
+class WaitressServer:
+    mode = 'waitress'
+
+    def __init__(self, app, host, port, threads=DEFAULT_THREADS,
+                 connection_limit=DEFAULT_CONNECTION_LIMIT, channel_timeout=DEFAULT_CHANNEL_TIMEOUT):
+        self.threads = threads
+        self.server = waitress.create_server(
+            app, host=host, port=port,
+            threads=threads,
+            connection_limit=connection_limit,
+            channel_timeout=channel_timeout,
+            ident='OutlookMailTool',
+            # 終了時の停止待ちを短くするため、イベントループの待ち時間を短めにする
+            asyncore_loop_timeout=1,
+            clear_untrusted_proxy_headers=True,
+        )
+        self.ready = threading.Event()
+        self.stopped = threading.Event()
+
+    def serve_forever(self):
+        try:
+            # ポートはcreate_serverでbind済み。イベントループに入る直前に準備完了を通知する
+            self.ready.set()
+            self.server.run()
+        finally:
+            self.stopped.set()
+
+    def shutdown(self, timeout=SHUTDOWN_GRACE):
+        """
+        新しい接続の受け付けを止め、処理中・待機中のリクエストが終わるまで最大timeout秒待ってから停止する
+        ソケット操作はイベントループのスレッドで行う（pull_triggerで依頼する）
+        """
+        from waitress.server import BaseWSGIServer
+
+        server = self.server
+        # 複数アドレスで待ち受ける場合（MultiSocketServer）は map、単一の場合は _map
+        socket_map = getattr(server, 'map', None) or server._map
+        listeners = [d for d in list(socket_map.values()) if isinstance(d, BaseWSGIServer)]
+        trigger = listeners[0].trigger
+        dispatcher = server.task_dispatcher
+
+        def stop_accepting():
+            for listener in listeners:
+                listener.del_channel()
+                listener.socket.close()
+
+        trigger.pull_trigger(stop_accepting)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with dispatcher.lock:
+                busy = bool(dispatcher.queue) or dispatcher.active_count > 0
+            # 応答の送信が終わっていない接続も待つ
+            if not busy and not any(getattr(ch, 'total_outbufs_len', 0) for ch in list(socket_map.values())):
+                break
+            time.sleep(0.05)
+
+        # 残りの接続（keep-alive中のものを含む）を閉じるとイベントループが終了する
+        def close_all():
+            for channel in list(socket_map.values()):
+                if channel is not trigger:
+                    channel.close()
+            trigger.close()
+
+        trigger.pull_trigger(close_all)
+        dispatcher.shutdown(cancel_pending=True, timeout=timeout)
+        self.stopped.wait(timeout)
+
+
+class DevServer:
+    """Werkzeugの開発サーバー（従来の app.run(threaded=True) と同じ動作）"""
+    mode = 'dev'
+
+    def __init__(self, app, host, port, **_options):
+        from werkzeug.serving import make_server as make_dev_server
+        self.threads = None
+        self.server = make_dev_server(host, port, app, threaded=True)
+        self.ready = threading.Event()
+
+    def serve_forever(self):
+        self.ready.set()
+        self.server.serve_forever()
+
+    def shutdown(self, timeout=SHUTDOWN_GRACE):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_server(app, host, port, mode=DEFAULT_MODE, **options):
+    """
+    指定モードのサーバーを作成する（ポートのbindまで行う）
+    waitressが未インストールの場合は開発サーバーにフォールバックする
+    options: threads, connection_limit, channel_timeout（waitressのみ有効）
+    """
+    if mode not in SERVER_MODES:
+        raise ValueError(f'不明なサーバーモードです: {mode}')
+    if mode == 'waitress' and waitress is None:
+        print('waitressがインストールされていないため、開発サーバーで起動します')
+        mode = 'dev'
+    options = {k: v for k, v in options.items() if v is not None}
+    if mode == 'waitress':
+        return WaitressServer(app, host, port, **options)
+    return DevServer(app, host, port, **options)
@@ -0,0 +1,182 @@
+"""
+フロントエンド（dist/）の静的ファイル配信
+起動時にdist/を1回だけ走査して索引を作り、リクエストごとのファイル存在確認を行わない
+ビルド時に作成した .br / .gz があればAccept-Encodingに応じてそのまま返す
+ファイル名にハッシュを含むアセット（assets/index-XXXXXXXX.js）は immutable で長期キャッシュさせ、
+index.html はメモリに保持して返す
+
+ビルド後の圧縮ファイルの作成: python -m backend.static_assets dist
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+
+from flask import Response, request, send_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+INDEX_FILE = 'index.html'
+# Viteが出力するハッシュ付きファイル名（name-XXXXXXXX.ext）
+HASHED_ASSET = re.compile(r'(^|/)assets/.+-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$')
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+# ハッシュなしのファイルは毎回ETagで再検証させる
+REVALIDATE_CACHE = 'no-cache'
+# 配信しないファイル（dist/に紛れ込んだDBなど）
+EXCLUDED_SUFFIXES = ('.db', '.db-wal', '.db-shm', '.gitkeep')
+# 圧縮ファイルの拡張子とContent-Encoding（優先順）
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# Windowsではレジストリの設定によりmimetypesが .js を text/plain と判定することがあるため固定する
+MIMETYPES = {
+    '.js': 'text/javascript', '.mjs': 'text/javascript', '.css': 'text/css', '.html': 'text/html',
+    '.svg': 'image/svg+xml', '.json': 'application/json', '.map': 'application/json', '.wasm': 'application/wasm',
+}
+# 圧縮する種類と最小サイズ
+COMPRESSIBLE = ('.js', '.mjs', '.css', '.html', '.svg', '.json', '.map', '.txt', '.xml', '.wasm')
+MIN_COMPRESS_SIZE = 1024
+
+
+class StaticFile:
+    __slots__ = ('path', 'mimetype', 'etag', 'cache_control', 'variants')
+
+    def __init__(self, path, mimetype, etag, cache_control):
+        self.path = path
+        self.mimetype = mimetype
+        self.etag = etag
+        self.cache_control = cache_control
+        # {Content-Encoding: ファイルパス}
+        self.variants = {}
+
+
+class StaticAssets:
+    """dist/の索引（URLパス -> StaticFile）とindex.htmlのメモリ上のコピー"""
+
+    def __init__(self, root):
+        self.root = root
+        self.files = {}
+        self.index_body = None
+        self.index_variants = {}
+        self.index_etag = None
+        self.reload()
+
+    def reload(self):
+        files = {}
+        if os.path.isdir(self.root):
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    full = os.path.join(dirpath, filename)
+                    url_path = os.path.relpath(full, self.root).replace(os.sep, '/')
+                    if url_path.endswith(EXCLUDED_SUFFIXES) or url_path.endswith(tuple(s for _, s in ENCODINGS)):
+                        continue
+                    files[url_path] = self._index_file(url_path, full)
+        self.files = files
+
+        index = files.get(INDEX_FILE)
+        if index is not None:
+            with open(index.path, 'rb') as f:
+                self.index_body = f.read()
+            self.index_etag = index.etag
+            # index.htmlは小さいため、圧縮ファイルがなければ起動時にメモリ上で圧縮しておく
+            self.index_variants = {'gzip': gzip.compress(self.index_body, 9)}
+            if brotli is not None:
+                self.index_variants['br'] = brotli.compress(self.index_body)
+            self.index_variants = {k: v for k, v in self.index_variants.items() if len(v) < len(self.index_body)}
+
+    def _index_file(self, url_path, full):
+        with open(full, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()[:16]
+        # text/* にはFlaskがcharset=utf-8を付ける
+        mimetype = (MIMETYPES.get(os.path.splitext(url_path)[1].lower())
+                    or mimetypes.guess_type(url_path)[0] or 'application/octet-stream')
+        cache_control = IMMUTABLE_CACHE if HASHED_ASSET.search(url_path) else REVALIDATE_CACHE
+        entry = StaticFile(full, mimetype, digest, cache_control)
+        for encoding, suffix in ENCODINGS:
+            if os.path.isfile(full + suffix):
+                entry.variants[encoding] = full + suffix
+        return entry
+
+    def response(self, path):
+        """pathに対応するレスポンス（未知のパスはSPAのindex.html）"""
+        entry = self.files.get(path) if path and path != INDEX_FILE else None
+        if entry is None:
+            return self._index_response()
+
+        encoding = self._choose(entry.variants)
+        etag = entry.etag if encoding is None else f'{entry.etag}-{encoding}'
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = send_file(entry.variants.get(encoding, entry.path), mimetype=entry.mimetype,
+                                 conditional=False, etag=False, max_age=None)
+            if encoding is not None:
+                response.headers['Content-Encoding'] = encoding
+        return self._finish(response, etag, entry.cache_control, bool(entry.variants))
+
+    def _index_response(self):
+        if self.index_body is None:
+            return Response('dist/index.html が見つかりません（npm run build を実行してください）',
+                            status=404, mimetype='text/plain')
+        encoding = self._choose(self.index_variants)
+        etag = self.index_etag if encoding is None else f'{self.index_etag}-{encoding}'
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(self.index_variants.get(encoding, self.index_body),
+                                mimetype='text/html')
+            if encoding is not None:
+                response.headers['Content-Encoding'] = encoding
+        return self._finish(response, etag, REVALIDATE_CACHE, bool(self.index_variants))
+
+    @staticmethod
+    def _choose(variants):
+        for encoding, _ in ENCODINGS:
+            if encoding in variants and request.accept_encodings.quality(encoding) > 0:
+                return encoding
+        return None
+
+    @staticmethod
+    def _finish(response, etag, cache_control, varies):
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        if varies:
+            response.vary.add('Accept-Encoding')
+        return response
+
+
+def precompress(root):
+    """
+    ビルド後に実行: 圧縮対象のファイルごとに .gz（とbrotliがあれば .br）を作成する
+    圧縮しても小さくならないファイルは作成しない（index.htmlは起動時にメモリ上で圧縮する）
+    戻り値: 作成したファイル数
+    """
+    created = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            full = os.path.join(dirpath, filename)
+            if not filename.endswith(COMPRESSIBLE) or os.path.relpath(full, root) == INDEX_FILE:
+                continue
+            with open(full, 'rb') as f:
+                data = f.read()
+            if len(data) < MIN_COMPRESS_SIZE:
+                continue
+            outputs = {'.gz': gzip.compress(data, 9)}
+            if brotli is not None:
+                outputs['.br'] = brotli.compress(data, quality=11)
+            for suffix, compressed in outputs.items():
+                if len(compressed) >= len(data):
+                    continue
+                with open(full + suffix, 'wb') as f:
+                    f.write(compressed)
+                created += 1
+    return created
+
+
+if __name__ == '__main__':
+    target = sys.argv[1] if len(sys.argv) > 1 else 'dist'
+    count = precompress(target)
+    print(f'{target}: 圧縮ファイルを{count}件作成しました' + ('' if brotli else '（brotli未インストールのためgzipのみ）'))
@@ -0,0 +1,135 @@
+"""
+SQLiteストレージ設定
+WAL・PRAGMA・コネクションプール・ロック待ち（busy timeout）の設定を1か所にまとめる
+設定の優先順位: create_app(config) の指定 > 環境変数（OUTLOOK_TOOL_<キー>） > 既定値
+
+書き込みを行うリクエストは BEGIN IMMEDIATE でトランザクションを開始する
+（読み取り後に書き込みへ昇格する際の "database is locked" をbusy timeout内の待ちに変えるため）
+"""
+import os
+import sqlite3
+from contextvars import ContextVar
+
+from flask import request
+from sqlalchemy import event
+
+try:
+    from backend.models import db
+except ModuleNotFoundError:
+    from models import db
+
+ENV_PREFIX = 'OUTLOOK_TOOL_'
+
+DEFAULTS = {
+    # WALにすると読み取りが書き込みをブロックしない（ネットワーク共有上のDBでは DELETE を指定する）
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    # WALではNORMALでも電源断以外でのデータ破損はない
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    # ページキャッシュ（KB単位、接続ごと）
+    'SQLITE_CACHE_SIZE_KB': 20000,
+    # メモリマップドI/Oの上限（バイト、0で無効）
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+    'SQLITE_TEMP_STORE': 'MEMORY',
+    # ロック待ちの最大時間（ミリ秒）
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,
+    # コネクションプール（waitressのスレッド数以上にする）
+    'SQLITE_POOL_SIZE': 16,
+    'SQLITE_MAX_OVERFLOW': 8,
+    'SQLITE_POOL_TIMEOUT': 30,
+}
+
+CHOICES = {
+    'SQLITE_JOURNAL_MODE': ('WAL', 'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'OFF'),
+    'SQLITE_SYNCHRONOUS': ('OFF', 'NORMAL', 'FULL', 'EXTRA'),
+    'SQLITE_TEMP_STORE': ('DEFAULT', 'FILE', 'MEMORY'),
+}
+
+# 現在のリクエストが書き込みを行うか（Trueの場合 BEGIN IMMEDIATE で開始）
+write_intent = ContextVar('write_intent', default=False)
+# 書き込みを行わないHTTPメソッド
+READ_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+
+def load_settings(config=None, environ=None):
+    """既定値・環境変数・明示的な設定を合わせたストレージ設定を返す"""
+    environ = os.environ if environ is None else environ
+    config = config or {}
+    settings = {}
+    for key, default in DEFAULTS.items():
+        value = config.get(key, environ.get(ENV_PREFIX + key, default))
+        if isinstance(default, int):
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f'{key} には整数を指定してください: {value!r}')
+        else:
+            value = str(value).upper()
+            if value not in CHOICES[key]:
+                raise ValueError(f'{key} は {"/".join(CHOICES[key])} のいずれかを指定してください: {value!r}')
+        settings[key] = value
+    return settings
+
+
+def engine_options(settings):
+    """SQLALCHEMY_ENGINE_OPTIONS に渡すプール設定"""
+    return {
+        'pool_size': settings['SQLITE_POOL_SIZE'],
+        'max_overflow': settings['SQLITE_MAX_OVERFLOW'],
+        'pool_timeout': settings['SQLITE_POOL_TIMEOUT'],
+        'pool_pre_ping': False,
+        'connect_args': {
+            'timeout': settings['SQLITE_BUSY_TIMEOUT_MS'] / 1000,
+            # プールの接続はスレッド間で使い回す
+            'check_same_thread': False,
+        },
+    }
+
+
+def install(engine, settings):
+    """接続ごとのPRAGMA設定と、トランザクション開始方法をエンジンに登録する"""
+
+    @event.listens_for(engine, 'connect')
+    def _configure_connection(dbapi_connection, connection_record):
+        # pysqliteの暗黙のBEGINを止め、トランザクションの開始は下の _begin で行う
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"PRAGMA busy_timeout = {settings['SQLITE_BUSY_TIMEOUT_MS']}")
+            try:
+                cursor.execute(f"PRAGMA journal_mode = {settings['SQLITE_JOURNAL_MODE']}")
+            except sqlite3.OperationalError as e:
+                # 他のプロセスが接続中の場合はジャーナルモードを切り替えられない（現在のモードのまま続行）
+                print(f"ジャーナルモードを変更できませんでした: {e}")
+            cursor.execute(f"PRAGMA synchronous = {settings['SQLITE_SYNCHRONOUS']}")
+            cursor.execute(f"PRAGMA cache_size = -{settings['SQLITE_CACHE_SIZE_KB']}")
+            cursor.execute(f"PRAGMA mmap_size = {settings['SQLITE_MMAP_SIZE']}")
+            cursor.execute(f"PRAGMA temp_store = {settings['SQLITE_TEMP_STORE']}")
+        finally:
+            cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def _begin(conn):
+        conn.exec_driver_sql('BEGIN IMMEDIATE' if write_intent.get() else 'BEGIN')
+
+
+def read_only(view):
+    """POSTでもDBに書き込まないビュー（描画・エクスポート）に付ける: 長いストリーミング中に書き込みロックを持たない"""
+    view.read_only = True
+    return view
+
+
+def init_app(app, settings):
+    """エンジンへの登録と、リクエストごとの書き込み有無の判定を設定する"""
+    with app.app_context():
+        install(db.engine, settings)
+
+    @app.before_request
+    def _set_write_intent():
+        view = app.view_functions.get(request.endpoint)
+        write_intent.set(request.method not in READ_METHODS and not getattr(view, 'read_only', False))
+
+
+def pragma_status(connection):
+    """現在の接続のPRAGMA値（確認用）"""
+    names = ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store', 'busy_timeout')
+    return {name: connection.exec_driver_sql(f'PRAGMA {name}').scalar() for name in names}
@@ -0,0 +1,145 @@
+"""
+変数の使用箇所の索引
+グローバル変数・属性定義のキーから、それを使っているテンプレート（件名・本文の {キー}）と
+グループ（属性のキー）を引けるようにする。テンプレート・グループの保存時にその1件分だけを更新し、
+使用箇所の検索とキーの変更では全テンプレートの本文を走査しない
+"""
+try:
+    from backend.models import db, Group, EmailTemplate, VariableUsage
+    from backend.render import CompiledText
+except ModuleNotFoundError:
+    from models import db, Group, EmailTemplate, VariableUsage
+    from render import CompiledText
+
+TEMPLATE = 'template'
+GROUP = 'group'
+# IN句1回あたりのID数
+ID_CHUNK_SIZE = 500
+# 索引を作り直すときに一度に読み込む行数
+REBUILD_BATCH = 1000
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def template_keys(subject, body):
+    return set(CompiledText(subject).keys) | set(CompiledText(body).keys)
+
+
+def group_keys(custom_attributes):
+    return {a['key'] for a in custom_attributes or [] if isinstance(a, dict) and a.get('key')}
+
+
+def set_usages(kind, ref_id, keys):
+    """ref_id の索引を keys に置き換える（増減した行だけをINSERT・DELETEする）"""
+    t = VariableUsage.__table__
+    current = set(db.session.execute(
+        db.select(t.c.key).where(t.c.kind == kind, t.c.ref_id == ref_id)).scalars())
+    removed = current - keys
+    added = keys - current
+    if removed:
+        db.session.execute(t.delete().where(t.c.kind == kind, t.c.ref_id == ref_id, t.c.key.in_(removed)))
+    if added:
+        db.session.execute(t.insert(), [{'key': k, 'kind': kind, 'ref_id': ref_id} for k in added])
+
+
+def index_template(template):
+    set_usages(TEMPLATE, template.id, template_keys(template.subject, template.body))
+
+
+def index_group(group):
+    set_usages(GROUP, group.id, group_keys(group.custom_attributes))
+
+
+def remove_usages(kind, ref_id):
+    t = VariableUsage.__table__
+    db.session.execute(t.delete().where(t.c.kind == kind, t.c.ref_id == ref_id))
+
+
+def usage_ids(key, kind):
+    t = VariableUsage.__table__
+    return list(db.session.execute(
+        db.select(t.c.ref_id).where(t.c.key == key, t.c.kind == kind).order_by(t.c.ref_id)).scalars())
+
+
+def find_usages(key):
+    """
+    キーを使っているテンプレート・グループ
+    戻り値: {"templates": [{"id", "title"}], "groups": [{"id", "group_name"}]}
+    """
+    u = VariableUsage.__table__
+    templates = db.session.execute(
+        db.select(EmailTemplate.id, EmailTemplate.title)
+        .join(u, db.and_(u.c.ref_id == EmailTemplate.id, u.c.kind == TEMPLATE))
+        .where(u.c.key == key).order_by(EmailTemplate.created_at.desc(), EmailTemplate.id.desc())
+    )
+    groups = db.session.execute(
+        db.select(Group.id, Group.group_name)
+        .join(u, db.and_(u.c.ref_id == Group.id, u.c.kind == GROUP))
+        .where(u.c.key == key).order_by(Group.created_at.desc(), Group.id.desc())
+    )
+    return {
+        'templates': [{'id': tid, 'title': title} for tid, title in templates],
+        'groups': [{'id': gid, 'group_name': name} for gid, name in groups],
+    }
+
+
+def rename_usages(old, new):
+    """
+    索引にあるテンプレートの {old} を {new} に、グループの属性キー old を new に書き換える（コミットは呼び出し側）
+    対象の行だけを読み込んでexecutemanyでUPDATEし、索引はキーの付け替えだけを行う
+    戻り値: (書き換えたテンプレートのID, 書き換えたグループのID)
+    """
+    old_token, new_token = '{' + old + '}', '{' + new + '}'
+    templates = EmailTemplate.__table__
+    template_rows = []
+    for chunk in _chunks(usage_ids(old, TEMPLATE), ID_CHUNK_SIZE):
+        for tid, subject, body in db.session.execute(
+                db.select(templates.c.id, templates.c.subject, templates.c.body).where(templates.c.id.in_(chunk))):
+            template_rows.append({'_id': tid, 'subject': subject.replace(old_token, new_token) if subject else subject,
+                                  'body': body.replace(old_token, new_token) if body else body})
+    if template_rows:
+        db.session.execute(templates.update().where(templates.c.id == db.bindparam('_id'))
+                           .values(subject=db.bindparam('subject'), body=db.bindparam('body')), template_rows)
+
+    groups = Group.__table__
+    group_rows = []
+    for chunk in _chunks(usage_ids(old, GROUP), ID_CHUNK_SIZE):
+        for gid, attrs in db.session.execute(
+                db.select(groups.c.id, groups.c.custom_attributes).where(groups.c.id.in_(chunk))):
+            group_rows.append({'_id': gid, 'custom_attributes': [
+                {**a, 'key': new} if isinstance(a, dict) and a.get('key') == old else a for a in attrs or []]})
+    if group_rows:
+        # 属性の変更もグループの更新なので版数を上げる
+        db.session.execute(groups.update().where(groups.c.id == db.bindparam('_id'))
+                           .values(custom_attributes=db.bindparam('custom_attributes'),
+                                   version=groups.c.version + 1), group_rows)
+
+    # 索引: old の行を new に付け替える（既に new も使っている行は old を消すだけ）
+    u = VariableUsage.__table__
+    db.session.execute(db.insert(u).prefix_with('OR IGNORE').from_select(
+        ['key', 'kind', 'ref_id'], db.select(db.literal(new), u.c.kind, u.c.ref_id).where(u.c.key == old)))
+    db.session.execute(u.delete().where(u.c.key == old))
+    return [r['_id'] for r in template_rows], [r['_id'] for r in group_rows]
+
+
+def rebuild_usages():
+    """索引を全テンプレート・全グループから作り直す（マイグレーション・ベンチマーク用データの生成時）"""
+    t = VariableUsage.__table__
+    db.session.execute(t.delete())
+    sources = (
+        (TEMPLATE, db.select(EmailTemplate.id, EmailTemplate.subject, EmailTemplate.body),
+         lambda row: template_keys(row[1], row[2])),
+        (GROUP, db.select(Group.id, Group.custom_attributes), lambda row: group_keys(row[1])),
+    )
+    for kind, query, keys_of in sources:
+        rows = []
+        for row in db.session.execute(query.execution_options(yield_per=REBUILD_BATCH)):
+            rows.extend({'key': k, 'kind': kind, 'ref_id': row[0]} for k in keys_of(row))
+            if len(rows) >= REBUILD_BATCH:
+                db.session.execute(t.insert(), rows)
+                rows = []
+        if rows:
+            db.session.execute(t.insert(), rows)
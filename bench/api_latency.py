@@ -0,0 +1,465 @@
+"""
+全APIのレイテンシ（p50/p95/p99）とスループットの計測
+Flaskのテストクライアント（client）と、waitressを別プロセスで起動した実際のHTTP（http）の2通りで計測し、
+結果をJSONで保存する。コミット間の比較は --compare で行う
+
+    python bench/generate.py --size 10k
+    python bench/api_latency.py --db bench/data/bench-10k.db                 # client と http の両方
+    python bench/api_latency.py --db bench/data/bench-10k.db --modes http --clients 8
+    python bench/api_latency.py --only search,render --iterations 500
+    python bench/api_latency.py --compare bench/results/old.json bench/results/new.json
+
+計測はDBのコピーに対して行う（書き込み系のAPIも実行するため）
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from server_rps import ROOT, wait_ready  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+MODES = ('client', 'http')
+# 全件を返すAPIなど重いものは反復回数をこの割合に減らす
+HEAVY_FACTOR = 0.05
+MIN_HEAVY_ITERATIONS = 3
+# 描画・差し込み・ZIPで対象にするグループ数
+MERGE_GROUPS = 20
+BULK_ROWS = 100
+# --compare でp95がこの割合以上悪化した場合に終了コード1
+DEFAULT_THRESHOLD = 0.2
+
+
+class Case:
+    """
+    計測対象のAPI呼び出し1種類: request(i) が (method, path, body) を返す
+    fresh=Trueの場合は毎回異なるクエリ文字列を付け、レスポンスキャッシュを通らない処理時間を計測する
+    """
+
+    def __init__(self, name, method, path, body=None, heavy=False, fresh=False, after=None, label=None,
+                 requires=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+        self.heavy = heavy
+        self.fresh = fresh
+        # レスポンス本文を受け取る後処理（作成したIDの記録など）
+        self.after = after
+        # 結果に記録するパス
+        self.label = label or path
+        # 先に実行が必要なケース（更新・削除の前の作成）
+        self.requires = requires
+        self.token = ''
+
+    def request(self, i):
+        path = self.path(i) if callable(self.path) else self.path
+        if self.fresh:
+            path = f"{path}{'&' if '?' in path else '?'}_b={self.token}.{i}"
+        body = self.body(i) if callable(self.body) else self.body
+        return self.method, path, body
+
+
+def sample_ids(db_path):
+    """計測に使う既存データのID・検索語をDBから選ぶ"""
+    conn = sqlite3.connect(db_path)
+    try:
+        one = lambda sql: (conn.execute(sql).fetchone() or (None,))[0]  # noqa: E731
+        return {
+            'address_id': one('SELECT address_id FROM group_members ORDER BY group_id, "order" LIMIT 1'),
+            'group_id': one('SELECT id FROM groups ORDER BY id LIMIT 1'),
+            'group_ids': [r[0] for r in conn.execute(f'SELECT id FROM groups ORDER BY id LIMIT {MERGE_GROUPS}')],
+            'template_id': one('SELECT id FROM templates ORDER BY id LIMIT 1'),
+            'organization': one('SELECT organization FROM addresses WHERE organization IS NOT NULL LIMIT 1'),
+            'counts': {t: one(f'SELECT count(*) FROM {t}') for t in ('addresses', 'groups', 'templates')},
+        }
+    finally:
+        conn.close()
+
+
+def build_cases(sample, run_id):
+    """全 /api/* の計測ケース（読み取り→書き込みの順。同じ順で毎回実行する）"""
+    aid, gid, tid = sample['address_id'], sample['group_id'], sample['template_id']
+    gids = sample['group_ids']
+    org = sample['organization'] or ''
+
+    cases = [
+        Case('health', 'GET', '/api/health'),
+        Case('addresses.page', 'GET', '/api/addresses?limit=100', fresh=True),
+        Case('addresses.page.cached', 'GET', '/api/addresses?limit=100'),
+        Case('addresses.all', 'GET', '/api/addresses', heavy=True, fresh=True),
+        Case('addresses.filter', 'GET', f'/api/addresses?organization={quote(org)}', fresh=True),
+        Case('addresses.q', 'GET', f"/api/addresses?q={quote('山田')}&limit=50", fresh=True),
+        Case('addresses.groups', 'GET', f'/api/addresses/{aid}/groups', fresh=True),
+        Case('groups.page', 'GET', '/api/groups?limit=100', fresh=True),
+        Case('groups.all', 'GET', '/api/groups', heavy=True, fresh=True),
+        Case('templates.page', 'GET', '/api/templates?limit=100', fresh=True),
+        Case('templates.all', 'GET', '/api/templates', heavy=True, fresh=True),
+        Case('globals', 'GET', '/api/globals', fresh=True),
+        Case('attrdefs', 'GET', '/api/attrdefs', fresh=True),
+        Case('bootstrap', 'GET', '/api/bootstrap', heavy=True, fresh=True),
+        Case('bootstrap.cached', 'GET', '/api/bootstrap'),
+        Case('changes', 'GET', '/api/changes?since=0&limit=500'),
+        Case('search', 'GET', f"/api/search?q={quote('山田 施工管理')}", fresh=True),
+        Case('search.short', 'GET', f"/api/search?q={quote('山田')}&type=address", fresh=True),
+        Case('render', 'POST', '/api/render', {'templateId': tid, 'groupId': gid}),
+        Case('render.groups', 'POST', '/api/render', {'templateId': tid, 'groupIds': gids}),
+        Case('mailmerge', 'POST', '/api/mailmerge', {'templateId': tid, 'groupIds': gids}),
+        Case('eml', 'POST', '/api/eml', {
+            'subject': '【港区庁舎改修現場】本日の作業報告', 'body': 'お疲れ様です。\n本日の作業内容を報告いたします。\n' * 20,
+            'to': [{'name': '山田 太郎', 'email': 'yamada.taro@example.com'}],
+            'cc': [{'name': f'関係者{k}', 'email': f'cc{k}@example.com'} for k in range(10)]}),
+        Case('eml.zip', 'POST', '/api/eml/zip', {'templateId': tid, 'groupIds': gids}),
+        Case('recipients', 'POST', '/api/recipients/resolve',
+             {'groupIds': gids, 'templateIds': [tid], 'addressIds': [aid]}),
+        Case('variables.usages', 'GET', f"/api/variables/{quote('工事番号')}/usages", fresh=True),
+    ]
+
+    # 書き込み: 作成したIDを後続の更新・削除で使う
+    for collection, body, update in (
+        ('addresses',
+         lambda i: {'name': f'計測 {i}', 'email': f'bench.{run_id}.{i}@example.com', 'organization': '計測',
+                    'department': '計測'},
+         lambda i: {'name': f'計測 更新{i}'}),
+        ('groups',
+         lambda i: {'group_name': f'計測グループ{run_id}-{i}', 'memberIds': [{'id': aid, 'recipientType': 'to'}],
+                    'customAttributes': [{'key': '現場名', 'value': f'計測現場{i}'}]},
+         lambda i: {'group_name': f'計測グループ更新{i}'}),
+        ('templates',
+         lambda i: {'title': f'計測テンプレート{i}', 'subject': '【{現場名}】計測', 'body': '{会社名}\n本文' * 10,
+                    'defaultRecipients': [{'addressId': aid, 'type': 'TO'}]},
+         lambda i: {'subject': f'【{{現場名}}】計測 更新{i}'}),
+        ('globals',
+         lambda i: {'key': f'計測_{run_id}_{i}', 'value': str(i)},
+         lambda i: {'value': f'更新{i}'}),
+        ('attrdefs',
+         lambda i: {'key': f'計測_{run_id}_{i}', 'label': str(i)},
+         lambda i: {'label': f'更新{i}'}),
+    ):
+        created = deque()
+        cases += [
+            Case(f'{collection}.create', 'POST', f'/api/{collection}', body,
+                 after=lambda payload, created=created: created.append(json.loads(payload)['id'])),
+            Case(f'{collection}.update', 'PUT',
+                 lambda i, created=created, c=collection: f'/api/{c}/{created[i % len(created)]}', update,
+                 label=f'/api/{collection}/<id>', requires=f'{collection}.create'),
+            Case(f'{collection}.delete', 'DELETE',
+                 lambda i, created=created, c=collection: f'/api/{c}/{created.popleft()}',
+                 label=f'/api/{collection}/<id>', requires=f'{collection}.create'),
+        ]
+
+    cases.append(Case('addresses.bulk', 'POST', '/api/addresses/bulk', lambda i: [
+        {'name': f'一括 {i}-{k}', 'email': f'bulk.{run_id}.{i}.{k}@example.com', 'organization': '計測'}
+        for k in range(BULK_ROWS)]))
+    # メンバーの部分更新（全メンバーを送らずに1人の追加と削除）
+    cases.append(Case('groups.members', 'PATCH', f'/api/groups/{gid}/members', {'operations': [
+        {'op': 'add', 'id': aid, 'recipientType': 'cc'}, {'op': 'remove', 'id': aid}]}))
+    # 複数コレクションの編集を1回のコミットで（アドレス2件の作成・グループ作成・テンプレート更新）
+    cases.append(Case('batch', 'POST', '/api/batch', lambda i: [
+        {'op': 'create', 'collection': 'addresses', 'id': f'addr-batch-{run_id}-{i}-{k}',
+         'data': {'name': f'一括編集 {i}-{k}', 'email': f'batch.{run_id}.{i}.{k}@example.com'}}
+        for k in range(2)] + [
+        {'op': 'create', 'collection': 'groups',
+         'data': {'group_name': f'一括編集グループ{run_id}-{i}',
+                  'memberIds': [{'id': f'addr-batch-{run_id}-{i}-{k}', 'recipientType': 'to', 'order': k}
+                                for k in range(2)]}},
+        {'op': 'update', 'collection': 'templates', 'id': tid, 'data': {'subject': f'【{{現場名}}】一括編集{i}'}},
+    ]))
+    # 変数のキーの変更（使っているテンプレート・グループの書き換え）。往復させて元のキーに戻す
+    rename_keys = ('契約金額', f'契約金額{run_id}')
+    cases.append(Case('variables.rename', 'POST',
+                      lambda i: f"/api/variables/{quote(rename_keys[i % 2])}/rename",
+                      lambda i: {'to': rename_keys[(i + 1) % 2]},
+                      heavy=True, label='/api/variables/<key>/rename'))
+    for case in cases:
+        case.token = run_id
+    return cases
+
+
+class ClientRunner:
+    """Flaskのテストクライアントでリクエストする（HTTP・サーバーを含まないアプリ自体の処理時間）"""
+
+    def __init__(self, db_path):
+        from backend.app import create_app
+        self.app = create_app({'DATABASE_PATH': db_path})
+
+    def session(self):
+        client = self.app.test_client()
+
+        def request(method, path, body):
+            response = client.open(path, method=method, json=body)
+            payload = response.get_data()
+            response.close()
+            return response.status_code, payload
+
+        return request, lambda: None
+
+    def close(self):
+        from backend.models import db
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+
+
+class HttpRunner:
+    """waitressを別プロセスで起動し、keep-alive接続でリクエストする"""
+
+    def __init__(self, db_path, threads, port):
+        self.port = port
+        cmd = [sys.executable, os.path.join(ROOT, 'bench', 'server_rps.py'), '--serve', 'waitress',
+               '--port', str(port), '--db', db_path, '--threads', str(threads)]
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        try:
+            wait_ready(self.proc)
+        except Exception:
+            self.close()
+            raise
+
+    def session(self):
+        conn = [http.client.HTTPConnection('127.0.0.1', self.port, timeout=120)]
+
+        def request(method, path, body):
+            headers = {'Accept-Encoding': 'gzip, br'}
+            data = None
+            if body is not None:
+                headers['Content-Type'] = 'application/json'
+                data = json.dumps(body).encode('utf-8')
+            try:
+                conn[0].request(method, path, data, headers)
+                resp = conn[0].getresponse()
+                payload = resp.read()
+                if resp.will_close:
+                    conn[0].close()
+                return resp.status, payload
+            except (OSError, http.client.HTTPException):
+                conn[0].close()
+                return 0, b''
+
+        return request, lambda: conn[0].close()
+
+    def close(self):
+        self.proc.terminate()
+        self.proc.wait(10)
+
+
+def percentile(sorted_values, p):
+    """線形補間したパーセンタイル（sorted_valuesは昇順）"""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def run_case(runner, case, iterations, warmup, clients):
+    """ケースをclients並列で合計iterations回実行し、レイテンシの統計を返す"""
+    # 更新・削除は作成済みのIDを使うため、ウォームアップは読み取りと描画系だけ行う
+    if case.method in ('GET', 'POST') and case.after is None and not case.name.endswith('.bulk'):
+        request, close = runner.session()
+        for i in range(warmup):
+            request(*case.request(-1 - i))
+        close()
+
+    counter = iter(range(iterations))
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+    sizes = [0]
+
+    def worker():
+        request, close = runner.session()
+        try:
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                method, path, body = case.request(i)
+                started = time.perf_counter()
+                status, payload = request(method, path, body)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    if 200 <= status < 400:
+                        latencies.append(elapsed)
+                        sizes[0] += len(payload)
+                    else:
+                        errors[0] += 1
+                if case.after and 200 <= status < 400:
+                    case.after(payload)
+        finally:
+            close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ok = len(latencies)
+    return {
+        'method': case.method,
+        'path': case.label,
+        'requests': ok,
+        'errors': errors[0],
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / ok * 1000, 3) if ok else 0.0,
+        'max_ms': round(latencies[-1] * 1000, 3) if ok else 0.0,
+        'rps': round(ok / wall, 1) if wall else 0.0,
+        'bytes': sizes[0] // ok if ok else 0,
+    }
+
+
+def git_revision():
+    def git(*args):
+        try:
+            return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True, timeout=30).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ''
+    return {'commit': git('rev-parse', 'HEAD'), 'subject': git('log', '-1', '--format=%s'),
+            'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+
+
+def run_mode(mode, args, source_db, sample):
+    """DBのコピーに対して1つのモードで全ケースを計測する"""
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, 'data.db')
+    shutil.copy(source_db, db_path)
+    runner = None
+    results = {}
+    try:
+        runner = (ClientRunner(db_path) if mode == 'client'
+                  else HttpRunner(db_path, args.threads, args.port))
+        run_id = f'{mode}{int(time.time())}'
+        cases = build_cases(sample, run_id)
+        selected = {c.name for c in cases
+                    if (not args.only or any(name in c.name for name in args.only))
+                    and not any(name in c.name for name in args.skip)}
+        selected |= {c.requires for c in cases if c.name in selected and c.requires}
+        for case in cases:
+            if case.name not in selected:
+                continue
+            iterations = args.iterations
+            if case.heavy:
+                iterations = max(MIN_HEAVY_ITERATIONS, int(iterations * HEAVY_FACTOR))
+            r = run_case(runner, case, iterations, args.warmup, args.clients)
+            results[case.name] = r
+            print(f"  {mode:<6} {case.name:<22} p50 {r['p50_ms']:8.2f}ms  p95 {r['p95_ms']:8.2f}ms  "
+                  f"p99 {r['p99_ms']:8.2f}ms  {r['rps']:8.1f}/s" + (f"  errors {r['errors']}" if r['errors'] else ''),
+                  flush=True)
+    finally:
+        if runner is not None:
+            runner.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(old_path, new_path, threshold):
+    """2つの結果ファイルのp50/p95を比較し、しきい値を超えて悪化したケースがあれば1を返す"""
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    print(f"old: {old['meta']['git']['commit'][:10]} {old['meta']['git']['subject']}")
+    print(f"new: {new['meta']['git']['commit'][:10]} {new['meta']['git']['subject']}")
+    for key in ('clients', 'threads', 'database', 'sqlite'):
+        a, b = old['meta'].get(key), new['meta'].get(key)
+        if key == 'database':
+            a, b = ({k: v for k, v in (d or {}).items() if k != 'path'} for d in (a, b))
+        if a != b:
+            print(f"  注意: 計測条件 {key} が異なります（{a} -> {b}）")
+    regressions = 0
+    for mode, cases in new['results'].items():
+        for name, r in cases.items():
+            before = old['results'].get(mode, {}).get(name)
+            if before is None:
+                print(f"  {mode:<6} {name:<22} （新規）p95 {r['p95_ms']:8.2f}ms")
+                continue
+            ratio = (r['p95_ms'] / before['p95_ms'] - 1) if before['p95_ms'] else 0.0
+            regressed = ratio > threshold and r['p95_ms'] - before['p95_ms'] > 1.0
+            regressions += regressed
+            print(f"  {mode:<6} {name:<22} p50 {before['p50_ms']:8.2f} -> {r['p50_ms']:8.2f}ms  "
+                  f"p95 {before['p95_ms']:8.2f} -> {r['p95_ms']:8.2f}ms  {ratio:+7.1%}"
+                  + ('  ** 悪化' if regressed else ''))
+    print(f"悪化: {regressions}件（しきい値 p95 +{threshold:.0%}）")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='全APIのレイテンシ・スループットを計測')
+    parser.add_argument('--db', default=os.path.join(ROOT, 'data.db'),
+                        help='計測に使うDB（bench/generate.py で作成。コピーして使用する）')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--iterations', type=int, default=200, help='1ケースあたりのリクエスト数')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--clients', type=int, default=1, help='同時にリクエストするクライアント数')
+    parser.add_argument('--threads', type=int, default=8, help='waitressのワーカースレッド数（http）')
+    parser.add_argument('--port', type=int, default=5097)
+    parser.add_argument('--only', type=lambda s: [x for x in s.split(',') if x], default=[],
+                        help='名前に含まれる文字列で計測するケースを絞り込む（カンマ区切り）')
+    parser.add_argument('--skip', type=lambda s: [x for x in s.split(',') if x], default=[],
+                        help='名前に含まれる文字列で除外するケース（例: .all,bootstrap）')
+    parser.add_argument('--out', help='結果のJSON（既定: bench/results/<日時>-<コミット>.json）')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='2つの結果ファイルを比較する')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare, args.threshold)
+
+    source_db = os.path.abspath(args.db)
+    sample = sample_ids(source_db)
+    revision = git_revision()
+    counts = sample['counts']
+    print(f"{source_db}: addresses {counts['addresses']:,}  groups {counts['groups']:,}  "
+          f"templates {counts['templates']:,}  clients={args.clients}")
+
+    results = {}
+    for mode in [m.strip() for m in args.modes.split(',') if m.strip()]:
+        if mode not in MODES:
+            parser.error(f'--modes は {",".join(MODES)} から指定してください: {mode}')
+        results[mode] = run_mode(mode, args, source_db, sample)
+
+    report = {
+        'meta': {
+            'git': revision,
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'database': {'path': source_db, **counts},
+            'iterations': args.iterations,
+            'warmup': args.warmup,
+            'clients': args.clients,
+            'threads': args.threads,
+        },
+        'results': results,
+    }
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{(revision['commit'] or 'nogit')[:10]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'結果: {out}')
+    return 1 if any(r['errors'] for cases in results.values() for r in cases.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""
+送信キュー（POST /api/dispatch）の結合テスト
+ローカルに簡易SMTPサーバー（受信したメッセージを数えるだけ）を起動し、data.dbのコピーで送信ワーカーを動かして
+全メッセージが届くこと・一時的な失敗が再送されること・恒久的な失敗が failed になること・
+SMTP接続が使い回されていることを確認する（期待どおりでなければ終了コード1）
+
+    python bench/dispatch_e2e.py
+    python bench/dispatch_e2e.py --messages 500 --workers 4 --rate 600
+
+宛先ドメイン:
+    example.com / example.org  受け付ける（--rate でドメインごとの1分あたりの送信数を制限）
+    flaky.example              最初のRCPTだけ 451 を返す（再送されて届く）
+    reject.example             550 を返す（failed になる）
+"""
+import argparse
+import logging
+import os
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from server_rps import ROOT  # noqa: E402
+
+sys.path.insert(0, ROOT)
+
+DOMAINS = ('example.com', 'example.org', 'flaky.example', 'reject.example')
+
+
+class Sink:
+    """受信の集計（スレッド間で共有）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []
+        self.temporary_failures = 0
+        self.seen_flaky = set()
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    """EHLO/HELO/MAIL/RCPT/DATA/RSET/NOOP/QUIT だけを扱う最小限のSMTPサーバー"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        sink = self.server.sink
+        with sink.lock:
+            sink.connections += 1
+        self.reply('220 sink ready')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250-sink' if verb == 'EHLO' else '250 sink')
+                if verb == 'EHLO':
+                    self.reply('250 8BITMIME')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                address = command.split(':', 1)[1].strip().strip('<>').split('>', 1)[0]
+                domain = address.rsplit('@', 1)[-1].lower()
+                if domain == 'reject.example':
+                    self.reply('550 no such user')
+                    continue
+                if domain == 'flaky.example':
+                    with sink.lock:
+                        first = address not in sink.seen_flaky
+                        sink.seen_flaky.add(address)
+                        if first:
+                            sink.temporary_failures += 1
+                    if first:
+                        self.reply('451 try again later')
+                        continue
+                recipients.append(address)
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 end with .')
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(data)
+                with sink.lock:
+                    sink.messages.append((tuple(recipients), b''.join(lines)))
+                self.reply('250 queued')
+            elif verb == 'RSET':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('502 not implemented')
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SmtpHandler)
+        self.sink = Sink()
+
+
+def build_messages(count):
+    messages = []
+    for i in range(count):
+        domain = DOMAINS[i % len(DOMAINS)]
+        messages.append({
+            'to': [{'name': f'宛先{i}', 'email': f'user{i}@{domain}'}],
+            'subject': f'テスト {i}',
+            'body': f'本文 {i}\n.\n行頭のドットを含む行',
+        })
+    return messages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='送信キューの結合テスト（簡易SMTPサーバーを使用）')
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--rate', type=int, default=1200, help='ドメインごとの1分あたりの送信数')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    args = parser.parse_args(argv)
+
+    # 拒否されるドメインの失敗ログは想定どおりなので表示しない
+    logging.getLogger('outlook_tool.dispatch').setLevel(logging.ERROR)
+    sink_server = SmtpSink()
+    threading.Thread(target=sink_server.serve_forever, daemon=True).start()
+    tmp = tempfile.mkdtemp(prefix='dispatch-e2e-')
+    db_path = os.path.join(tmp, 'data.db')
+    shutil.copy(os.path.join(ROOT, 'data.db'), db_path)
+
+    from backend.app import create_app
+    app = create_app({
+        'DATABASE_PATH': db_path,
+        'DISPATCH_ENABLED': 1,
+        'DISPATCH_WORKERS': args.workers,
+        'DISPATCH_DOMAIN_RATE_PER_MINUTE': args.rate,
+        'DISPATCH_DOMAIN_BURST': 20,
+        'DISPATCH_RETRY_BASE_SECONDS': 0.2,
+        'DISPATCH_POLL_SECONDS': 0.1,
+        'SMTP_HOST': '127.0.0.1',
+        'SMTP_PORT': sink_server.server_address[1],
+        'SMTP_FROM': 'sender@example.com',
+    })
+    client = app.test_client()
+    dispatcher = app.extensions['dispatcher']
+    try:
+        started = time.perf_counter()
+        response = client.post('/api/dispatch', json={'messages': build_messages(args.messages)})
+        batch = response.get_json()
+        print(f"登録: {batch['queued']}件 ({(time.perf_counter() - started) * 1000:.1f} ms)")
+
+        deadline = time.monotonic() + args.timeout
+        while True:
+            counts = client.get(f"/api/dispatch/status?batchId={batch['batchId']}").get_json()['counts']
+            if counts['queued'] == 0 and counts['sending'] == 0:
+                break
+            if time.monotonic() > deadline:
+                print(f'タイムアウトしました: {counts}')
+                return 1
+            time.sleep(0.1)
+        elapsed = time.perf_counter() - started
+    finally:
+        dispatcher.stop()
+        sink_server.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    sink = sink_server.sink
+    rejected = sum(1 for i in range(args.messages) if DOMAINS[i % len(DOMAINS)] == 'reject.example')
+    expected = args.messages - rejected
+    print(f'送信完了: {elapsed:.2f}秒 ({args.messages / elapsed:.0f}通/秒)  {counts}')
+    print(f'受信: {len(sink.messages)}通 / 接続: {sink.connections}回 / 一時エラー: {sink.temporary_failures}回')
+
+    problems = []
+    if counts['sent'] != expected or len(sink.messages) != expected:
+        problems.append(f'送信済み {counts["sent"]}件・受信 {len(sink.messages)}通（期待 {expected}件）')
+    if counts['failed'] != rejected:
+        problems.append(f'失敗 {counts["failed"]}件（期待 {rejected}件）')
+    if sink.temporary_failures and counts['sent'] < expected:
+        problems.append('一時エラーのメッセージが再送されていません')
+    if sink.connections > max(args.workers * 4, args.messages // 10):
+        problems.append(f'SMTP接続が使い回されていません（{sink.connections}回）')
+    if any(b'X-Unsent' in data or b'\nBcc:' in data for _, data in sink.messages):
+        problems.append('送信したメッセージに下書き用のヘッダーが含まれています')
+    for problem in problems:
+        print(f'NG: {problem}')
+    if not problems:
+        print('OK')
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
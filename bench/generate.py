@@ -0,0 +1,273 @@
+"""
+ベンチマーク用の大量データ生成
+アドレス件数を指定し、グループ（約15人/現場）・テンプレート・既定宛先をそれに比例した件数で作成する
+同じ --seed なら毎回同じ内容になる
+
+    python bench/generate.py --size 10k                    # bench/data/bench-10k.db
+    python bench/generate.py --size 1M --out /tmp/big.db
+    python bench/generate.py --size 100 --out data.db --force
+
+全文検索の同期トリガーを外した状態でexecutemanyにより一括投入し、最後に索引をまとめて作り直す
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+SIZES = {'100': 100, '1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+DATA_DIR = os.path.join(ROOT, 'bench', 'data')
+# 1回のexecutemanyで投入する行数
+CHUNK = 20000
+# 1グループ（現場）あたりのメンバー数・アドレス何件につきテンプレート1件か
+GROUP_SIZE = 15
+ADDRESSES_PER_TEMPLATE = 500
+MIN_TEMPLATES = 6
+# 他の現場のグループにも所属するメンバー数（1グループあたり）
+SHARED_MEMBERS = 3
+BASE_TIME = datetime(2024, 4, 1)
+
+SURNAMES = [
+    ('山田', 'yamada'), ('鈴木', 'suzuki'), ('田中', 'tanaka'), ('佐藤', 'sato'), ('高橋', 'takahashi'),
+    ('伊藤', 'ito'), ('渡辺', 'watanabe'), ('中村', 'nakamura'), ('小林', 'kobayashi'), ('加藤', 'kato'),
+    ('吉田', 'yoshida'), ('松本', 'matsumoto'), ('木村', 'kimura'), ('林', 'hayashi'), ('清水', 'shimizu'),
+    ('山口', 'yamaguchi'), ('前田', 'maeda'), ('藤原', 'fujiwara'), ('坂本', 'sakamoto'), ('森田', 'morita'),
+    ('西村', 'nishimura'), ('石川', 'ishikawa'), ('池田', 'ikeda'), ('橋本', 'hashimoto'), ('遠藤', 'endo'),
+    ('青木', 'aoki'), ('村上', 'murakami'), ('野村', 'nomura'), ('岡田', 'okada'), ('三浦', 'miura'),
+]
+GIVEN_NAMES = [
+    ('太郎', 'taro'), ('花子', 'hanako'), ('浩', 'hiroshi'), ('健', 'ken'), ('美咲', 'misaki'),
+    ('誠', 'makoto'), ('由美', 'yumi'), ('大輔', 'daisuke'), ('一郎', 'ichiro'), ('恵子', 'keiko'),
+    ('修平', 'shuhei'), ('真理', 'mari'), ('正樹', 'masaki'), ('由香', 'yuka'), ('裕太', 'yuta'),
+    ('亮', 'ryo'), ('さくら', 'sakura'), ('健太', 'kenta'), ('美紀', 'miki'), ('勇', 'isamu'),
+]
+AREAS = ['港区', '新宿区', '横浜市', '川崎市', '千葉市', 'さいたま市', '相模原市', '八王子市', '船橋市', '藤沢市']
+FACILITIES = ['庁舎', '県立高校', '病院', '市民会館', '物流倉庫', '集合住宅', '図書館', '体育館', '浄水場', '橋梁']
+WORKS = ['改修', '新築', '増築', '耐震補強', '解体']
+DEPARTMENTS = ['現場代理人', '主任技術者', '施工管理', '施工管理', '安全管理', '品質管理', '事務',
+               '資材管理', '作業員', '作業員', '作業員', '協力業者', '協力業者', '発注者', '測量']
+DOMAINS = ['abc-construction.co.jp', 'abc-construction.co.jp', 'abc-construction.co.jp', 'partner-kensetsu.co.jp',
+           'city-office.lg.jp']
+TEMPLATE_KINDS = [
+    ('【現場】日報提出', '【{現場名}】本日の作業報告（{メール送付者名}）',
+     '各位\n\nお疲れ様です。{メール送付者名}です。\n{現場名}（工事番号：{工事番号}）の本日の作業内容を報告いたします。\n\n'
+     '■本日の作業内容\n・\n\n■明日の予定\n・\n\n以上、よろしくお願いいたします。\n\n----\n{会社名}\n{メール送付者名}'),
+    ('【発注者】施工状況報告', '【{工事番号}】{現場名} 施工状況報告',
+     '{現場責任者}様\n\nいつもお世話になっております。{会社名}の{メール送付者名}です。\n\n'
+     '{現場名}（工事番号：{工事番号}）の施工状況をご報告いたします。\n\n■進捗状況\n予定出来高：○○%\n実績出来高：○○%\n\n'
+     'ご確認のほど、よろしくお願いいたします。'),
+    ('【発注者】工期変更協議のお願い', '【{工事番号}】{現場名} 工期変更協議のお願い',
+     'ご担当者様\n\n{現場名}（工事番号：{工事番号}）につきまして、工期の変更をご協議いただきたくご連絡いたしました。\n\n'
+     '■現行工期\n{工期}\n\n■契約金額\n{契約金額}\n\n----\n{会社名}\n{本社住所}\nTEL: {本社電話番号}'),
+]
+GLOBALS = [('メール送付者名', '山田'), ('会社名', 'ABC建設株式会社'), ('本社住所', '東京都港区芝5-1-1'),
+           ('本社電話番号', '03-1234-5678')]
+ATTR_DEFS = [('現場名', 'プロジェクトや現場の名称'), ('工事番号', '工事管理番号'), ('現場責任者', '現場担当者名'),
+             ('工期', '工事開始日〜完了予定日'), ('契約金額', '請負契約金額')]
+
+
+def parse_size(value):
+    """'10k' / '1M' / '2500' などをアドレス件数に変換"""
+    key = value.strip().lower()
+    if key in SIZES:
+        return SIZES[key]
+    try:
+        count = int(key)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'件数は {"/".join(SIZES)} または整数で指定してください: {value!r}')
+    if count < 1:
+        raise argparse.ArgumentTypeError('件数は1以上を指定してください')
+    return count
+
+
+def size_label(count):
+    for label, n in SIZES.items():
+        if n == count:
+            return label
+    return str(count)
+
+
+def timestamp(i):
+    # SQLAlchemyのDateTime列と同じ文字列形式
+    return (BASE_TIME + timedelta(seconds=i)).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def address_id(i):
+    return f'addr-{i:07d}'
+
+
+def site_name(g):
+    name = f'{AREAS[g % len(AREAS)]}{FACILITIES[g // len(AREAS) % len(FACILITIES)]}' \
+           f'{WORKS[g // (len(AREAS) * len(FACILITIES)) % len(WORKS)]}現場'
+    cycle = g // (len(AREAS) * len(FACILITIES) * len(WORKS))
+    return name if cycle == 0 else f'{name}{cycle + 1}'
+
+
+def plan(count):
+    """アドレス件数から各テーブルの件数を決める"""
+    return {
+        'addresses': count,
+        'groups': max(1, -(-count // GROUP_SIZE)),
+        'templates': max(MIN_TEMPLATES, count // ADDRESSES_PER_TEMPLATE),
+    }
+
+
+def iter_addresses(count, rng):
+    for i in range(count):
+        surname, surname_r = SURNAMES[rng.randrange(len(SURNAMES))]
+        given, given_r = GIVEN_NAMES[rng.randrange(len(GIVEN_NAMES))]
+        email = f'{given_r}.{surname_r}{i}@{DOMAINS[i % len(DOMAINS)]}'
+        # 生成するメールアドレスはASCIIなので、正規化（normalize_email）は小文字化と同じ
+        yield (address_id(i), f'{surname} {given}', email, email.lower(),
+               site_name(i // GROUP_SIZE), DEPARTMENTS[i % GROUP_SIZE % len(DEPARTMENTS)], timestamp(i))
+
+
+def iter_groups(counts, rng):
+    for g in range(counts['groups']):
+        attrs = [
+            {'key': '現場名', 'value': site_name(g).replace('現場', '工事')},
+            {'key': '工事番号', 'value': f'2024-K-{g:05d}'},
+            {'key': '現場責任者', 'value': f'現場代理人{g}'},
+            {'key': '工期', 'value': f'2024年{g % 12 + 1}月1日～2026年{(g + 5) % 12 + 1}月28日'},
+            {'key': '契約金額', 'value': f'{rng.randrange(1, 200) * 1000:,}万円'},
+        ]
+        yield (f'grp-{g:06d}', site_name(g), json.dumps(attrs), timestamp(g))
+
+
+def iter_group_members(counts, rng):
+    total = counts['addresses']
+    for g in range(counts['groups']):
+        start = g * GROUP_SIZE
+        members = list(range(start, min(start + GROUP_SIZE, total)))
+        if total > GROUP_SIZE:
+            # 本社・協力業者など複数現場にまたがるメンバー
+            for a in rng.sample(range(total), SHARED_MEMBERS):
+                if a not in members:
+                    members.append(a)
+        for order, a in enumerate(members):
+            kind = 'to' if order < 2 else ('cc' if order < GROUP_SIZE else 'bcc')
+            yield (f'grp-{g:06d}', address_id(a), kind, order)
+
+
+def iter_templates(counts):
+    for t in range(counts['templates']):
+        title, subject, body = TEMPLATE_KINDS[t % len(TEMPLATE_KINDS)]
+        yield (f'tpl-{t:06d}', f'{title} {t + 1}', subject, body, timestamp(t))
+
+
+def iter_template_recipients(counts, rng):
+    for t in range(counts['templates']):
+        picks = rng.sample(range(counts['addresses']), min(counts['addresses'], rng.randint(1, 3)))
+        for position, a in enumerate(picks):
+            yield (f'tpl-{t:06d}', address_id(a), 'TO' if position == 0 else 'CC', position)
+
+
+def insert_rows(connection, sql, rows):
+    """CHUNK行ずつexecutemanyで投入し、件数を返す"""
+    total = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK:
+            connection.exec_driver_sql(sql, chunk)
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        connection.exec_driver_sql(sql, chunk)
+        total += len(chunk)
+    return total
+
+
+def generate(out, count, seed=0, quiet=False):
+    """outに新しいDBを作成してデータを投入し、テーブルごとの件数と所要時間を返す"""
+    from backend.app import create_app
+    from backend.models import db
+    from backend.search import drop_sync_triggers, rebuild_search_index
+    from backend.storage import write_intent
+    from backend.variables import rebuild_usages
+
+    # 投入中だけ同期書き込みを省略する（ジャーナル設定はDBに保存されない）
+    app = create_app({'DATABASE_PATH': out, 'SQLITE_JOURNAL_MODE': 'MEMORY', 'SQLITE_SYNCHRONOUS': 'OFF'})
+    rng = random.Random(seed)
+    counts = plan(count)
+    timings = {}
+    log = (lambda *a: None) if quiet else print
+
+    with app.app_context():
+        token = write_intent.set(True)
+        try:
+            connection = db.session.connection()
+            drop_sync_triggers()
+
+            started = time.perf_counter()
+            insert_rows(connection, 'INSERT INTO addresses (id, name, email, email_normalized, organization, '
+                                    'department, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        iter_addresses(count, rng))
+            insert_rows(connection, 'INSERT INTO groups (id, group_name, custom_attributes, created_at) '
+                                    'VALUES (?, ?, ?, ?)', iter_groups(counts, rng))
+            counts['group_members'] = insert_rows(
+                connection, 'INSERT OR IGNORE INTO group_members (group_id, address_id, recipient_type, "order") '
+                            'VALUES (?, ?, ?, ?)', iter_group_members(counts, rng))
+            insert_rows(connection, 'INSERT INTO templates (id, title, subject, body, created_at) '
+                                    'VALUES (?, ?, ?, ?, ?)', iter_templates(counts))
+            counts['template_recipients'] = insert_rows(
+                connection, 'INSERT OR IGNORE INTO template_recipients (template_id, address_id, type, position) '
+                            'VALUES (?, ?, ?, ?)', iter_template_recipients(counts, rng))
+            insert_rows(connection, 'INSERT INTO globals (id, key, value, created_at) VALUES (?, ?, ?, ?)',
+                        ((f'gvar-{i:03d}', k, v, timestamp(i)) for i, (k, v) in enumerate(GLOBALS)))
+            insert_rows(connection, 'INSERT INTO attrdefs (id, key, label, created_at) VALUES (?, ?, ?, ?)',
+                        ((f'atdef-{i:03d}', k, v, timestamp(i)) for i, (k, v) in enumerate(ATTR_DEFS)))
+            timings['insert'] = time.perf_counter() - started
+            log(f"  投入: {timings['insert']:.1f}s")
+
+            started = time.perf_counter()
+            rebuild_search_index()
+            rebuild_usages()
+            db.session.commit()
+            timings['search_index'] = time.perf_counter() - started
+            log(f"  全文検索索引・変数の索引: {timings['search_index']:.1f}s")
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            write_intent.reset(token)
+        db.session.remove()
+        db.engine.dispose()
+    return counts, timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ベンチマーク用の大量データを生成')
+    parser.add_argument('--size', type=parse_size, default=SIZES['10k'],
+                        help=f'アドレス件数（{"/".join(SIZES)} または整数）')
+    parser.add_argument('--out', help='出力先のDBファイル（既定: bench/data/bench-<size>.db）')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--force', action='store_true', help='出力先が存在する場合は削除して作り直す')
+    args = parser.parse_args(argv)
+
+    out = os.path.abspath(args.out or os.path.join(DATA_DIR, f'bench-{size_label(args.size)}.db'))
+    if os.path.exists(out):
+        if not args.force:
+            print(f'{out} は既に存在します（作り直す場合は --force を指定してください）')
+            return 1
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(out + suffix):
+                os.remove(out + suffix)
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+
+    print(f'{out}: アドレス{args.size:,}件のデータを生成しています...')
+    started = time.perf_counter()
+    counts, _ = generate(out, args.size, args.seed)
+    elapsed = time.perf_counter() - started
+    print('  ' + '  '.join(f'{name} {n:,}' for name, n in counts.items()))
+    print(f'完了: {elapsed:.1f}s（{os.path.getsize(out) / 1024 / 1024:.1f} MB）')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+全件一覧（GET /api/addresses）のピークメモリと最初の1バイトまでの時間（TTFB）の計測
+JSONエンコーダ（標準json / orjson）と、一括生成（buffered）・ストリーミング（streamed）の組み合わせを比較する
+
+    python bench/list_stream.py                          # bench/data/bench-100k.db（なければ生成）
+    python bench/list_stream.py --db bench/data/bench-1m.db --path /api/bootstrap
+
+各設定は別プロセスで実行する（エンコーダの選択はimport時に決まるため）
+- ピークメモリ: テストクライアントでレスポンスを読み切るまでのtracemallocのピーク
+- TTFB / 合計: waitressを起動し、HTTPで本文の最初の1バイト・最後のバイトを受け取るまでの時間
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from server_rps import ROOT, wait_ready  # noqa: E402
+
+PROFILES = {
+    'stdlib-buffered': {'OUTLOOK_TOOL_JSON_ENCODER': 'stdlib', 'OUTLOOK_TOOL_JSON_STREAM_MIN_ROWS': str(10 ** 12)},
+    'orjson-buffered': {'OUTLOOK_TOOL_JSON_STREAM_MIN_ROWS': str(10 ** 12)},
+    'stdlib-streamed': {'OUTLOOK_TOOL_JSON_ENCODER': 'stdlib'},
+    'orjson-streamed': {},
+}
+
+
+def measure_in_process(db_path, path, runs):
+    """子プロセス側: テストクライアントで計測（1回目はtracemallocなしで時間、最後にtracemalloc付きでピーク）"""
+    from backend.app import create_app
+    from backend import serialization
+
+    app = create_app({'DATABASE_PATH': db_path})
+    client = app.test_client()
+
+    def fetch(i):
+        sep = '&' if '?' in path else '?'
+        started = time.perf_counter()
+        response = client.get(f'{path}{sep}_b={i}', buffered=False)
+        first = None
+        size = 0
+        for chunk in response.response:
+            if first is None and chunk:
+                first = time.perf_counter() - started
+            size += len(chunk)
+        response.close()
+        return first, time.perf_counter() - started, size, 'Content-Length' not in response.headers
+
+    fetch('warmup')
+    timings = [fetch(i) for i in range(runs)]
+    tracemalloc.start()
+    fetch('memory')
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    best = min(timings, key=lambda t: t[1])
+    return {
+        'encoder': 'orjson' if serialization.orjson is not None else 'stdlib',
+        'streamed': best[3],
+        'bytes': best[2],
+        'app_ttfb_ms': best[0] * 1000,
+        'app_total_ms': best[1] * 1000,
+        'peak_mb': peak / 1024 / 1024,
+    }
+
+
+def measure_http(db_path, path, runs, port, env):
+    cmd = [sys.executable, os.path.join(ROOT, 'bench', 'server_rps.py'), '--serve', 'waitress',
+           '--port', str(port), '--db', db_path, '--threads', '4']
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, env=env)
+    try:
+        wait_ready(proc)
+        results = []
+        for i in range(runs + 1):
+            sep = '&' if '?' in path else '?'
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+            started = time.perf_counter()
+            conn.request('GET', f'{path}{sep}_h={i}')
+            resp = conn.getresponse()
+            resp.read(1)
+            first = time.perf_counter() - started
+            resp.read()
+            total = time.perf_counter() - started
+            conn.close()
+            if i:
+                results.append((first, total))
+    finally:
+        proc.terminate()
+        proc.wait(10)
+    best = min(results, key=lambda r: r[1])
+    return {'http_ttfb_ms': best[0] * 1000, 'http_total_ms': best[1] * 1000}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='全件一覧のピークメモリ・TTFBの計測')
+    parser.add_argument('--db', default=os.path.join(ROOT, 'bench', 'data', 'bench-100k.db'))
+    parser.add_argument('--path', default='/api/addresses')
+    parser.add_argument('--profiles', default=','.join(PROFILES))
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--port', type=int, default=5096)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(measure_in_process(args.db, args.path, args.runs)))
+        return 0
+
+    if not os.path.exists(args.db):
+        from generate import generate
+        print(f'{args.db} を生成しています（アドレス100,000件）...')
+        os.makedirs(os.path.dirname(args.db), exist_ok=True)
+        generate(args.db, 100000, quiet=True)
+
+    print(f'GET {args.path}  ({args.db})')
+    print(f"  {'profile':<16} {'streamed':>8} {'size MB':>8} {'peak MB':>8} {'app TTFB':>9} {'app total':>9} "
+          f"{'http TTFB':>9} {'http total':>10}")
+    for name in args.profiles.split(','):
+        env = dict(os.environ, **PROFILES[name.strip()])
+        out = subprocess.run([sys.executable, __file__, '--child', '--db', args.db, '--path', args.path,
+                              '--runs', str(args.runs)], env=env, capture_output=True, text=True, check=True)
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        r.update(measure_http(args.db, args.path, args.runs, args.port, env))
+        print(f"  {name:<16} {str(r['streamed']):>8} {r['bytes'] / 1024 / 1024:8.1f} {r['peak_mb']:8.1f} "
+              f"{r['app_ttfb_ms']:8.1f}ms {r['app_total_ms']:8.1f}ms {r['http_ttfb_ms']:8.1f}ms "
+              f"{r['http_total_ms']:9.1f}ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+ロングポーリング（/api/changes?wait=）と通常のリクエストの同居の確認
+waitressをワーカースレッド数より多いロングポーリングのクライアントと一緒に動かし、
+待機中のリクエストがスレッドを使い切らずに通常のAPIが応答し続けること・
+待機中のリクエストが書き込みで起こされることを確認する（期待どおりでなければ終了コード1）
+
+    python bench/longpoll.py
+    python bench/longpoll.py --threads 8 --pollers 32
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from server_rps import ROOT, wait_ready  # noqa: E402
+
+# 通常のリクエストの応答時間の上限（秒）
+MAX_LATENCY = 1.0
+
+
+def request(port, method, path, body=None, timeout=60):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        resp = conn.getresponse()
+        return resp.status, json.loads(resp.read() or b'null')
+    finally:
+        conn.close()
+
+
+class Poller(threading.Thread):
+    """ロングポーリングを繰り返すクライアント（retryAfterが返ったらその秒数だけ待つ）"""
+
+    def __init__(self, port, since, stop):
+        super().__init__(daemon=True)
+        self.port = port
+        self.since = since
+        self.stop = stop
+        self.busy = 0
+        self.received = 0
+
+    def run(self):
+        while not self.stop.is_set():
+            try:
+                _, data = request(self.port, 'GET', f'/api/changes?since={self.since}&wait=30')
+            except (OSError, http.client.HTTPException):
+                # 終了時にサーバーを止めると待機中の接続が切れる
+                continue
+            self.since = data['lastSeq']
+            self.received += len(data['changes'])
+            if data.get('retryAfter'):
+                self.busy += 1
+                self.stop.wait(data['retryAfter'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ロングポーリング中の通常リクエストの応答時間を確認')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--pollers', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--port', type=int, default=5097)
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix='longpoll-')
+    db_path = os.path.join(tmp, 'data.db')
+    shutil.copy(os.path.join(ROOT, 'data.db'), db_path)
+    cmd = [sys.executable, os.path.join(ROOT, 'bench', 'server_rps.py'), '--serve', 'waitress',
+           '--port', str(args.port), '--db', db_path, '--threads', str(args.threads)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    stop = threading.Event()
+    try:
+        wait_ready(proc)
+        _, data = request(args.port, 'GET', '/api/changes')
+        since = data['lastSeq']
+        pollers = [Poller(args.port, since, stop) for _ in range(args.pollers)]
+        for p in pollers:
+            p.start()
+        # 全員がロングポーリングを開始する（または待機枠が埋まって断られる）まで待つ
+        time.sleep(1.0)
+
+        latencies = []
+        for i in range(args.requests):
+            started = time.perf_counter()
+            try:
+                status, _ = request(args.port, 'GET', f'/api/globals?_={i}', timeout=MAX_LATENCY * 10)
+            except OSError:
+                print(f'NG: ロングポーリング中に GET /api/globals が{MAX_LATENCY * 10:.0f}秒以内に応答しませんでした')
+                return 1
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                print(f'NG: GET /api/globals が {status} を返しました')
+                return 1
+
+        # 書き込みで待機中のクライアントが起こされること
+        started = time.perf_counter()
+        request(args.port, 'POST', '/api/globals', {'key': 'longpoll-bench', 'value': '1'})
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and not any(p.received for p in pollers):
+            time.sleep(0.01)
+        woke = time.perf_counter() - started
+        received = sum(1 for p in pollers if p.received)
+        busy = sum(p.busy for p in pollers)
+    finally:
+        stop.set()
+        proc.terminate()
+        proc.wait(10)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    print(f'スレッド: {args.threads} / ロングポーリング: {args.pollers}（待機枠が埋まっていて待たずに返った回数: {busy}）')
+    print(f'通常のリクエスト: p50 {p50 * 1000:.1f}ms / 最大 {latencies[-1] * 1000:.1f}ms')
+    print(f'書き込みから最初の通知まで: {woke * 1000:.1f}ms（受け取ったクライアント: {received}）')
+
+    problems = []
+    if latencies[-1] > MAX_LATENCY:
+        problems.append(f'ロングポーリング中の通常のリクエストが遅延しています（最大 {latencies[-1]:.2f}秒）')
+    if not received:
+        problems.append('待機中のロングポーリングが書き込みで起こされていません')
+    for problem in problems:
+        print(f'NG: {problem}')
+    if not problems:
+        print('OK')
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
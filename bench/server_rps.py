@@ -0,0 +1,132 @@
+"""
+サーバーモード別のスループット計測（requests/sec）
+data.dbのコピーを使ってサーバーを別プロセスで起動し、keep-alive接続の並列クライアントでAPIを叩く
+
+    python bench/server_rps.py                     # waitress と dev を比較
+    python bench/server_rps.py --clients 16 --duration 10 --path /api/groups
+"""
+import argparse
+import http.client
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+
+def serve(mode, port, db_path, threads):
+    """子プロセス側: DBのパスを指定してサーバーを起動する（ストレージ設定は環境変数で変更可能）"""
+    from backend.app import create_app
+    from backend.changes import begin_shutdown
+    from backend.server import make_server, max_long_poll_waiters
+
+    app = create_app({'DATABASE_PATH': db_path, 'CHANGES_MAX_WAITERS': max_long_poll_waiters(threads)})
+    server = make_server(app, '127.0.0.1', port, mode=mode, threads=threads)
+    print('ready', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        begin_shutdown()
+        server.shutdown()
+
+
+def wait_ready(proc, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        line = proc.stdout.readline()
+        if not line:
+            break
+        if line.strip() == 'ready':
+            return
+    raise RuntimeError('サーバーが起動しませんでした')
+
+
+def run_clients(port, path, clients, duration):
+    """各クライアントが1本のkeep-alive接続でリクエストを繰り返し、完了数とエラー数を返す"""
+    counts = [0] * clients
+    errors = [0] * clients
+    stop = time.monotonic() + duration
+
+    def worker(i):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while time.monotonic() < stop:
+            try:
+                conn.request('GET', path)
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status >= 400:
+                    errors[i] += 1
+                else:
+                    counts[i] += 1
+                if resp.will_close:
+                    conn.close()
+                    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            except (OSError, http.client.HTTPException):
+                errors[i] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        conn.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+    return sum(counts), sum(errors), elapsed
+
+
+def measure(mode, args, db_path):
+    cmd = [sys.executable, __file__, '--serve', mode, '--port', str(args.port),
+           '--db', db_path, '--threads', str(args.threads)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        wait_ready(proc)
+        # ウォームアップ（キャッシュ・接続プールの初期化）
+        run_clients(args.port, args.path, 2, 1)
+        ok, failed, elapsed = run_clients(args.port, args.path, args.clients, args.duration)
+    finally:
+        proc.terminate()
+        proc.wait(10)
+    return {'mode': mode, 'requests': ok, 'errors': failed, 'rps': ok / elapsed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='サーバーモード別のrequests/secを計測')
+    parser.add_argument('--modes', default='waitress,dev')
+    parser.add_argument('--path', default='/api/addresses')
+    parser.add_argument('--clients', type=int, default=8, help='同時接続数')
+    parser.add_argument('--duration', type=float, default=5.0, help='計測秒数')
+    parser.add_argument('--threads', type=int, default=8, help='waitressのワーカースレッド数')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--source-db', default=os.path.join(ROOT, 'data.db'))
+    # 子プロセス用
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve, args.port, args.db, args.threads)
+        return 0
+
+    workdir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(workdir, 'data.db')
+        shutil.copy(args.source_db, db_path)
+        print(f'GET {args.path}  clients={args.clients}  duration={args.duration}s')
+        for mode in args.modes.split(','):
+            r = measure(mode.strip(), args, db_path)
+            print(f"  {r['mode']:<9} {r['rps']:8.1f} req/s  ({r['requests']} requests, {r['errors']} errors)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
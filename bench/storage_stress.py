@@ -0,0 +1,168 @@
+"""
+SQLiteストレージ設定の並行読み書きストレステスト
+data.dbのコピーでwaitressを起動し、読み取りクライアントと書き込みクライアントを同時に実行して
+エラー数（"database is locked" による500など）とレイテンシを比較する
+
+    python bench/storage_stress.py                         # 既定設定（WAL）と従来設定（DELETE/FULL）を比較
+    python bench/storage_stress.py --readers 16 --writers 8 --duration 15
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from server_rps import ROOT, wait_ready  # noqa: E402
+
+# 比較する設定（環境変数で子プロセスのサーバーに渡す）
+PROFILES = {
+    'tuned': {},
+    'legacy': {
+        'OUTLOOK_TOOL_SQLITE_JOURNAL_MODE': 'DELETE',
+        'OUTLOOK_TOOL_SQLITE_SYNCHRONOUS': 'FULL',
+        'OUTLOOK_TOOL_SQLITE_CACHE_SIZE_KB': '2000',
+        'OUTLOOK_TOOL_SQLITE_MMAP_SIZE': '0',
+        'OUTLOOK_TOOL_SQLITE_TEMP_STORE': 'DEFAULT',
+    },
+}
+
+READ_PATHS = ('/api/addresses', '/api/groups', '/api/templates', '/api/bootstrap', '/api/addresses?limit=50')
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Client:
+    def __init__(self, port):
+        self.port = port
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+
+    def request(self, method, path, body=None):
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        data = json.dumps(body) if body is not None else None
+        try:
+            self.conn.request(method, path, data, headers)
+            resp = self.conn.getresponse()
+            payload = resp.read()
+            if resp.will_close:
+                self.reconnect()
+            return resp.status, payload
+        except (OSError, http.client.HTTPException):
+            self.reconnect()
+            return 0, b''
+
+    def reconnect(self):
+        self.conn.close()
+        self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+
+
+def reader(port, stop, stats):
+    client = Client(port)
+    while time.monotonic() < stop:
+        started = time.monotonic()
+        status, _ = client.request('GET', random.choice(READ_PATHS))
+        stats.append(('read', status, time.monotonic() - started))
+
+
+def writer(port, stop, stats, n):
+    client = Client(port)
+    _, body = client.request('GET', '/api/groups')
+    group_ids = [g['id'] for g in json.loads(body or b'[]')]
+    created = []
+    i = 0
+    while time.monotonic() < stop:
+        i += 1
+        started = time.monotonic()
+        op = i % 3
+        if op == 0 or not created:
+            status, body = client.request('POST', '/api/addresses', {
+                'name': f'負荷試験{n}-{i}', 'email': f'stress{n}.{i}@example.com',
+                'organization': '負荷試験', 'department': str(n)})
+            if status == 201:
+                created.append(json.loads(body)['id'])
+        elif op == 1 and group_ids:
+            gid = random.choice(group_ids)
+            status, _ = client.request('PUT', f'/api/groups/{gid}', {
+                'group_name': f'負荷試験グループ{n}-{i}',
+                'memberIds': [{'id': a, 'recipientType': 'to', 'order': k} for k, a in enumerate(created[-5:])],
+                'customAttributes': []})
+        else:
+            status, _ = client.request('DELETE', f'/api/addresses/{created.pop(0)}')
+        stats.append(('write', status, time.monotonic() - started))
+
+
+def run_profile(name, args, source_db):
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, 'data.db')
+    shutil.copy(source_db, db_path)
+    env = dict(os.environ, **PROFILES[name])
+    cmd = [sys.executable, os.path.join(ROOT, 'bench', 'server_rps.py'), '--serve', 'waitress',
+           '--port', str(args.port), '--db', db_path, '--threads', str(args.threads)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, env=env)
+    try:
+        wait_ready(proc)
+        stats = []
+        stop = time.monotonic() + args.duration
+        threads = [threading.Thread(target=reader, args=(args.port, stop, stats)) for _ in range(args.readers)]
+        threads += [threading.Thread(target=writer, args=(args.port, stop, stats, n)) for n in range(args.writers)]
+        started = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - started
+    finally:
+        proc.terminate()
+        proc.wait(10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {'profile': name}
+    for kind in ('read', 'write'):
+        rows = [s for s in stats if s[0] == kind]
+        ok = [s[2] for s in rows if 200 <= s[1] < 400]
+        result[kind] = {
+            'ok': len(ok),
+            'errors': len(rows) - len(ok),
+            'per_sec': len(ok) / elapsed,
+            'p50_ms': percentile(ok, 0.5) * 1000,
+            'p95_ms': percentile(ok, 0.95) * 1000,
+        }
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='並行読み書きのストレステスト')
+    parser.add_argument('--profiles', default='tuned,legacy')
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--threads', type=int, default=16, help='waitressのワーカースレッド数')
+    parser.add_argument('--port', type=int, default=5098)
+    parser.add_argument('--source-db', default=os.path.join(ROOT, 'data.db'))
+    args = parser.parse_args(argv)
+
+    print(f'readers={args.readers} writers={args.writers} duration={args.duration}s')
+    failed = False
+    for name in args.profiles.split(','):
+        r = run_profile(name.strip(), args, args.source_db)
+        for kind in ('read', 'write'):
+            k = r[kind]
+            print(f"  {r['profile']:<7} {kind:<5} {k['per_sec']:7.1f}/s  p50 {k['p50_ms']:6.1f}ms  "
+                  f"p95 {k['p95_ms']:6.1f}ms  errors {k['errors']}")
+            failed = failed or (name.strip() == 'tuned' and k['errors'] > 0)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
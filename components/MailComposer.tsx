@@ -1,10 +1,13 @@
 
 import React, { useState, useEffect, useRef } from 'react';
 import { Address, Group, EmailTemplate, RecipientType, GlobalVariable } from '../types';
-import { fetchAddresses, fetchGroups, fetchTemplates, fetchGlobals, resolveTextVariables } from '../services/mockApi';
+import { fetchBootstrap, resolveTextVariables, downloadEml } from '../services/mockApi';
 import { Button } from './ui/Button';
 import { IconAdd, IconClose, IconRocket, IconChevronDown, IconDocumentText, IconPeople, IconCheck, IconArrowUp, IconArrowDown } from './ui/Icons';
 
+// mailto: URLとして安全に渡せる長さ（Outlook / ブラウザの制限を考慮）
+const MAILTO_MAX_LENGTH = 2000;
+
 export const MailComposer: React.FC = () => {
   const [addresses, setAddresses] = useState<Address[]>([]);
   const [groups, setGroups] = useState<Group[]>([]);
@@ -33,8 +36,9 @@ export const MailComposer: React.FC = () => {
   const [activeGroupContext, setActiveGroupContext] = useState<Group | undefined>(undefined);
 
   useEffect(() => {
-    Promise.all([fetchAddresses(), fetchGroups(), fetchTemplates(), fetchGlobals()]).then(([a, g, t, glb]) => {
-      setAddresses(a); setGroups(g); setTemplates(t); setGlobals(glb);
+    fetchBootstrap().then(data => {
+      setAddresses(data.addresses || []); setGroups(data.groups || []);
+      setTemplates(data.templates || []); setGlobals(data.globals || []);
     });
   }, []);
 
@@ -164,6 +168,14 @@ export const MailComposer: React.FC = () => {
     let link = `mailto:${to}?subject=${encodeURIComponent(resolvedSubject)}&body=${encodeURIComponent(resolvedBody)}`;
     if (cc) link += `&cc=${cc}`;
     if (bcc) link += `&bcc=${bcc}`;
+
+    // 長いURLはメールクライアント側で切り捨てられるため、.emlファイルとしてダウンロードする
+    if (link.length > MAILTO_MAX_LENGTH) {
+      const pick = (type: RecipientType) => recipients.filter(r => r.type === type).map(r => ({ name: r.name, email: r.email }));
+      downloadEml({ subject: resolvedSubject, body: resolvedBody, to: pick('TO'), cc: pick('CC'), bcc: pick('BCC') })
+        .catch(err => alert(`.emlの作成に失敗しました: ${err.message}`));
+      return;
+    }
     window.location.href = link;
   };
 
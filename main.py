@@ -2,13 +2,18 @@
 Outlook Mail Tool - EXE Entry Point
 起動時にFlaskサーバーを開始し、ブラウザを自動起動
 """
+import argparse
 import os
 import sys
-import webbrowser
 import threading
 import time
-import socket
-from backend.app import create_app
+
+# 起動時間の計測の基準（--profile-startup）
+STARTED_AT = time.perf_counter()
+
+# Flask・SQLAlchemyは重いため、ここではimportしない（ポートを開いてブラウザを起動した後で読み込む）
+from backend.server import (make_server, DeferredApp, SERVER_MODES, DEFAULT_MODE, DEFAULT_THREADS,
+                            DEFAULT_CONNECTION_LIMIT, DEFAULT_CHANNEL_TIMEOUT, max_long_poll_waiters)
 
 def resource_path(relative_path):
     """PyInstallerでバンドルされたリソースのパスを取得"""
@@ -20,68 +25,142 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
-def check_server_ready(host, port, timeout=10):
-    """サーバーが起動するまで待機"""
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(1)
-            result = sock.connect_ex((host, port))
-            sock.close()
-            if result == 0:
-                return True
-        except:
-            pass
-        time.sleep(0.5)
-    return False
-
-def open_browser(url, host, port):
-    """サーバー起動を待ってブラウザを開く"""
-    print(f"サーバーの起動を待っています...")
-    if check_server_ready(host, port):
+def open_browser(url, server, timeout=10):
+    """サーバースレッドの準備完了の通知を待ってブラウザを開く（ポートへの接続確認は行わない）"""
+    if server.ready.wait(timeout):
+        import webbrowser
         print(f"ブラウザを起動します: {url}")
         webbrowser.open(url)
     else:
         print(f"サーバーの起動に失敗しました。手動で {url} にアクセスしてください。")
 
-def run_server(app, host, port):
-    """Flaskサーバーを別スレッドで起動"""
-    app.run(host=host, port=port, debug=False, use_reloader=False, threaded=True)
+class StartupProfile:
+    """起動処理の段階ごとの所要時間（--profile-startup で表示）"""
+
+    def __init__(self):
+        self.phases = []
+        self.last = STARTED_AT
+
+    def mark(self, name, seconds=None):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last if seconds is None else seconds))
+        self.last = now
+
+    def report(self):
+        print(f"")
+        print(f"起動時間の内訳:")
+        for name, seconds in self.phases + [('合計（main.py開始から）', self.last - STARTED_AT)]:
+            print(f"  {_pad(name, 32)}{seconds * 1000:8.1f} ms")
+
+def _pad(text, width):
+    """全角文字を2桁として左寄せ"""
+    import unicodedata
+    used = sum(2 if unicodedata.east_asian_width(c) in 'WF' else 1 for c in text)
+    return text + ' ' * max(0, width - used)
+
+def first_request(host, port, path):
+    """起動直後の最初のリクエストにかかる時間を計測"""
+    import http.client
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+def parse_args(argv=None):
+    """起動オプション（環境変数 OUTLOOK_TOOL_SERVER / OUTLOOK_TOOL_THREADS でも指定可能）"""
+    parser = argparse.ArgumentParser(description='Outlook Mail Tool')
+    parser.add_argument('--server', choices=SERVER_MODES,
+                        default=os.environ.get('OUTLOOK_TOOL_SERVER', DEFAULT_MODE),
+                        help='waitress: 本番用マルチスレッドサーバー / dev: Flask開発サーバー')
+    parser.add_argument('--host', default='127.0.0.1', help='待ち受けアドレス（共有する場合は 0.0.0.0）')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--threads', type=int,
+                        default=int(os.environ.get('OUTLOOK_TOOL_THREADS', DEFAULT_THREADS)),
+                        help='ワーカースレッド数')
+    parser.add_argument('--connection-limit', type=int, default=DEFAULT_CONNECTION_LIMIT,
+                        help='同時接続数の上限')
+    parser.add_argument('--channel-timeout', type=int, default=DEFAULT_CHANNEL_TIMEOUT,
+                        help='keep-alive接続のアイドルタイムアウト（秒）')
+    parser.add_argument('--no-browser', action='store_true', help='ブラウザを自動起動しない')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='起動処理の段階ごとの所要時間を表示して終了する（ブラウザは起動しない）')
+    return parser.parse_args(argv)
 
 def main():
+    args = parse_args()
+    profile = StartupProfile() if args.profile_startup else None
+    server = None
+    app = None
     try:
         print(f"==============================================")
         print(f"  Outlook Mail Tool v2.0.0")
         print(f"==============================================")
         print(f"")
         
-        # データベースの保存場所を表示
-        if getattr(sys, 'frozen', False):
-            db_path = os.path.join(os.path.dirname(sys.executable), 'data.db')
+        port = args.port
+        host = args.host
+        browse_host = '127.0.0.1' if host in ('0.0.0.0', '::') else host
+        url = f'http://{browse_host}:{port}'
+        
+        # 先にポートを開いてサーバーを起動する（アプリの準備ができるまでリクエストは待機させる）
+        print(f"サーバーを起動しています...")
+        deferred = DeferredApp()
+        server = make_server(deferred, host, port, mode=args.server, threads=args.threads,
+                             connection_limit=args.connection_limit,
+                             channel_timeout=args.channel_timeout)
+        if server.mode == 'waitress':
+            print(f"サーバー: waitress（スレッド数: {server.threads}）")
         else:
-            db_path = os.path.join(os.path.abspath('.'), 'data.db')
-        print(f"データベース: {db_path}")
-        print(f"")
+            print(f"サーバー: Flask開発サーバー")
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        server.ready.wait()
+        if profile:
+            profile.mark('サーバー起動')
+        
+        # ブラウザの起動とアプリの初期化を並行して行う
+        if not args.no_browser and not profile:
+            browser_thread = threading.Thread(target=open_browser, args=(url, server), daemon=True)
+            browser_thread.start()
         
-        # Flaskアプリを作成
         print(f"アプリケーションを初期化しています...")
-        app = create_app()
+        try:
+            from backend.app import create_app
+            if profile:
+                profile.mark('import（Flask / SQLAlchemy）')
+            config = {}
+            if 'OUTLOOK_TOOL_CHANGES_MAX_WAITERS' not in os.environ:
+                # ロングポーリングで待たせるのはワーカースレッドの半分まで
+                config['CHANGES_MAX_WAITERS'] = max_long_poll_waiters(args.threads)
+            app = create_app(config)
+        except Exception as e:
+            deferred.set_error(e)
+            raise
+        deferred.set_app(app)
+        if profile:
+            db_open = app.extensions['startup_timings']['db_open']
+            profile.mark('アプリ作成', time.perf_counter() - profile.last - db_open)
+            profile.mark('DBオープン・マイグレーション', db_open)
         print(f"初期化完了")
         
-        port = 5000
-        host = '127.0.0.1'
-        url = f'http://{host}:{port}'
-        
-        print(f"サーバーを起動しています...")
-        
-        # Flaskサーバーを別スレッドで起動
-        server_thread = threading.Thread(target=run_server, args=(app, host, port), daemon=True)
-        server_thread.start()
+        # データベースの保存場所を表示（環境変数 OUTLOOK_TOOL_DB で変更可能）
+        print(f"データベース: {app.config['DATABASE_PATH']}（{app.config['SQLITE_JOURNAL_MODE']}）")
+        if app.config['DISPATCH_ENABLED']:
+            print(f"送信キュー: 有効（SMTP: {app.config['SMTP_HOST']}:{app.config['SMTP_PORT']}、"
+                  f"ワーカー数: {app.config['DISPATCH_WORKERS']}）")
         
-        # ブラウザを別スレッドで起動
-        browser_thread = threading.Thread(target=open_browser, args=(url, host, port), daemon=True)
-        browser_thread.start()
+        if profile:
+            first_request(browse_host, port, '/')
+            profile.mark('最初のリクエスト（/）')
+            first_request(browse_host, port, '/api/bootstrap')
+            profile.mark('最初のAPI（/api/bootstrap）')
+            profile.report()
+            server.shutdown()
+            return
         
         print(f"")
         print(f"アプリケーションが起動しました")
@@ -96,6 +175,16 @@ def main():
             
     except KeyboardInterrupt:
         print(f"\nアプリケーションを終了しています...")
+        if app is not None:
+            # 待機中のロングポーリング（/api/changes?wait=）を先に返させる
+            from backend.changes import begin_shutdown
+            begin_shutdown()
+        if server is not None:
+            # 処理中のリクエストを待ってから停止
+            server.shutdown()
+        if app is not None:
+            # 送信中のメッセージを送り終えてから送信ワーカーを停止
+            app.extensions['dispatcher'].stop()
     except Exception as e:
         print(f"\n!!! エラーが発生しました !!!")
         print(f"エラー内容: {e}")
@@ -17,11 +17,13 @@ a = Analysis(
         'sqlalchemy',
         'sqlalchemy.ext.declarative',
         'sqlalchemy.orm',
+        'waitress',
     ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # 使用しない大きな標準モジュールは同梱しない（onefileの展開時間を短くする）
+    excludes=['tkinter', 'test', 'pydoc_data'],
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
@@ -41,7 +43,8 @@ exe = EXE(
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    # UPX圧縮したDLLは起動のたびに展開が必要になり、ウイルス対策ソフトの検査も遅くなるため無効にする
+    upx=False,
     upx_exclude=[],
     runtime_tmpdir=None,
     console=True,  # コンソール表示（エラー確認用）
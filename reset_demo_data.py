@@ -5,7 +5,11 @@ import sys
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from backend.app import create_app
-from backend.models import db, Address, Group, EmailTemplate, GlobalVariable, AttributeDefinition
+from backend.models import db, Address, Group, EmailTemplate, GlobalVariable, AttributeDefinition, normalize_email
+from backend.membership import set_group_members, set_template_recipients
+from backend.variables import index_group, index_template
+from backend.changes import record_changes
+from backend.migrations import reset_database
 
 app = create_app()
 
@@ -112,24 +116,27 @@ DEMO_ATTR_DEFS = [
 ]
 
 with app.app_context():
-    # データベースをリセット
-    db.drop_all()
-    db.create_all()
+    # データベースをリセット（全文検索索引を含めて作り直す）
+    reset_database()
     
     # Addresses
     for a in DEMO_ADDRESSES:
-        addr = Address(id=a['id'], name=a['name'], email=a['email'], organization=a.get('organization'), department=a.get('department'))
+        addr = Address(id=a['id'], name=a['name'], email=a['email'], email_normalized=normalize_email(a['email']), organization=a.get('organization'), department=a.get('department'))
         db.session.add(addr)
 
     # Groups
     for g in DEMO_GROUPS:
-        grp = Group(id=g['id'], group_name=g['group_name'], member_ids=g.get('memberIds', []), custom_attributes=g.get('customAttributes', []))
+        grp = Group(id=g['id'], group_name=g['group_name'], custom_attributes=g.get('customAttributes', []))
+        set_group_members(grp, g.get('memberIds', []))
         db.session.add(grp)
+        index_group(grp)
 
     # Templates
     for t in DEMO_TEMPLATES:
-        tpl = EmailTemplate(id=t['id'], title=t.get('title'), subject=t.get('subject'), body=t.get('body'), default_recipients=t.get('defaultRecipients', []))
+        tpl = EmailTemplate(id=t['id'], title=t.get('title'), subject=t.get('subject'), body=t.get('body'))
+        set_template_recipients(tpl, t.get('defaultRecipients', []))
         db.session.add(tpl)
+        index_template(tpl)
 
     # Globals
     for g in DEMO_GLOBALS:
@@ -141,6 +148,11 @@ with app.app_context():
         ad = AttributeDefinition(id=a['id'], key=a['key'], label=a.get('label'))
         db.session.add(ad)
 
+    # 起動中のサーバーの一覧のキャッシュ・差分同期にも反映されるよう変更ログに記録する
+    for collection, items in (('addresses', DEMO_ADDRESSES), ('groups', DEMO_GROUPS), ('templates', DEMO_TEMPLATES),
+                              ('globals', DEMO_GLOBALS), ('attrdefs', DEMO_ATTR_DEFS)):
+        record_changes(collection, [item['id'] for item in items])
+
     db.session.commit()
     print("✓ デモデータを登録しました！")
     print(f"  - アドレス: {len(DEMO_ADDRESSES)}件")
@@ -1,5 +1,5 @@
 
-import { Address, Group, EmailTemplate, GlobalVariable, AttributeDefinition } from '../types';
+import { Address, Group, GroupMember, EmailTemplate, GlobalVariable, AttributeDefinition, RecipientType } from '../types';
 
 // ============================================================================
 // CONFIGURATION
@@ -15,6 +15,15 @@ const httpGet = async (path: string) => {
   return r.json();
 };
 
+// カーソルページング: 本文は配列、次ページのカーソルは X-Next-Cursor ヘッダー
+const httpGetPage = async <T>(path: string, params: Record<string, string | number | undefined>): Promise<Page<T>> => {
+  const qs = new URLSearchParams();
+  Object.entries(params).forEach(([k, v]) => { if (v !== undefined && v !== '') qs.set(k, String(v)); });
+  const r = await fetch(`${API_BASE}${path}?${qs.toString()}`);
+  if (!r.ok) throw new Error(`HTTP ${r.status} ${r.statusText}`);
+  return { items: await r.json(), nextCursor: r.headers.get('X-Next-Cursor') };
+};
+
 const httpPost = async (path: string, body: any) => {
   const r = await fetch(`${API_BASE}${path}`, {
     method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(body)
@@ -37,13 +46,50 @@ const httpDelete = async (path: string) => {
   return r.json().catch(() => ({}));
 };
 
+export interface Page<T> {
+  items: T[];
+  nextCursor: string | null;
+}
+
+export interface ListQuery {
+  limit?: number;
+  cursor?: string;
+  q?: string;
+  match?: 'prefix' | 'substring';
+}
+
+export interface AddressQuery extends ListQuery {
+  organization?: string;
+  department?: string;
+}
+
+export interface BulkImportResult {
+  accepted: number;
+  // accepted のうち、既存のアドレス（同じメールアドレス）を更新した件数
+  updated: number;
+  rejected: number;
+  results: { row: number; status: 'accepted' | 'rejected'; id?: string; updated?: boolean; reason?: string }[];
+}
+
+export interface DedupeResult {
+  clusters: number;
+  removed: number;
+  groups: number;
+  templates: number;
+  samples: { email: string; keep: string; remove: string[] }[];
+  dryRun: boolean;
+}
+
 // ============================================================================
 // API FUNCTIONS
 // ============================================================================
 
 // Addresses
 export const fetchAddresses = async (): Promise<Address[]> => httpGet('/addresses');
-export const saveAddress = async (item: Address): Promise<{ id: string }> => {
+export const fetchAddressPage = (query: AddressQuery): Promise<Page<Address>> =>
+  httpGetPage<Address>('/addresses', { ...query });
+// 新規作成で同じメールアドレスのアドレスが既にある場合は、そのアドレスを更新して existing: true を返す
+export const saveAddress = async (item: Address): Promise<{ id: string; existing?: boolean }> => {
   if (item.id) {
     await httpPut(`/addresses/${item.id}`, item);
     return { id: item.id };
@@ -51,11 +97,17 @@ export const saveAddress = async (item: Address): Promise<{ id: string }> => {
   return httpPost('/addresses', item);
 };
 export const deleteAddress = (id: string): Promise<any> => httpDelete(`/addresses/${id}`);
-export const bulkCreateAddresses = (items: Address[]): Promise<any[]> => 
-  Promise.all(items.map(i => httpPost('/addresses', i)));
+export const fetchAddressGroups = (id: string): Promise<{ id: string; group_name: string; recipientType: string; order: number }[]> =>
+  httpGet(`/addresses/${id}/groups`);
+export const bulkCreateAddresses = (items: Address[]): Promise<BulkImportResult> =>
+  httpPost('/addresses/bulk', items);
+export const dedupeAddresses = (dryRun = false): Promise<DedupeResult> =>
+  httpPost(`/addresses/dedupe${dryRun ? '?dryRun=1' : ''}`, {});
 
 // Groups
 export const fetchGroups = async (): Promise<Group[]> => httpGet('/groups');
+export const fetchGroupPage = (query: ListQuery): Promise<Page<Group>> =>
+  httpGetPage<Group>('/groups', { ...query });
 export const saveGroup = async (item: Group): Promise<{ id: string }> => {
   if (item.id) {
     await httpPut(`/groups/${item.id}`, item);
@@ -65,8 +117,35 @@ export const saveGroup = async (item: Group): Promise<{ id: string }> => {
 };
 export const deleteGroup = (id: string): Promise<any> => httpDelete(`/groups/${id}`);
 
+// メンバーの部分更新: 追加・削除・宛先種別の変更・並べ替えだけを送る
+// version を指定すると、他の更新が先に行われていた場合は HTTP 409 になる（グループを再取得してやり直す）
+export type GroupMemberOperation =
+  | { op: 'add'; id: string; recipientType?: GroupMember['recipientType']; order?: number }
+  | { op: 'remove'; id: string }
+  | { op: 'setType'; id: string; recipientType: GroupMember['recipientType'] }
+  | { op: 'move'; id: string; order: number };
+export interface GroupMemberPatchResult {
+  version: number;
+  added: number;
+  removed: number;
+  updated: number;
+  moved: number;
+  unchanged: number;
+}
+export const patchGroupMembers = async (
+  id: string, operations: GroupMemberOperation[], version?: number
+): Promise<GroupMemberPatchResult> => {
+  const r = await fetch(`${API_BASE}/groups/${id}/members`, {
+    method: 'PATCH', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ version, operations })
+  });
+  if (!r.ok) throw new Error(`HTTP ${r.status} ${r.statusText}`);
+  return r.json();
+};
+
 // Templates
 export const fetchTemplates = async (): Promise<EmailTemplate[]> => httpGet('/templates');
+export const fetchTemplatePage = (query: ListQuery): Promise<Page<EmailTemplate>> =>
+  httpGetPage<EmailTemplate>('/templates', { ...query });
 export const saveTemplate = async (item: EmailTemplate): Promise<{ id: string }> => {
   if (item.id) {
     await httpPut(`/templates/${item.id}`, item);
@@ -78,7 +157,7 @@ export const deleteTemplate = (id: string): Promise<any> => httpDelete(`/templat
 
 // Globals
 export const fetchGlobals = async (): Promise<GlobalVariable[]> => httpGet('/globals');
-export const saveGlobal = async (item: GlobalVariable): Promise<{ id: string }> => {
+export const saveGlobal = async (item: GlobalVariable & { renameUsages?: boolean }): Promise<{ id: string }> => {
   if (item.id) {
     await httpPut(`/globals/${item.id}`, item);
     return { id: item.id };
@@ -89,7 +168,7 @@ export const deleteGlobal = (id: string): Promise<any> => httpDelete(`/globals/$
 
 // Attribute Definitions
 export const fetchAttrDefs = async (): Promise<AttributeDefinition[]> => httpGet('/attrdefs');
-export const saveAttrDef = async (item: AttributeDefinition): Promise<{ id: string }> => {
+export const saveAttrDef = async (item: AttributeDefinition & { renameUsages?: boolean }): Promise<{ id: string }> => {
   if (item.id) {
     await httpPut(`/attrdefs/${item.id}`, item);
     return { id: item.id };
@@ -98,6 +177,246 @@ export const saveAttrDef = async (item: AttributeDefinition): Promise<{ id: stri
 };
 export const deleteAttrDef = (id: string): Promise<any> => httpDelete(`/attrdefs/${id}`);
 
+// Variables: 変数のキーを使っているテンプレート・グループ（保存時に更新される索引から取得）
+export interface VariableUsages {
+  key: string;
+  global: GlobalVariable | null;
+  attrdef: AttributeDefinition | null;
+  templates: { id: string; title: string }[];
+  groups: { id: string; group_name: string }[];
+}
+export const fetchVariableUsages = (key: string): Promise<VariableUsages> =>
+  httpGet(`/variables/${encodeURIComponent(key)}/usages`);
+// キーの変更: 同じキーのグローバル変数・属性定義と、使っているテンプレートの {キー}・グループの属性を1回で書き換える
+// （saveGlobal / saveAttrDef で renameUsages: true を指定しても同じ）
+export const renameVariable = (key: string, to: string):
+  Promise<{ key: string; globals: string[]; attrdefs: string[]; templates: string[]; groups: string[] }> =>
+  httpPost(`/variables/${encodeURIComponent(key)}/rename`, { to });
+
+// Recipients: グループ・テンプレートの既定宛先・個別のアドレスをサーバー側でアドレス帳と結合し、
+// メールアドレスで重複を除いたTO/CC/BCCを返す（同じ人が複数の種別にある場合は TO > CC > BCC）
+export interface ResolvedRecipient {
+  id: string;
+  name: string;
+  email: string;
+  organization?: string;
+  department?: string;
+}
+export interface ResolvedRecipients {
+  to: ResolvedRecipient[];
+  cc: ResolvedRecipient[];
+  bcc: ResolvedRecipient[];
+  total: number;
+  duplicates: number;
+  notFound: { groups: string[]; templates: string[]; addresses: string[] };
+}
+export const resolveRecipients = (params: {
+  groupIds?: string[];
+  templateIds?: string[];
+  addressIds?: (string | { id: string; type: RecipientType })[];
+  type?: RecipientType; // addressIdsを文字列で指定した場合の種別（既定: TO）
+}): Promise<ResolvedRecipients> => httpPost('/recipients/resolve', params);
+
+// Batch: 複数コレクションの作成・更新・削除を1回のリクエスト・1トランザクションで実行
+// 1件でも失敗した場合は全体が取り消され、committed: false と失敗した操作の番号（index）が返る
+export type BatchCollection = 'addresses' | 'groups' | 'templates' | 'globals' | 'attrdefs';
+export interface BatchOperation {
+  op: 'create' | 'update' | 'delete';
+  collection: BatchCollection;
+  id?: string;
+  data?: Record<string, any>;
+}
+export interface BatchResult {
+  committed: boolean;
+  // existing: 作成の操作で同じメールアドレスの既存アドレスを更新した（status は 200）
+  results: { op: BatchOperation['op']; collection: BatchCollection; id: string; status: number; existing?: boolean }[];
+  error?: string;
+  index?: number;
+  status?: number;
+}
+export const runBatch = async (operations: BatchOperation[]): Promise<BatchResult> => {
+  const r = await fetch(`${API_BASE}/batch`, {
+    method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ operations })
+  });
+  const result = await r.json().catch(() => null);
+  if (!result) throw new Error(`HTTP ${r.status} ${r.statusText}`);
+  return result.committed === undefined ? { committed: false, results: [], ...result } : result;
+};
+
+// Bootstrap: 全コレクションを1回のリクエストで取得
+export interface BootstrapData {
+  versions: Record<string, string>;
+  changeSeq: number;
+  addresses?: Address[];
+  groups?: Group[];
+  templates?: EmailTemplate[];
+  globals?: GlobalVariable[];
+  attrdefs?: AttributeDefinition[];
+}
+export const fetchBootstrap = (known?: Record<string, string>): Promise<BootstrapData> => {
+  const param = known ? Object.entries(known).map(([k, v]) => `${k}:${v}`).join(',') : '';
+  return httpGet(param ? `/bootstrap?known=${encodeURIComponent(param)}` : '/bootstrap');
+};
+
+// Changes: since以降の差分（waitを指定するとロングポーリング）
+// サーバーの待機枠が埋まっている場合は待たずに返り、retryAfter（秒）をあけてから次の取得をする
+export interface ChangeEntry {
+  seq: number;
+  collection: 'addresses' | 'groups' | 'templates' | 'globals' | 'attrdefs';
+  id: string;
+  op: 'upsert' | 'delete';
+  data: any | null;
+}
+export const fetchChanges = (since: number, wait = 0):
+  Promise<{ changes: ChangeEntry[]; lastSeq: number; hasMore: boolean; reset?: boolean; retryAfter?: number }> =>
+  httpGet(`/changes?since=${since}${wait ? `&wait=${wait}` : ''}`);
+
+// Render: サーバー側で変数を置換
+export interface RenderResult {
+  subject: string;
+  body: string;
+  missing: string[];
+}
+export const renderMessage = (params: {
+  templateId?: string; subject?: string; body?: string; groupId?: string; values?: Record<string, string>;
+}): Promise<RenderResult> => httpPost('/render', params);
+
+// Mail merge (NDJSON: 1行ごとにグループ1件分の結果、最後に集計行)
+export interface MergedMessage extends RenderResult {
+  type: 'message';
+  groupId: string;
+  groupName: string;
+  to: { id: string; name: string; email: string }[];
+  cc: { id: string; name: string; email: string }[];
+  bcc: { id: string; name: string; email: string }[];
+}
+export type MailMergeLine =
+  | MergedMessage
+  | { type: 'error'; groupId: string; error: string }
+  | { type: 'summary'; messages: number; errors: number };
+
+export const mailMerge = async (
+  params: { templateId: string; groupIds?: string[]; all?: boolean; workers?: number },
+  onLine: (line: MailMergeLine) => void
+): Promise<void> => {
+  const r = await fetch(`${API_BASE}/mailmerge`, {
+    method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(params)
+  });
+  if (!r.ok || !r.body) throw new Error(`HTTP ${r.status} ${r.statusText}`);
+  const reader = r.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    buffer += decoder.decode(value, { stream: !done });
+    let nl: number;
+    while ((nl = buffer.indexOf('\n')) >= 0) {
+      const line = buffer.slice(0, nl).trim();
+      buffer = buffer.slice(nl + 1);
+      if (line) onLine(JSON.parse(line));
+    }
+    if (done) break;
+  }
+};
+
+// .eml export: mailto: URLの長さ制限を超える場合は.emlファイル（複数グループはZIP）でダウンロード
+export interface EmlMessage {
+  subject: string;
+  body: string;
+  to: { name?: string; email: string }[];
+  cc?: { name?: string; email: string }[];
+  bcc?: { name?: string; email: string }[];
+}
+
+const httpPostDownload = async (path: string, body: any, filename: string): Promise<void> => {
+  const r = await fetch(`${API_BASE}${path}`, {
+    method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(body)
+  });
+  if (!r.ok) throw new Error(`HTTP ${r.status} ${r.statusText}`);
+  const url = URL.createObjectURL(await r.blob());
+  const a = document.createElement('a');
+  a.href = url;
+  a.download = filename;
+  a.click();
+  setTimeout(() => URL.revokeObjectURL(url), 0);
+};
+
+export const downloadEml = (message: EmlMessage, filename = 'message.eml') =>
+  httpPostDownload('/eml', message, filename);
+
+export const downloadEmlZip = (
+  params: { templateId: string; groupIds?: string[]; all?: boolean } | { messages: EmlMessage[] },
+  filename = 'messages.zip'
+) => httpPostDownload('/eml/zip', params, filename);
+
+// アドレス帳のエクスポート: サーバーが少しずつ書き出すので、Blobにせずリンクから直接ダウンロードする
+export type AddressExportFormat = 'csv' | 'vcf' | 'jsonl';
+export const addressExportUrl = (
+  format: AddressExportFormat,
+  filters: { organization?: string; department?: string; groupId?: string; bom?: boolean } = {}
+): string => {
+  const qs = new URLSearchParams({ format });
+  if (filters.organization) qs.set('organization', filters.organization);
+  if (filters.department) qs.set('department', filters.department);
+  if (filters.groupId) qs.set('groupId', filters.groupId);
+  if (filters.bom === false) qs.set('bom', '0');
+  return `${API_BASE}/addresses/export?${qs.toString()}`;
+};
+export const downloadAddressExport = (
+  format: AddressExportFormat,
+  filters: { organization?: string; department?: string; groupId?: string; bom?: boolean } = {}
+) => {
+  const a = document.createElement('a');
+  a.href = addressExportUrl(format, filters);
+  a.download = `addresses.${format}`;
+  a.click();
+};
+
+// Dispatch: SMTPで送信（サーバーで OUTLOOK_TOOL_DISPATCH_ENABLED=1 の場合のみ。無効な場合は503）
+export type DispatchStatus = 'queued' | 'sending' | 'sent' | 'failed' | 'cancelled';
+export interface DispatchJob {
+  id: number;
+  batchId: string;
+  status: DispatchStatus;
+  to: { name: string; email: string }[];
+  cc: { name: string; email: string }[];
+  bcc: { name: string; email: string }[];
+  subject: string;
+  body?: string; // fetchDispatchJob のみ
+  groupId: string | null;
+  attempts: number;
+  lastError: string | null;
+  messageId: string | null;
+  createdAt: string;
+  nextAttemptAt: string | null;
+  sentAt: string | null;
+}
+export const queueDispatch = (
+  params: ({ templateId: string; groupIds?: string[]; all?: boolean } | { messages: EmlMessage[] }) & { from?: string }
+): Promise<{ batchId: string; queued: number; skipped: number[]; notFound: string[] }> =>
+  httpPost('/dispatch', params);
+export const fetchDispatchStatus = (batchId?: string):
+  Promise<{ enabled: boolean; workers: number; counts: Record<DispatchStatus, number> }> =>
+  httpGet(batchId ? `/dispatch/status?batchId=${encodeURIComponent(batchId)}` : '/dispatch/status');
+export const fetchDispatchJobs = (query: { status?: DispatchStatus; batchId?: string; limit?: number; cursor?: string } = {}) =>
+  httpGetPage<DispatchJob>('/dispatch/jobs', query);
+export const fetchDispatchJob = (id: number): Promise<DispatchJob> => httpGet(`/dispatch/jobs/${id}`);
+export const retryDispatchJob = (id: number): Promise<DispatchJob> => httpPost(`/dispatch/jobs/${id}/retry`, {});
+export const cancelDispatchJob = (id: number): Promise<DispatchJob> => httpPost(`/dispatch/jobs/${id}/cancel`, {});
+
+// Search
+export interface SearchResult {
+  type: 'address' | 'template';
+  score: number;
+  item: Partial<Address> & Partial<EmailTemplate> & { id: string };
+}
+export const searchAll = (q: string, type?: 'address' | 'template', limit = 20, offset = 0):
+  Promise<{ results: SearchResult[]; nextOffset: number | null }> => {
+  const qs = new URLSearchParams({ q, limit: String(limit), offset: String(offset) });
+  if (type) qs.set('type', type);
+  return httpGet(`/search?${qs.toString()}`);
+};
+
 // ============================================================================
 // VARIABLE RESOLVER
 // ============================================================================
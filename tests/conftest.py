@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backend.app import create_app  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """空のデータベース（一時ディレクトリ）で作成したアプリ"""
+    return create_app({'DATABASE_PATH': str(tmp_path / 'data.db')})
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
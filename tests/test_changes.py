@@ -0,0 +1,51 @@
+import http.client
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+from backend import changes
+from backend.server import make_server
+
+
+@pytest.fixture
+def server(app):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    server = make_server(app, '127.0.0.1', port, mode='waitress', threads=4)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.ready.wait()
+    server.port = port
+    yield server
+    changes.shutting_down.clear()
+
+
+def test_shutdown_returns_pending_long_poll(client, server):
+    since = client.get('/api/changes').json['lastSeq']
+    response = {}
+
+    def poll():
+        conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=30)
+        conn.request('GET', f'/api/changes?since={since}&wait=20')
+        r = conn.getresponse()
+        response.update(status=r.status, body=json.loads(r.read()))
+        conn.close()
+
+    poller = threading.Thread(target=poll)
+    poller.start()
+    time.sleep(0.5)
+
+    started = time.monotonic()
+    changes.begin_shutdown()
+    server.shutdown()
+    elapsed = time.monotonic() - started
+    poller.join(5)
+
+    assert elapsed < 2
+    assert response['status'] == 200
+    assert response['body']['changes'] == []
+    assert response['body']['lastSeq'] == since
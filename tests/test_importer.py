@@ -0,0 +1,65 @@
+from backend.models import db, Address
+
+
+def addresses(app):
+    with app.app_context():
+        return {a.id: a.email for a in db.session.query(Address)}
+
+
+def test_existing_id_is_rejected(app, client):
+    r = client.post('/api/addresses', json={'id': 'addr-1', 'name': '山田', 'email': 'yamada@example.com'})
+    assert r.status_code == 201
+
+    r = client.post('/api/addresses/bulk', json=[
+        {'id': 'addr-1', 'name': '佐藤', 'email': 'sato@example.com'},
+        {'name': '鈴木', 'email': 'suzuki@example.com'},
+    ])
+    assert r.status_code == 201
+    summary = r.json
+    assert summary['accepted'] == 1
+    assert summary['rejected'] == 1
+    assert summary['results'][0] == {'row': 1, 'status': 'rejected', 'reason': 'duplicate_id'}
+    assert summary['results'][1]['status'] == 'accepted'
+    assert addresses(app)['addr-1'] == 'yamada@example.com'
+    assert 'sato@example.com' not in addresses(app).values()
+
+
+def test_id_repeated_in_payload_is_rejected(app, client):
+    r = client.post('/api/addresses/bulk', json=[
+        {'id': 'new-1', 'name': '山田', 'email': 'yamada@example.com'},
+        {'id': 'new-1', 'name': '佐藤', 'email': 'sato@example.com'},
+    ])
+    assert r.status_code == 201
+    assert [x['status'] for x in r.json['results']] == ['accepted', 'rejected']
+    assert r.json['results'][1]['reason'] == 'duplicate_id'
+    assert addresses(app) == {'new-1': 'yamada@example.com'}
+
+
+def test_id_repeated_across_batches_is_rejected(app):
+    from backend.importer import import_records, iter_json_records
+
+    items = [{'id': 'new-1', 'name': '山田', 'email': 'yamada@example.com'},
+             {'name': '鈴木', 'email': 'suzuki@example.com'},
+             {'id': 'new-1', 'name': '佐藤', 'email': 'sato@example.com'}]
+    with app.app_context():
+        summary = import_records(iter_json_records(items), batch_size=2)
+    assert (summary['accepted'], summary['rejected']) == (2, 1)
+    assert summary['results'][2]['reason'] == 'duplicate_id'
+
+
+def test_new_email_with_taken_id_does_not_fail_dedup(app, client):
+    client.post('/api/addresses', json={'id': 'addr-1', 'name': '山田', 'email': 'yamada@example.com'})
+
+    r = client.post('/api/addresses/bulk', json=[
+        # 同じメールアドレス: 指定したIDに関係なく既存のアドレスを更新する
+        {'id': 'other', 'name': '山田 太郎', 'email': ' YAMADA@example.com'},
+        # 新しいメールアドレスだがIDが既存のアドレスと重なる
+        {'id': 'addr-1', 'name': '佐藤', 'email': 'sato@example.com'},
+    ])
+    assert r.status_code == 201
+    assert r.json['updated'] == 1
+    assert r.json['results'] == [
+        {'row': 1, 'status': 'accepted', 'id': 'addr-1', 'updated': True},
+        {'row': 2, 'status': 'rejected', 'reason': 'duplicate_id'},
+    ]
+    assert addresses(app) == {'addr-1': 'yamada@example.com'}
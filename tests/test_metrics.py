@@ -0,0 +1,24 @@
+import time
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from backend.models import db
+
+
+def test_failed_query_does_not_skew_later_timings(app, monkeypatch):
+    metrics = app.extensions['metrics']
+    observed = []
+    monkeypatch.setattr(metrics, 'observe_query', lambda statement, seconds: observed.append(seconds))
+
+    with app.app_context():
+        with db.engine.connect() as conn:
+            with pytest.raises(OperationalError):
+                conn.exec_driver_sql('SELECT * FROM no_such_table')
+            assert 'query_started' not in conn.info
+            time.sleep(0.2)
+            conn.exec_driver_sql('SELECT 1')
+
+    # 失敗した文の開始時刻と組み合わせると0.2秒以上になる
+    assert observed
+    assert max(observed) < 0.1
@@ -23,6 +23,7 @@ export interface Group {
   group_name: string;
   memberIds: GroupMember[]; // List of members with recipient type and order
   customAttributes?: GroupAttribute[]; // e.g., { key: "現場名", value: "〇〇ビル新築工事" }
+  version?: number; // 更新のたびに増える版数（メンバーの部分更新で競合を検出する）
 }
 
 export interface GlobalVariable {